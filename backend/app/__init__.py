@@ -1,25 +1,23 @@
 import os
-import logging
-from config import Config
-from dotenv import load_dotenv
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_login import LoginManager
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from logging.handlers import RotatingFileHandler
+from app.startup import StartupTimer
+from app.sharding import ShardedSession, ShardMap
 
 
 # Find absolute path of the root of the backend directory
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
-# Load the .env file from that directory
-load_dotenv(os.path.join(basedir, '.env'))
+# Load the .env file from that directory (dotenv is only imported if there is one)
+if os.path.exists(os.path.join(basedir, '.env')):
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(basedir, '.env'))
+
+from config import Config  # Read after .env so its values are visible
 
 # Extension Initialization (Decoupled)
-db = SQLAlchemy()
-migrate = Migrate()
-login_manager = LoginManager()
+db = SQLAlchemy(session_options={'class_': ShardedSession})  # Routes per-user tables
 cors = CORS()
 jwt = JWTManager()
 
@@ -33,33 +31,60 @@ def create_app(config_class=Config):
     Returns:
         object: Fully configured Flask app instance.
     """
-    app = Flask(__name__)
-    app.config.from_object(config_class)  # Read & apply configs from config file
+    timer = StartupTimer()
+    with timer.step('config'):
+        app = Flask(__name__)
+        app.config.from_object(config_class)  # Read & apply configs from config file
+    app.extensions['startup_timer'] = timer
 
     # Connect extensions to the app using .init_app() to bind each extension to the app instance
-    db.init_app(app)
-    migrate.init_app(app, db)
-    login_manager.init_app(app)
-    cors.init_app(app, resources={r"/api/*": {"origins": "*"}})  # scope CORS to API routes
-    jwt.init_app(app)
+    with timer.step('sqlalchemy'):
+        db.init_app(app)
+        app.extensions['shards'] = ShardMap(app)
+        from app import stats, usage  # Register the flush hooks updating rollups and usage
+    if app.config['MIGRATIONS_ENABLED']:  # Alembic is heavy, servers can skip it
+        with timer.step('migrate'):
+            from flask_migrate import Migrate
+            Migrate(app, db)
+    if app.config['SESSION_LOGIN_ENABLED']:  # The API authenticates with JWTs
+        with timer.step('login_manager'):
+            from flask_login import LoginManager
+            LoginManager(app)
+    with timer.step('cors'):
+        cors.init_app(app, resources={r"/api/*": {"origins": "*"}})  # scope CORS to API routes
+    with timer.step('jwt'):
+        jwt.init_app(app)
+        from app.blocklist import init_blocklist
+        init_blocklist(app)
+
+    with timer.step('compression'):
+        from app.compression import init_compression
+        init_compression(app)
+
+    with timer.step('avatars'):
+        from app.avatars import init_avatars
+        init_avatars(app)
 
     # Register Blueprints (connection of routes.py file)
-    from app.api import bp as api_blueprint
-    app.register_blueprint(api_blueprint, url_prefix='/api')
+    with timer.step('api_blueprint'):
+        from app.api import bp as api_blueprint
+        app.register_blueprint(api_blueprint, url_prefix='/api')
+    with timer.step('cli_blueprint'):
+        from app.cli import bp as cli_blueprint
+        app.register_blueprint(cli_blueprint)
 
-    # Logging errors to file
+    # Logging errors and access records to file, off the request thread
     if not app.debug and not app.testing:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        file_handler = RotatingFileHandler('logs/notez.log', maxBytes=10240, backupCount=10)
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-
-        app.logger.setLevel(logging.INFO)
+        with timer.step('logging'):
+            from app.logs import init_logging
+            init_logging(app)
         app.logger.info('Notez API startup')
 
+    if app.config['DB_WARMUP_CONNECTIONS']:
+        with timer.step('db_warmup'):
+            from app.startup import warm_up
+            warm_up(app, app.config['DB_WARMUP_CONNECTIONS'])
+
     return app
 
 from app import models
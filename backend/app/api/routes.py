@@ -1,10 +1,15 @@
 from app import db
 from app.api import bp
-from app.forms import SignupForm
-from flask import request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import request, jsonify, current_app, stream_with_context
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 import sqlalchemy as sa
-from app.models import User, GenderEnum, Note
+import tarfile
+import zipfile
+from app.models import User, UserDirectory, GenderEnum, Note, NoteRevision
+from app.sharding import use_shard
+from app.chunks import append_content, iter_content, note_size, read_content, set_content
+from app.revisions import Appended, record_revision, reconstruct
+from app.usage import QuotaExceeded, check_quota, content_size, get_usage
 
 
 # ------ Authentication API Endpoints -------
@@ -19,21 +24,30 @@ def register():
         return jsonify({"error": "Bad Request",
                         "message": "Request body must be valid JSON"}), 400
     
-    # use form to validate incoming JSON data
+    # use form to validate incoming JSON data (WTForms is imported on first use)
     # `csrf_enabled=False` is important for an API
+    from app.forms import SignupForm
     form = SignupForm(data=data, csrf_enabled=False)
     
     if form.validate():
-        user = User(
-            first_name=form.first_name.data,
-            last_name=form.last_name.data,
-            username=form.username.data,
-            email=form.email.data,
-            gender=GenderEnum(form.gender.data)
-        )
-        user.set_password(form.password.data)
-        db.session.add(user)
-        db.session.commit()
+        # The directory allocates the global user id and picks the user's shard
+        entry = UserDirectory(username=form.username.data, email=form.email.data)
+        db.session.add(entry)
+        db.session.flush()
+        entry.shard = current_app.extensions['shards'].assign(entry.id)
+
+        with use_shard(entry.shard):
+            user = User(
+                id=entry.id,
+                first_name=form.first_name.data,
+                last_name=form.last_name.data,
+                username=form.username.data,
+                email=form.email.data,
+                gender=GenderEnum(form.gender.data)
+            )
+            user.set_password(form.password.data)
+            db.session.add(user)
+            db.session.commit()
         return jsonify({"message": "User created successfully"}), 201
     else:  # i.e. validation failed
         return jsonify({"error": "Validation Error", "message": form.errors}), 422
@@ -48,7 +62,12 @@ def login():
     if not data or not data.get('username') or not data.get('password'):
         return jsonify({'error': 'Missing username or password'}), 400
     
-    user = db.session.scalar(sa.select(User).where(User.username == data['username']))
+    entry = db.session.scalar(
+        sa.select(UserDirectory).where(UserDirectory.username == data['username']))
+    user = None
+    if entry is not None:
+        with use_shard(entry.shard):
+            user = db.session.get(User, entry.id)
 
     if user is None or not user.check_password(data['password']):
         return jsonify({'error': 'Invalid username or password'}), 401  # 401 Unauthorized
@@ -58,6 +77,18 @@ def login():
     return jsonify(access_token=access_token)
 
 
+@bp.route('/auth/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """Revokes the access token used for this request.
+    """
+    from app.blocklist import revoke_token
+
+    revoke_token(get_jwt(), int(get_jwt_identity()))
+    db.session.commit()
+    return jsonify({"message": "Logged out"})
+
+
 # ------ User Data API Endpoints -------
 
 @bp.route('/auth/me')
@@ -83,6 +114,40 @@ def get_me():
     return jsonify(user_data)
 
 
+@bp.route('/avatars/<style>/<seed>.svg', methods=['GET'])
+def get_avatar(style, seed):
+    """Renders an avatar as SVG. Public, since it is loaded by <img> tags.
+    Optional query parameters `gender`, `size` and `v` (the render version,
+    which makes the URL change with the output so responses are immutable).
+    """
+    from app.avatars import normalize
+    from app.compression import matching_etag
+
+    try:
+        params = normalize(style, seed, request.args.get('gender'),
+                           request.args.get('size', 128, type=int))
+    except ValueError as e:
+        return jsonify({'error': 'Not found', 'message': str(e)}), 404
+
+    svg, etag = current_app.extensions['avatars'].get(*params)
+    matched = matching_etag(etag)
+    response = current_app.response_class(
+        None if matched else svg, status=304 if matched else 200, mimetype='image/svg+xml')
+    response.set_etag(matched or etag)  # Strong: the bytes only depend on the URL
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/usage', methods=['GET'])
+@jwt_required()
+def get_my_usage():
+    """Returns the current user's plan, usage counters and quota limits.
+    """
+    return jsonify(get_usage(int(get_jwt_identity())))
+
+
 # ------ Notes API Endpoints --------
 
 @bp.route('/notes', methods=['POST'])
@@ -106,19 +171,27 @@ def create_note():
             "message": "A note must have either a title or content."
         }), 400
     
+    try:
+        check_quota(int(current_user_id), notes=1, note_bytes=content_size(content))
+    except QuotaExceeded as e:
+        return jsonify({"error": "Quota exceeded", "message": str(e)}), 403
+
     new_note = Note(
         title=title,
-        content=content,
         author=user,
         group_id=data.get('group_id')  # Optional group assignment
     )
     db.session.add(new_note)
+    set_content(new_note, content)  # Large content is stored in chunks
+    db.session.flush()  # Assigns the id the first revision points to
+    record_revision(new_note, content=content)
     db.session.commit()
 
     return jsonify({
         'id': new_note.id,
         'title': new_note.title,
-        'content': new_note.content,
+        'content': new_note.content if new_note.chunked_size is None else None,
+        'chunked': new_note.chunked_size is not None,
         'created_at': new_note.created_at.isoformat()
     }), 201
 
@@ -127,6 +200,8 @@ def create_note():
 @jwt_required()
 def get_notes():
     """Retrieves all notes for the currently authenticated user.
+    The content of large (`chunked`) notes is null: read it from
+    `/notes/<id>/content`.
     """
     current_user_id = get_jwt_identity()
 
@@ -138,7 +213,8 @@ def get_notes():
         {
             'id': note.id,
             'title': note.title,
-            'content': note.content,
+            'content': note.content if note.chunked_size is None else None,
+            'chunked': note.chunked_size is not None,
             'updated_at': note.updated_at.isoformat()
         }
         for note in notes_query
@@ -146,6 +222,374 @@ def get_notes():
 
     return jsonify(notes_list)
 
+
+@bp.route('/notes/<int:note_id>', methods=['PUT'])
+@jwt_required()
+def update_note(note_id):
+    """Updates the title, content or group of a note and records a revision.
+    """
+    current_user_id = get_jwt_identity()
+    note = db.session.scalar(
+        sa.select(Note).where(Note.id == note_id, Note.user_id == current_user_id))
+    if note is None:
+        return jsonify({'error': 'Note not found'}), 404
+
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    for field in ('title', 'content'):
+        if field in data and not isinstance(data[field], str):
+            return jsonify({
+                "error": "Validation Error",
+                "message": f"`{field}` must be a string."
+            }), 400
+
+    # Read before the note changes: the query would autoflush it, and the usage
+    # hook would count the new size before check_quota adds it again
+    usage = get_usage(int(current_user_id))
+    previous_title = note.title
+    previous_content = read_content(note) if 'content' in data else note.content
+    previous_size = note_size(note.content, note.chunked_size)
+    for field in ('title', 'group_id'):
+        if field in data:
+            setattr(note, field, data[field])
+    content_changed = 'content' in data and data['content'] != previous_content
+    if content_changed:
+        set_content(note, data['content'])
+
+    if not note.title and not note.content and note.chunked_size is None:
+        db.session.rollback()
+        return jsonify({
+            "error": "Validation Error",
+            "message": "A note must have either a title or content."
+        }), 400
+
+    try:
+        check_quota(int(current_user_id), usage=usage,
+                    note_bytes=note_size(note.content, note.chunked_size) - previous_size)
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({"error": "Quota exceeded", "message": str(e)}), 403
+
+    if content_changed:
+        record_revision(note, previous_content or '', content=data['content'])
+    elif note.title != previous_title:  # The content needn't be read
+        record_revision(note, content=Appended(''))
+    db.session.commit()
+
+    return jsonify({
+        'id': note.id,
+        'title': note.title,
+        'content': note.content if note.chunked_size is None else None,
+        'chunked': note.chunked_size is not None,
+        'updated_at': note.updated_at.isoformat()
+    })
+
+
+@bp.route('/notes/<int:note_id>/content', methods=['GET'])
+@jwt_required()
+def get_note_content(note_id):
+    """Returns a note's content as UTF-8 text, streamed chunk by chunk for
+    large notes. Supports single byte `Range` requests (with a strong
+    `If-Range`), so only the chunks overlapping the range are read, and
+    `If-None-Match` (304 without reading any chunk).
+    """
+    from werkzeug.datastructures import ContentRange
+    from app.compression import matching_etag
+
+    current_user_id = get_jwt_identity()
+    note = db.session.execute(
+        sa.select(Note.id, Note.content, Note.chunked_size, Note.updated_at)
+        .where(Note.id == note_id, Note.user_id == current_user_id)).first()
+    if note is None:
+        return jsonify({'error': 'Note not found'}), 404
+
+    length = note_size(note.content, note.chunked_size)
+    etag = f'{note.id}-{length}-{note.updated_at.strftime("%Y%m%d%H%M%S%f")}'
+    matched = matching_etag(etag)
+    if matched:  # Unchanged, don't read the chunks
+        response = current_app.response_class(status=304)
+        response.accept_ranges = 'bytes'
+        response.set_etag(matched)
+        return response
+    start, stop, status = 0, length, 200
+    byte_range = request.range
+    if_range = request.headers.get('If-Range', '')
+    if (byte_range is not None and len(byte_range.ranges) == 1 and not if_range.startswith('W/')
+            and request.if_range.date is None and request.if_range.etag in (None, etag)):
+        bounds = byte_range.range_for_length(length)
+        if bounds is None:
+            response = jsonify({'error': 'Range not satisfiable'})
+            response.status_code = 416
+            response.content_range = ContentRange('bytes', None, None, length)
+            return response
+        (start, stop), status = bounds, 206
+
+    response = current_app.response_class(
+        stream_with_context(iter_content(note, start, stop)), status=status,
+        mimetype='text/plain')
+    response.content_length = stop - start
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    if status == 206:
+        response.content_range = ContentRange('bytes', start, stop, length)
+    return response
+
+
+@bp.route('/notes/<int:note_id>/content', methods=['POST'])
+@jwt_required()
+def append_note_content(note_id):
+    """Appends the request body (UTF-8 text) to a note's content and records
+    a revision. Only the last chunk of a large note is rewritten.
+    """
+    current_user_id = get_jwt_identity()
+    note = db.session.scalar(
+        sa.select(Note).where(Note.id == note_id, Note.user_id == current_user_id))
+    if note is None:
+        return jsonify({'error': 'Note not found'}), 404
+
+    try:
+        text = request.get_data().decode('utf-8')
+    except UnicodeDecodeError:
+        return jsonify({"error": "Request body must be UTF-8 text"}), 400
+
+    try:
+        check_quota(int(current_user_id), note_bytes=content_size(text))
+    except QuotaExceeded as e:
+        return jsonify({"error": "Quota exceeded", "message": str(e)}), 403
+
+    append_content(note, text)
+    record_revision(note, content=Appended(text))
+    db.session.commit()
+
+    return jsonify({
+        'id': note.id,
+        'size': note_size(note.content, note.chunked_size),
+        'chunked': note.chunked_size is not None,
+        'updated_at': note.updated_at.isoformat()
+    })
+
+
+@bp.route('/notes/import', methods=['POST'])
+@jwt_required()
+def import_notes():
+    """Imports a zip or tar archive of Markdown files as notes.
+    Expects a multipart upload with the archive in the `archive` field and an
+    optional `start` (files already imported, to resume a failed import).
+    """
+    from werkzeug.exceptions import RequestEntityTooLarge
+    from app.importer import ArchiveTooLarge, import_archive
+
+    current_user_id = get_jwt_identity()
+    try:
+        archive = request.files.get('archive')
+    except RequestEntityTooLarge:  # Over MAX_CONTENT_LENGTH
+        return jsonify({"error": "Archive too large",
+                        "message": "The upload exceeds the maximum request size."}), 413
+    if archive is None:
+        return jsonify({"error": "Missing `archive` file upload"}), 400
+
+    start = request.form.get('start', 0, type=int)
+    position = {'committed': start}
+    try:
+        result = import_archive(
+            archive.stream, int(current_user_id), start=start,
+            chunk_size=current_app.config['IMPORT_CHUNK_SIZE'],
+            workers=current_app.config['IMPORT_WORKERS'],
+            progress=lambda done: position.update(committed=done))
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        db.session.rollback()
+        return jsonify({
+            "error": "Invalid archive",
+            "message": str(e),
+            "position": position['committed']  # Resume from here
+        }), 400
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({
+            "error": "Quota exceeded",
+            "message": str(e),
+            "position": position['committed']
+        }), 403
+    except ArchiveTooLarge as e:
+        db.session.rollback()
+        return jsonify({
+            "error": "Archive too large",
+            "message": str(e),
+            "position": position['committed']
+        }), 413
+
+    return jsonify(result), 201
+
+
+@bp.route('/notes/duplicates', methods=['GET'])
+@jwt_required()
+def get_duplicate_notes():
+    """Groups the current user's near-identical notes.
+    Optional `threshold` query parameter: minimum similarity (0.5 to 1,
+    defaults to DEDUP_THRESHOLD).
+    """
+    from app.dedup import find_duplicates
+
+    current_user_id = int(get_jwt_identity())
+    threshold = request.args.get('threshold', current_app.config['DEDUP_THRESHOLD'], type=float)
+    result = find_duplicates(current_user_id, min(max(threshold, 0.5), 1.0))
+
+    note_ids = [note_id for _, group in result['groups'] for note_id in group]
+    notes = {note.id: note for note in db.session.execute(
+        sa.select(Note.id, Note.title, Note.updated_at).where(Note.id.in_(note_ids)))}
+    return jsonify({
+        'scanned': result['scanned'],
+        'groups': [
+            {
+                'similarity': similarity,
+                'notes': [{'id': note_id, 'title': notes[note_id].title,
+                           'updated_at': notes[note_id].updated_at.isoformat()}
+                          for note_id in group]
+            }
+            for similarity, group in result['groups']
+        ]
+    })
+
+
+# ------ Note Revisions API Endpoints --------
+
+@bp.route('/notes/<int:note_id>/revisions', methods=['GET'])
+@jwt_required()
+def get_note_revisions(note_id):
+    """Lists the revisions of a note, newest first (without their content).
+    """
+    current_user_id = get_jwt_identity()
+    note_exists = db.session.scalar(
+        sa.select(Note.id).where(Note.id == note_id, Note.user_id == current_user_id))
+    if note_exists is None:
+        return jsonify({'error': 'Note not found'}), 404
+
+    revisions = db.session.execute(
+        sa.select(NoteRevision.number, NoteRevision.title, NoteRevision.is_snapshot,
+                  NoteRevision.created_at)
+        .where(NoteRevision.note_id == note_id)
+        .order_by(NoteRevision.number.desc())
+    ).all()
+
+    return jsonify([
+        {
+            'number': revision.number,
+            'title': revision.title,
+            'is_snapshot': revision.is_snapshot,
+            'created_at': revision.created_at.isoformat()
+        }
+        for revision in revisions
+    ])
+
+
+@bp.route('/notes/<int:note_id>/revisions/<int:number>', methods=['GET'])
+@jwt_required()
+def get_note_revision(note_id, number):
+    """Returns a note's title and content as of revision `number`.
+    """
+    current_user_id = get_jwt_identity()
+    note_exists = db.session.scalar(
+        sa.select(Note.id).where(Note.id == note_id, Note.user_id == current_user_id))
+    found = reconstruct(note_id, number) if note_exists is not None else None
+    if found is None:
+        return jsonify({'error': 'Revision not found'}), 404
+
+    revision, content = found
+    return jsonify({
+        'number': revision.number,
+        'title': revision.title,
+        'content': content,
+        'created_at': revision.created_at.isoformat()
+    })
+
+
+# ------ Tags API Endpoints --------
+
+@bp.route('/tags/apply', methods=['POST'])
+@jwt_required()
+def apply_tags():
+    """Adds and/or removes tags by name on many notes and to-do lists at once.
+    Expects JSON with `add` and/or `remove` (tag names) and `note_ids` and/or
+    `todolist_ids`. Items not owned by the user are ignored.
+    """
+    from app.bulk import apply_tags as apply_tag_changes
+
+    current_user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+
+    lists = {key: data.get(key) or [] for key in ('add', 'remove', 'note_ids', 'todolist_ids')}
+    if not all(isinstance(value, list) for value in lists.values()) \
+            or not all(isinstance(name, str) for name in lists['add'] + lists['remove']) \
+            or not all(type(item_id) is int  # Not bool
+                       for item_id in lists['note_ids'] + lists['todolist_ids']):
+        return jsonify({
+            "error": "Validation Error",
+            "message": "`add`/`remove` must be lists of tag names and "
+                       "`note_ids`/`todolist_ids` lists of ids."
+        }), 400
+
+    result = apply_tag_changes(current_user_id, **lists)
+    db.session.commit()
+    return jsonify(result)
+
+
+# ------ Sync API Endpoints --------
+
+@bp.route('/sync/push', methods=['POST'])
+@jwt_required()
+def sync_push():
+    """Applies a batch of edits made offline, in order, in one transaction.
+    Expects JSON with `operations`: objects with `key` (idempotency key),
+    `op`, `type`, `id`, `updated_at` and `data` (see `app.sync`). Returns a
+    result per operation; retried keys get their first result back.
+    """
+    from app.sync import apply_batch
+
+    current_user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    limit = current_app.config['SYNC_MAX_OPERATIONS']
+    if not isinstance(operations, list) or len(operations) > limit:
+        return jsonify({
+            "error": "Validation Error",
+            "message": f"`operations` must be a list of at most {limit} operations."
+        }), 400
+
+    for attempt in range(2):
+        try:
+            results = apply_batch(current_user_id, operations)
+            db.session.commit()
+            break
+        except sa.exc.IntegrityError:
+            # A concurrent push stored some of the same keys (or tag names) first
+            db.session.rollback()
+            if attempt:
+                return jsonify({"error": "Conflict",
+                                "message": "The batch conflicts with a concurrent push."}), 409
+        except QuotaExceeded as e:
+            db.session.rollback()
+            return jsonify({"error": "Quota exceeded", "message": str(e)}), 403
+    return jsonify({'results': results})
+
+
+# ------ Analytics API Endpoints --------
+
+@bp.route('/stats', methods=['GET'])
+@jwt_required()
+def get_stats():
+    """Daily and weekly note and to-do activity of the current user.
+    Optional query parameters `days` (default 30) and `weeks` (default 12).
+    """
+    from app.stats import get_stats as read_stats
+
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    weeks = min(max(request.args.get('weeks', 12, type=int), 1), 104)
+    return jsonify(read_stats(int(get_jwt_identity()), days=days, weeks=weeks))
+
+
 # @bp.route('/hello')
 # def hello():
 #     return jsonify({"message": "Hello from the otherside!!!!!!!"})
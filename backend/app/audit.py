@@ -0,0 +1,191 @@
+"""Query-plan audit of every statement the API issues (`flask db-audit`).
+
+The catalog is captured by calling every `/api` route once through a test
+client on a scratch in-memory app, recording the SQL statements each route
+executes. Each captured SELECT, UPDATE, DELETE and INSERT ... SELECT is then
+explained on the configured databases (so their real indexes are used):
+`EXPLAIN QUERY PLAN` on SQLite, `EXPLAIN` on PostgreSQL (with sequential
+scans disabled, so small tables still show whether an index could be used)
+and MySQL. A plan that reads a whole table is a failure.
+"""
+import io
+import re
+import zipfile
+import sqlalchemy as sa
+from flask import current_app, has_request_context, request
+from app import db
+from app.sharding import GLOBAL_TABLES, bind_key
+
+_SQLITE_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW|\()(\S+)(?!.*\bUSING\b)')
+_POSTGRES_SCAN = re.compile(r'Seq Scan on (\S+)')
+
+
+def exercise_api(client):
+    """Calls every `/api` route the way a client session would.
+
+    Returns:
+        list: `(method, path, status)` of the calls that failed.
+    """
+    failed = []
+
+    def call(method, path, **kwargs):
+        response = client.open(path, method=method, **kwargs)
+        if response.status_code >= 400:
+            failed.append((method, path, response.status_code))
+        return response
+
+    credentials = {'username': 'audit', 'password': 'Audit123!'}
+    call('POST', '/api/auth/register', json={
+        **credentials, 'password2': credentials['password'], 'email': 'audit@example.com',
+        'first_name': 'Audit', 'last_name': 'User', 'gender': 'other'})
+    token = call('POST', '/api/auth/login', json=credentials).json['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    avatar = call('GET', '/api/auth/me', headers=headers).json['avatar']
+    call('GET', avatar[avatar.index('/api/'):])
+    call('GET', '/api/usage', headers=headers)
+    note_id = call('POST', '/api/notes', headers=headers,
+                   json={'title': 'Audit', 'content': 'First draft'}).json['id']
+    call('PUT', f'/api/notes/{note_id}', headers=headers, json={'content': 'Second draft'})
+    call('POST', f'/api/notes/{note_id}/content', headers=headers, data='\nAppended')
+    large_id = call('POST', '/api/notes', headers=headers,
+                    json={'title': 'Large', 'content': 'Large note\n' * 200}).json['id']
+    call('POST', f'/api/notes/{large_id}/content', headers=headers, data='More\n')
+    call('GET', f'/api/notes/{large_id}/content', headers={**headers, 'Range': 'bytes=100-199'})
+    call('GET', '/api/notes', headers=headers)
+    call('POST', '/api/notes', headers=headers, json={'title': 'Copy', 'content': 'Second draft'})
+    call('GET', '/api/notes/duplicates', headers=headers)
+    call('GET', f'/api/notes/{note_id}/revisions', headers=headers)
+    call('GET', f'/api/notes/{note_id}/revisions/1', headers=headers)
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr('folder/imported.md', '---\ntags: [audit]\n---\n# Imported\nBody')
+    archive.seek(0)
+    call('POST', '/api/notes/import', headers=headers,
+         data={'archive': (archive, 'notes.zip')}, content_type='multipart/form-data')
+
+    call('POST', '/api/tags/apply', headers=headers, json={
+        'add': ['audit', 'new'], 'remove': ['old'], 'note_ids': [note_id], 'todolist_ids': [1]})
+    updated_at = next(note['updated_at'] for note in call('GET', '/api/notes', headers=headers).json
+                      if note['id'] == note_id)
+    operations = [
+        {'key': 'audit-1', 'op': 'create', 'type': 'todolist', 'data': {'title': 'Offline'}},
+        {'key': 'audit-2', 'op': 'create', 'type': 'item',
+         'data': {'description': 'Sync', 'todolist_id': 'audit-1'}},
+        {'key': 'audit-3', 'op': 'update', 'type': 'note', 'id': note_id,
+         'updated_at': updated_at, 'data': {'content': 'Edited offline'}},
+        {'key': 'audit-4', 'op': 'create', 'type': 'tag', 'data': {'name': 'offline'}},
+        {'key': 'audit-5', 'op': 'delete', 'type': 'tag', 'id': 'audit-4'},
+        {'key': 'audit-6', 'op': 'delete', 'type': 'note', 'id': large_id},
+    ]
+    call('POST', '/api/sync/push', headers=headers, json={'operations': operations})
+    call('POST', '/api/sync/push', headers=headers, json={'operations': operations})  # Replayed
+    call('GET', '/api/stats', headers=headers)
+    call('POST', '/api/auth/logout', headers=headers)
+    return failed
+
+
+def capture_catalog(config_class):
+    """Runs `exercise_api` on a scratch in-memory app and records its SQL.
+
+    Returns:
+        tuple: `(catalog, missing, failed)`: catalog maps each route to its
+            `(statement, parameters)` list, `missing` lists the `/api`
+            routes `exercise_api` didn't call and `failed` the calls that
+            errored.
+    """
+    from app import create_app
+
+    class AuditConfig(config_class):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        SQLALCHEMY_BINDS = {}
+        SHARDS = ['default']
+        MIGRATIONS_ENABLED = False
+        DB_WARMUP_CONNECTIONS = 0
+        LARGE_NOTE_THRESHOLD = 1024  # So the chunked note paths are captured too
+
+    scratch = create_app(AuditConfig)
+    catalog, seen, called = {}, set(), set()
+
+    @scratch.before_request
+    def track_route():
+        if request.url_rule is not None:
+            called.add(f'{request.method} {request.url_rule.rule}')
+
+    def record(conn, clauseelement, multiparams, params, execution_options):
+        if not has_request_context() or request.url_rule is None:
+            return
+        if not isinstance(clauseelement, (sa.Select, sa.Update, sa.Delete, sa.Insert)):
+            return
+        if isinstance(clauseelement, sa.Insert) and clauseelement.select is None:
+            return  # Plain INSERT ... VALUES reads nothing
+        route = f'{request.method} {request.url_rule.rule}'
+        parameters = multiparams[0] if multiparams else params
+        key = (route, str(clauseelement.compile(dialect=conn.dialect)))
+        if key not in seen:
+            seen.add(key)
+            catalog.setdefault(route, []).append((clauseelement, dict(parameters or {})))
+
+    with scratch.app_context():
+        engine = db.engine
+        db.metadata.create_all(engine)  # Not db.create_all(): it includes other apps' binds
+        sa.event.listen(engine, 'before_execute', record)
+        try:
+            failed = exercise_api(scratch.test_client())
+        finally:
+            sa.event.remove(engine, 'before_execute', record)
+        db.session.remove()
+        routes = {f'{method} {rule.rule}' for rule in scratch.url_map.iter_rules()
+                  if rule.rule.startswith('/api/')
+                  for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    return catalog, sorted(routes - called), failed
+
+
+def _full_scans(conn, statement, parameters):
+    """Names of the tables read in full by the plan of `statement`."""
+    dialect = conn.dialect.name
+    compiled = statement.compile(  # ORM flushes render UPDATE/DELETE from the parameter keys
+        dialect=conn.dialect, column_keys=list(parameters) if parameters else None,
+        compile_kwargs={'render_postcompile': True})
+    values = compiled.construct_params(parameters or None)
+    if compiled.positional:
+        values = tuple(values[name] for name in compiled.positiontup)
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    cursor = conn.exec_driver_sql(prefix + compiled.string, values).cursor
+    names = [column[0] for column in cursor.description]
+    rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+    if dialect == 'sqlite':
+        return [m.group(1) for m in (_SQLITE_SCAN.match(row['detail']) for row in rows) if m]
+    if dialect == 'postgresql':
+        return [m.group(1) for m in (_POSTGRES_SCAN.search(row['QUERY PLAN']) for row in rows) if m]
+    if dialect in ('mysql', 'mariadb'):
+        return [row['table'] for row in rows if row['type'] == 'ALL']
+    raise NotImplementedError(f'db-audit is not supported on {dialect}')
+
+
+def audit_catalog(catalog):
+    """Explains every captured statement on the databases that hold its tables.
+
+    Returns:
+        list: `(route, database, tables scanned, SQL)` of every full scan.
+    """
+    shard_names = current_app.extensions['shards'].names
+    problems = []
+    for route, statements in sorted(catalog.items()):
+        for statement, parameters in statements:
+            tables = {table.name for table in sa.sql.util.find_tables(
+                statement, include_crud=True, include_joins=True)}
+            databases = ['default'] if tables <= GLOBAL_TABLES else shard_names
+            for database in databases:
+                engine = db.engines[bind_key(database)]
+                with engine.begin() as conn:
+                    if conn.dialect.name == 'postgresql':
+                        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+                    scanned = _full_scans(conn, statement, parameters)
+                    conn.rollback()
+                if scanned:
+                    sql = str(statement.compile(dialect=engine.dialect))
+                    problems.append((route, database, scanned, sql))
+    return problems
@@ -0,0 +1,220 @@
+"""Locally rendered avatar SVGs, so profiles don't depend on a third party.
+
+Two styles mirror the DiceBear variants `User.avatar` used to link to: a
+face (`adventurer`) whose features come from a hash of the seed, and
+`initials` on a background picked from a fixed palette. Rendering is
+deterministic, so an avatar is identified by its parameters alone: the
+SVG is stored on disk under the SHA-256 of `RENDER_VERSION` and the
+parameters, and the hottest ones are also kept in an in-process LRU.
+The route is public and any seed renders, so the disk store is capped
+too: past `AVATAR_DISK_CACHE_SIZE` files, the least recently used go.
+Bump `RENDER_VERSION` whenever the output changes; it is part of the URL,
+which is why responses can be cached as immutable.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+RENDER_VERSION = 1
+STYLES = ('adventurer', 'initials')
+GENDERS = ('male', 'female')
+MIN_SIZE, MAX_SIZE = 16, 512
+
+logger = logging.getLogger('notez.avatars')
+
+_SKIN = ('#f2d3b1', '#ecad80', '#d08b5b', '#ae5d29', '#9e5622', '#763900', '#f9d9c4')
+_HAIR = ('#0e0e0e', '#562306', '#6a4e35', '#b58143', '#d6b370', '#ac6511', '#cb6820', '#796a45',
+         '#afafaf')
+_INITIALS_BACKGROUNDS = ('#00897b', '#00acc1', '#26a69a')
+
+
+def _face(seed, gender):
+    digest = hashlib.sha256(f'adventurer:{seed}'.encode()).digest()
+    skin = _SKIN[digest[0] % len(_SKIN)]
+    hair = _HAIR[digest[1] % len(_HAIR)]
+    eye_gap = 9 + digest[2] % 4
+    mouth_curve = 3 + digest[3] % 5
+    female = gender == 'female' or (gender is None and digest[4] % 2)
+
+    parts = []
+    if female:  # Long hair behind the face
+        parts.append(f'<path d="M12 34C10 14 20 8 32 8s22 6 20 26v22H12z" fill="{hair}"/>')
+    parts.append(f'<ellipse cx="32" cy="34" rx="16" ry="18" fill="{skin}"/>')
+    if female:
+        parts.append(f'<path d="M16 30C16 16 24 12 32 12s16 4 16 18c-6-6-10-10-16-10s-10 4-16 10z" '
+                     f'fill="{hair}"/>')
+    else:
+        spikes = 3 + digest[5] % 4
+        step = 32 / spikes
+        points = ''.join(f'L{16 + step * (i + 0.5):.1f} {13 - digest[6 + i] % 4}L{16 + step * i:.1f} 18'
+                         for i in reversed(range(spikes)))  # Right to left, back to x=16
+        parts.append(f'<path d="M16 28C15 18 22 13 32 13s17 5 16 15L48 18{points}z" '
+                     f'fill="{hair}"/>')
+    for x in (32 - eye_gap / 2 - 2, 32 + eye_gap / 2 + 2):
+        parts.append(f'<circle cx="{x:.1f}" cy="33" r="2" fill="#1f1f1f"/>')
+    parts.append(f'<path d="M26 42q6 {mouth_curve} 12 0" stroke="#8c3a2b" stroke-width="2" '
+                 f'fill="none" stroke-linecap="round"/>')
+    if digest[10] % 5 == 0:  # Glasses
+        parts.append('<g fill="none" stroke="#3b3b3b" stroke-width="1.5">'
+                     f'<circle cx="{32 - eye_gap / 2 - 2:.1f}" cy="33" r="5"/>'
+                     f'<circle cx="{32 + eye_gap / 2 + 2:.1f}" cy="33" r="5"/>'
+                     f'<path d="M{32 - eye_gap / 2 + 3:.1f} 33h{eye_gap - 2:.1f}"/></g>')
+    return ''.join(parts)
+
+
+def _initials(seed):
+    digest = hashlib.sha256(f'initials:{seed}'.encode()).digest()
+    background = _INITIALS_BACKGROUNDS[digest[0] % len(_INITIALS_BACKGROUNDS)]
+    return (f'<rect width="64" height="64" fill="{background}"/>'
+            '<text x="50%" y="50%" dy=".35em" text-anchor="middle" fill="#ffffff" '
+            'font-family="Arial, Helvetica, sans-serif" font-size="26" font-weight="600">'
+            f'{escape(seed[:2].upper())}</text>')
+
+
+def render(style, seed, gender=None, size=128):
+    """Renders an avatar as SVG bytes.
+
+    Args:
+        style (str): `adventurer` or `initials` (whose seed is the initials).
+        seed (str): Value the features are derived from.
+        gender (str, optional): `male`, `female` or `None` (adventurer only).
+        size (int, optional): Width and height in pixels.
+    """
+    body = _initials(seed) if style == 'initials' else _face(seed, gender)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 64 64" '
+            f'width="{size}" height="{size}">{body}</svg>').encode()
+
+
+def normalize(style, seed, gender=None, size=128):
+    """Validates and canonicalizes avatar parameters.
+
+    Returns:
+        tuple: `(style, seed, gender, size)`; raises `ValueError` if invalid.
+    """
+    if style not in STYLES:
+        raise ValueError(f'Unknown avatar style {style!r}')
+    seed = seed.strip()[:64]
+    if not seed:
+        raise ValueError('Empty avatar seed')
+    if style == 'initials' or gender not in GENDERS:
+        gender = None
+    return style, seed, gender, min(max(int(size), MIN_SIZE), MAX_SIZE)
+
+
+class AvatarStore:
+    """Avatar SVGs cached in an LRU of `memory_size` entries over a directory.
+
+    Files are named after the SHA-256 of the render parameters and written
+    atomically, so several processes can share the directory. Reading a
+    file touches its mtime; when a process has seen more than `disk_size`
+    files, it deletes the oldest down to `PRUNE_TO` of that (0 keeps
+    avatars in memory only).
+    """
+
+    PRUNE_TO = 0.9
+
+    def __init__(self, directory, memory_size, disk_size):
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory = OrderedDict()  # Key: (svg, etag)
+        self._lock = threading.Lock()
+        self._files = None  # Files on disk as of the last count, plus those written since
+        self._prune_lock = threading.Lock()
+        self._write_failed = False  # Logged once
+
+    @staticmethod
+    def key(style, seed, gender, size):
+        params = f'{RENDER_VERSION}\0{style}\0{seed}\0{gender or ""}\0{size}'
+        return hashlib.sha256(params.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.svg')
+
+    def get(self, style, seed, gender=None, size=128):
+        """Returns `(svg bytes, strong ETag)` of an avatar (normalized parameters)."""
+        key = self.key(style, seed, gender, size)
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+                return cached
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                svg = f.read()
+            os.utime(path)  # Recently used, pruned last
+        except OSError:  # Not stored yet, or the directory can't be read
+            svg = render(style, seed, gender, size)
+            if self.disk_size:
+                try:
+                    self._write(path, svg)
+                except OSError as e:  # Served from memory only
+                    if not self._write_failed:
+                        self._write_failed = True
+                        logger.warning('Avatar cache %s is not writable: %s', self.directory, e)
+
+        cached = (svg, hashlib.sha256(svg).hexdigest()[:32])
+        with self._lock:
+            self._memory[key] = cached
+            if len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+        return cached
+
+    def _write(self, path, svg):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(svg)
+        os.replace(temp, path)
+
+        with self._lock:
+            if self._files is not None:
+                self._files += 1
+            full = self._files is None or self._files > self.disk_size
+        if full and self._prune_lock.acquire(blocking=False):  # Else another thread prunes
+            try:
+                self._files = self.prune()
+            finally:
+                self._prune_lock.release()
+
+    def _scan(self):
+        """`(mtime, path)` of every stored file."""
+        files = []
+        for bucket in os.scandir(self.directory):
+            if bucket.is_dir():
+                for entry in os.scandir(bucket.path):
+                    if entry.name.endswith('.svg'):
+                        try:
+                            files.append((entry.stat().st_mtime, entry.path))
+                        except FileNotFoundError:  # Pruned by another process
+                            pass
+        return files
+
+    def prune(self):
+        """Deletes the least recently used files if there are over `disk_size`.
+
+        Returns:
+            int: Files left.
+        """
+        files = self._scan()
+        if len(files) <= self.disk_size:
+            return len(files)
+        files.sort()
+        excess = len(files) - int(self.disk_size * self.PRUNE_TO)
+        for _, path in files[:excess]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(files) - excess
+
+
+def init_avatars(app):
+    app.extensions['avatars'] = AvatarStore(
+        app.config['AVATAR_CACHE_DIR'], app.config['AVATAR_MEMORY_CACHE_SIZE'],
+        app.config['AVATAR_DISK_CACHE_SIZE'])
@@ -0,0 +1,97 @@
+"""Revoked JWT checks without a database query per request.
+
+Revocations are stored in `revoked_token`. Each process keeps the unexpired
+JTIs in a dict and, at most every `JWT_BLOCKLIST_REFRESH_SECONDS`, fetches
+only the rows revoked since its last refresh. Checking a token is a dict
+lookup; tokens revoked by another process are rejected here after at most
+one refresh interval.
+"""
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from flask import current_app
+from app import db, jwt
+from app.models import RevokedToken
+
+
+def _timestamp(value):
+    if value.tzinfo is None:  # SQLite drops the timezone, values are UTC
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class TokenBlocklist:
+    """Unexpired revoked JTIs mapped to their expiry (epoch seconds)."""
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._revoked = {}
+        self._since = None  # `revoked_at` lower bound of the next refresh
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        return jti in self._revoked
+
+    def add(self, jti, expires):
+        self._revoked[jti] = expires
+
+    def refresh(self):
+        """Loads revocations since the last refresh and drops expired JTIs."""
+        if not self._lock.acquire(blocking=False):
+            return  # Another thread is refreshing, use the current set meanwhile
+        try:
+            started = datetime.now(timezone.utc)
+            query = sa.select(RevokedToken.jti, RevokedToken.expires_at) \
+                .where(RevokedToken.expires_at > started)
+            if self._since is not None:
+                query = query.where(RevokedToken.revoked_at >= self._since)
+            # Own connection: never touches the request's session/transaction
+            with db.engine.connect() as conn:
+                rows = conn.execute(query).all()
+
+            now = started.timestamp()
+            revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            revoked.update((jti, _timestamp(expires_at)) for jti, expires_at in rows)
+            self._revoked = revoked  # Swapped whole, readers never see a partial dict
+
+            # Overlap so rows from transactions that committed late are still seen
+            self._since = started - timedelta(seconds=self.refresh_seconds + 30)
+            self._next_refresh = time.monotonic() + self.refresh_seconds
+        finally:
+            self._lock.release()
+
+
+def revoke_token(decoded, user_id):
+    """Revokes a decoded JWT everywhere (the caller commits)."""
+    expires = decoded['exp']
+    db.session.add(RevokedToken(
+        jti=decoded['jti'],
+        user_id=user_id,
+        expires_at=datetime.fromtimestamp(expires, timezone.utc)))
+    current_app.extensions['token_blocklist'].add(decoded['jti'], expires)
+
+
+def prune_revoked_tokens():
+    """Deletes revocations of tokens that have expired anyway.
+
+    Returns:
+        int: Number of rows deleted.
+    """
+    deleted = db.session.execute(
+        sa.delete(RevokedToken).where(RevokedToken.expires_at <= datetime.now(timezone.utc))
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    return current_app.extensions['token_blocklist'].is_revoked(jwt_payload['jti'])
+
+
+def init_blocklist(app):
+    app.extensions['token_blocklist'] = TokenBlocklist(app.config['JWT_BLOCKLIST_REFRESH_SECONDS'])
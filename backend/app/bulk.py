@@ -0,0 +1,180 @@
+"""Multi-row SQL helpers shared by the bulk endpoints and CLI jobs.
+"""
+from collections import Counter
+import sqlalchemy as sa
+from app import db
+from app.models import Tag, Note, ToDoList, note_tag_association, todolist_tag_association
+from app.sharding import assign_ids
+
+
+def insert_ignore(table, dialect=None):
+    """`INSERT` that skips rows violating a unique constraint.
+
+    Args:
+        table: Table or mapped class to insert into.
+        dialect (str, optional): Dialect name; defaults to the one `db.session`
+            uses for `table`.
+
+    Returns:
+        Insert: Statement to execute with a list of parameter dicts.
+    """
+    if dialect is None:
+        target = table if isinstance(table, sa.Table) else sa.inspect(table).local_table
+        dialect = db.session.get_bind(clause=target).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect in ('mysql', 'mariadb'):
+        return sa.insert(table).prefix_with('IGNORE')
+    else:
+        raise NotImplementedError(f'insert_ignore is not supported on {dialect}')
+    return insert(table).on_conflict_do_nothing()
+
+
+def upsert_add(table, keys, counters, dialect=None):
+    """`INSERT` that adds its counters to those of an existing row instead.
+
+    Args:
+        table: Table to insert into.
+        keys (list): Names of the primary key columns.
+        counters (list): Names of the columns to add up on conflict.
+        dialect (str, optional): Dialect name; defaults to the one `db.session`
+            uses for `table`.
+
+    Returns:
+        Insert: Statement to execute with a list of parameter dicts.
+    """
+    if dialect is None:
+        dialect = db.session.get_bind(clause=table).dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        return stmt.on_duplicate_key_update(
+            {name: table.c[name] + stmt.inserted[name] for name in counters})
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f'upsert_add is not supported on {dialect}')
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: table.c[name] + stmt.excluded[name] for name in counters})
+
+
+def upsert_replace(table, keys, columns, dialect=None):
+    """`INSERT` that overwrites `columns` of an existing row instead.
+
+    Args:
+        table: Table to insert into.
+        keys (list): Names of the primary key columns.
+        columns (list): Names of the columns to overwrite on conflict.
+        dialect (str, optional): Dialect name; defaults to the one `db.session`
+            uses for `table`.
+
+    Returns:
+        Insert: Statement to execute with a list of parameter dicts.
+    """
+    if dialect is None:
+        dialect = db.session.get_bind(clause=table).dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        return stmt.on_duplicate_key_update({name: stmt.inserted[name] for name in columns})
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f'upsert_replace is not supported on {dialect}')
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=keys, set_={name: stmt.excluded[name] for name in columns})
+
+
+def normalize_tag_name(name):
+    """Tag names are stored stripped and lowercase."""
+    return str(name).strip().lower()[:100]
+
+
+def upsert_tags(names, user_id=None):
+    """Makes sure a tag exists for every name, in at most three statements.
+
+    New tags are created with `user_id` as their creator; existing ones (which
+    may be global or another user's, names are unique) are left alone.
+
+    Returns:
+        dict: Tag id by name for every requested name.
+    """
+    names = {normalize_tag_name(name) for name in names} - {''}
+    if not names:
+        return {}
+    tag_ids = dict(db.session.execute(
+        sa.select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+    missing = names - set(tag_ids)
+    if missing:
+        db.session.execute(insert_ignore(Tag), assign_ids(
+            Tag.__table__, [{'name': name, 'user_id': user_id} for name in missing]))
+        tag_ids.update(db.session.execute(
+            sa.select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+        if user_id is not None:
+            from app.usage import add_usage  # app.usage imports this module
+            # May count a tag another request created meanwhile; reconciliation fixes that
+            add_usage({user_id: Counter(tags=len(missing))})
+    return tag_ids
+
+
+def _retag(association, owner_column, parent, user_id, ids, add, remove):
+    """Adds and removes tag links between `ids` (owned by `user_id`) and tags.
+
+    One `INSERT ... SELECT ... ON CONFLICT DO NOTHING` adds every missing link
+    and one `DELETE ... WHERE IN` drops the unwanted ones; ids that aren't the
+    user's are filtered out inside the statements.
+
+    Returns:
+        tuple: `(links added, links removed)`.
+    """
+    added = removed = 0
+    if add:
+        rows = (
+            sa.select(parent.id, Tag.id)
+            .join(Tag, sa.true())  # Every owned item with every tag to add
+            .where(parent.id.in_(ids), parent.user_id == user_id, Tag.name.in_(add))
+        )
+        added = db.session.execute(
+            insert_ignore(association).from_select([owner_column, 'tag_id'], rows)
+        ).rowcount
+    if remove:
+        owned = sa.select(parent.id).where(parent.id.in_(ids), parent.user_id == user_id)
+        removed = db.session.execute(
+            sa.delete(association)
+            .where(association.c[owner_column].in_(owned),
+                   association.c.tag_id.in_(sa.select(Tag.id).where(Tag.name.in_(remove))))
+        ).rowcount
+    return added, removed
+
+
+def apply_tags(user_id, add=(), remove=(), note_ids=(), todolist_ids=()):
+    """Adds and removes tags by name across many notes and to-do lists.
+
+    Missing tags in `add` are created first. A name in both `add` and
+    `remove` is removed. The caller commits.
+
+    Returns:
+        dict: Links added and removed per kind of item.
+    """
+    remove = {normalize_tag_name(name) for name in remove} - {''}
+    add = {normalize_tag_name(name) for name in add} - {''} - remove
+    if add and (note_ids or todolist_ids):
+        upsert_tags(add, user_id)
+
+    result = {}
+    for kind, ids, association, owner_column, parent in (
+            ('notes', note_ids, note_tag_association, 'note_id', Note),
+            ('todolists', todolist_ids, todolist_tag_association, 'todolist_id', ToDoList)):
+        added, removed = _retag(association, owner_column, parent, user_id,
+                                set(ids), add, remove) if ids else (0, 0)
+        result[kind] = {'added': added, 'removed': removed}
+    return result
@@ -0,0 +1,110 @@
+"""Chunked storage of very large notes.
+
+A note whose content reaches `LARGE_NOTE_THRESHOLD` UTF-8 bytes keeps it in
+`note_chunk` rows of `CHUNK_SIZE` bytes each (compressed like `note.content`)
+instead of `note.content`, which is left empty; `note.chunked_size` holds the
+total size. A byte range is read from the chunks that overlap it only, one
+chunk at a time, and an append rewrites the last chunk and adds new ones
+instead of rewriting the whole text. Smaller notes are stored as before.
+"""
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import NoteChunk
+
+CHUNK_SIZE = 1 << 18  # Fixed: chunk n of every stored note starts at byte n * CHUNK_SIZE
+
+
+def note_size(content, chunked_size):
+    """UTF-8 size of a note's content, from its `content` and `chunked_size`."""
+    if chunked_size is not None:
+        return chunked_size
+    return len(content.encode('utf-8')) if content else 0
+
+
+def is_large(size):
+    """Whether content of `size` bytes is stored in chunks."""
+    return size >= current_app.config['LARGE_NOTE_THRESHOLD']
+
+
+def chunk_rows(note_id, raw, first=0):
+    """`note_chunk` rows holding the bytes `raw`, numbered from `first`."""
+    return [{'note_id': note_id, 'number': first + i, 'data': raw[start:start + CHUNK_SIZE]}
+            for i, start in enumerate(range(0, len(raw), CHUNK_SIZE))]
+
+
+def set_content(note, content):
+    """Replaces a note's content, in chunks if it is large.
+
+    Flushes a new note that needs chunks, since they reference its id.
+    """
+    raw = content.encode('utf-8') if content else b''
+    if note.chunked_size is not None:
+        db.session.execute(sa.delete(NoteChunk).where(NoteChunk.note_id == note.id))
+    if not is_large(len(raw)):
+        note.content, note.chunked_size = content, None
+        return
+
+    note.content, note.chunked_size = '', len(raw)
+    if note.id is None:
+        db.session.flush()
+    db.session.execute(sa.insert(NoteChunk), chunk_rows(note.id, raw))
+
+
+def append_content(note, text):
+    """Appends `text` to a note's content.
+
+    A large note only has its last chunk rewritten (if it isn't full) and
+    new chunks added; a small one that becomes large is converted.
+    """
+    if note.chunked_size is None:
+        set_content(note, (note.content or '') + text)
+        return
+
+    raw = text.encode('utf-8')
+    last = (note.chunked_size - 1) // CHUNK_SIZE
+    tail = db.session.scalar(
+        sa.select(NoteChunk.data).where(NoteChunk.note_id == note.id, NoteChunk.number == last))
+    rows = chunk_rows(note.id, tail + raw, first=last)
+    if len(tail) < CHUNK_SIZE:
+        db.session.execute(
+            sa.update(NoteChunk)
+            .where(NoteChunk.note_id == note.id, NoteChunk.number == last)
+            .values(data=rows[0]['data']))
+    if rows[1:]:
+        db.session.execute(sa.insert(NoteChunk), rows[1:])
+    note.chunked_size += len(raw)
+
+
+def read_content(note):
+    """Full content of a note (or row with `id`, `content` and `chunked_size`)."""
+    if note.chunked_size is None:
+        return note.content
+    return b''.join(db.session.scalars(
+        sa.select(NoteChunk.data).where(NoteChunk.note_id == note.id).order_by(NoteChunk.number)
+    )).decode('utf-8')
+
+
+def iter_content(note, start=0, stop=None):
+    """Yields the UTF-8 bytes `start:stop` of a note's content.
+
+    Chunks of a large note are streamed from the database as they are
+    consumed, and only those overlapping the range are read.
+    """
+    if note.chunked_size is None:
+        yield (note.content or '').encode('utf-8')[start:stop]
+        return
+
+    stop = note.chunked_size if stop is None else min(stop, note.chunked_size)
+    if start >= stop:
+        return
+    first, last = start // CHUNK_SIZE, (stop - 1) // CHUNK_SIZE
+    chunks = db.session.scalars(
+        sa.select(NoteChunk.data)
+        .where(NoteChunk.note_id == note.id, NoteChunk.number.between(first, last))
+        .order_by(NoteChunk.number)
+        .execution_options(yield_per=4))
+    offset = first * CHUNK_SIZE
+    for data in chunks:
+        yield data[max(start - offset, 0):stop - offset]
+        offset += CHUNK_SIZE
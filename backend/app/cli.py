@@ -0,0 +1,319 @@
+"""Custom `flask` CLI commands.
+"""
+import os
+import json
+import time
+import click
+from datetime import datetime, timedelta, timezone
+from app.startup import profile_imports
+from flask import Blueprint, current_app
+
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.command('startup-profile')
+@click.option('--top', default=15, show_default=True, help='Number of imports to list.')
+def startup_profile(top):
+    """Report import and init time per component of the app factory."""
+    backend_dir = os.path.dirname(current_app.root_path)
+    start = time.perf_counter()
+    imports = profile_imports(cwd=backend_dir)
+    wall = time.perf_counter() - start
+
+    click.echo(f'Cold start (fresh interpreter): {wall * 1000:.1f} ms')
+    click.echo('\nImports (cumulative):')
+    for package, seconds in imports[:top]:
+        click.echo(f'  {package:<32} {seconds * 1000:8.1f} ms')
+
+    click.echo('\ncreate_app steps:')
+    for step, seconds in current_app.extensions['startup_timer'].steps.items():
+        click.echo(f'  {step:<32} {seconds * 1000:8.1f} ms')
+
+
+@bp.cli.command('seed')
+@click.option('--users', default=50, show_default=True, help='Number of users to create.')
+def seed(users):
+    """Drop all tables and fill the database with fake data."""
+    from seed import run_seed  # Imports Faker only when seeding
+    run_seed(num_users=users)
+
+
+@bp.cli.command('compact-revisions')
+@click.option('--days', default=90, show_default=True,
+              help='Prune revisions older than this many days.')
+@click.option('--keep-last', default=10, show_default=True,
+              help='Revisions always kept per note.')
+def compact_revisions_command(days, keep_last):
+    """Prune old note revisions, re-basing each note on a fresh snapshot."""
+    from app.revisions import compact_revisions
+    from app.sharding import use_shard
+    older_than = datetime.now(timezone.utc) - timedelta(days=days)
+    for shard in current_app.extensions['shards'].names:
+        with use_shard(shard):
+            deleted = compact_revisions(older_than, keep_last=keep_last)
+        click.echo(f'Deleted {deleted} revisions on {shard}.')
+
+
+@bp.cli.command('import-notes')
+@click.argument('archive_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', required=True, help='Username that will own the notes.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='File recording progress; an existing one resumes the import.')
+@click.option('--workers', type=int,
+              help='Parser processes (0 parses inline); IMPORT_WORKERS by default.')
+@click.option('--chunk-size', type=int,
+              help='Markdown files per transaction; IMPORT_CHUNK_SIZE by default.')
+def import_notes(archive_path, username, checkpoint, workers, chunk_size):
+    """Import a zip or tar archive of Markdown files as a user's notes."""
+    import sqlalchemy as sa
+    from app import db
+    from app.models import UserDirectory
+    from app.importer import ArchiveTooLarge, import_archive
+    from app.sharding import use_shard
+    from app.usage import QuotaExceeded
+
+    config = current_app.config
+    workers = config['IMPORT_WORKERS'] if workers is None else workers
+    chunk_size = config['IMPORT_CHUNK_SIZE'] if chunk_size is None else chunk_size
+    user = db.session.scalar(sa.select(UserDirectory).where(UserDirectory.username == username))
+    if user is None:
+        raise click.BadParameter(f'No user named {username!r}', param_hint='--user')
+
+    start = 0
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        if saved.get('archive') != os.path.abspath(archive_path):
+            raise click.BadParameter('Checkpoint belongs to another archive',
+                                     param_hint='--checkpoint')
+        start = saved['position']
+        click.echo(f'Resuming after {start} files.')
+
+    started = time.perf_counter()
+
+    def report(position):
+        if checkpoint:
+            with open(checkpoint, 'w') as f:
+                json.dump({'archive': os.path.abspath(archive_path), 'position': position}, f)
+        rate = (position - start) / (time.perf_counter() - started)
+        click.echo(f'  {position} files imported ({rate:.0f}/s)')
+
+    try:
+        with open(archive_path, 'rb') as f, use_shard(user.shard):
+            result = import_archive(f, user.id, start=start, chunk_size=chunk_size,
+                                    workers=workers, progress=report)
+    except (QuotaExceeded, ArchiveTooLarge) as e:
+        raise click.ClickException(str(e))
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    click.echo(f"Imported {result['notes']} notes into {result['groups']} groups "
+               f"with {result['tags']} tag links.")
+
+
+@bp.cli.group('shards')
+def shards():
+    """Manage user shards."""
+
+
+@shards.command('init')
+def shards_init():
+    """Create all tables in the default database and every shard."""
+    from app import db
+    from app.sharding import GLOBAL_TABLES
+    db.create_all()
+    shard_tables = [table for table in db.metadata.sorted_tables
+                    if table.name not in GLOBAL_TABLES]
+    for name, engine in db.engines.items():
+        if name is not None:
+            db.metadata.create_all(engine, tables=shard_tables)
+            click.echo(f'Created tables on shard {name}.')
+
+
+@shards.command('status')
+def shards_status():
+    """Show how many users each shard holds."""
+    import sqlalchemy as sa
+    from app import db
+    from app.models import UserDirectory
+    counts = dict(db.session.execute(
+        sa.select(UserDirectory.shard, sa.func.count()).group_by(UserDirectory.shard)).all())
+    for name in current_app.extensions['shards'].names:
+        new_users = ' (new users)' if name in current_app.config['SHARDS'] else ''
+        click.echo(f'  {name:<20} {counts.get(name, 0):>8} users{new_users}')
+
+
+@shards.command('move')
+@click.argument('user_id', type=int)
+@click.argument('target')
+@click.option('--grace', type=float, help='Seconds before deleting the old copy '
+              '(default: SHARD_MAP_TTL).')
+def shards_move(user_id, target, grace):
+    """Move one user and all their data to another shard."""
+    from app.rebalance import move_users
+    try:
+        copied = move_users([(user_id, target)], grace=grace)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Moved user {user_id} to {target}: {copied.get(user_id, 0)} rows copied.')
+
+
+@shards.command('rebalance')
+@click.option('--dry-run', is_flag=True, help='Only print the planned moves.')
+@click.option('--grace', type=float, help='Seconds before deleting each old copy '
+              '(default: SHARD_MAP_TTL).')
+def shards_rebalance(dry_run, grace):
+    """Even out users over the shards in SHARDS."""
+    from app.rebalance import move_users, plan_rebalance
+    moves = plan_rebalance(current_app.config['SHARDS'])
+    for user_id, source, target in moves:
+        click.echo(f'  user {user_id}: {source} -> {target}')
+    if not dry_run:
+        move_users([(user_id, target) for user_id, _, target in moves], grace=grace)
+    click.echo(f'{len(moves)} users {"to move" if dry_run else "moved"}.')
+
+
+@bp.cli.command('prune-revoked-tokens')
+def prune_revoked_tokens_command():
+    """Delete revocations of tokens that have expired."""
+    from app.blocklist import prune_revoked_tokens
+    click.echo(f'Deleted {prune_revoked_tokens()} expired revocations.')
+
+
+@bp.cli.command('prune-sync-keys')
+@click.option('--days', type=int, help='Forget keys older than this many days '
+              '(default: SYNC_KEY_RETENTION_DAYS).')
+def prune_sync_keys_command(days):
+    """Delete old idempotency keys of /api/sync/push operations."""
+    from app.sync import prune_sync_operations
+    from app.sharding import use_shard
+    days = current_app.config['SYNC_KEY_RETENTION_DAYS'] if days is None else days
+    older_than = datetime.now(timezone.utc) - timedelta(days=days)
+    for shard in current_app.extensions['shards'].names:
+        with use_shard(shard):
+            deleted = prune_sync_operations(older_than)
+        click.echo(f'Deleted {deleted} sync keys on {shard}.')
+
+
+@bp.cli.group('stats')
+def stats():
+    """Manage the activity rollups behind /api/stats."""
+
+
+@stats.command('backfill')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Users aggregated per transaction.')
+def stats_backfill(batch_size):
+    """Rebuild every user's daily rollups from their notes and to-do items."""
+    from app.stats import backfill_stats
+    from app.sharding import use_shard
+    for shard in current_app.extensions['shards'].names:
+        with use_shard(shard):
+            users = backfill_stats(batch_size=batch_size)
+        click.echo(f'Rebuilt rollups of {users} users on {shard}.')
+
+
+@bp.cli.command('find-duplicates')
+@click.option('--user', 'username', help='Only this user (default: every user).')
+@click.option('--full', is_flag=True, help='Recompute every signature, not just outdated ones.')
+@click.option('--threshold', type=float, help='Minimum similarity (default: DEDUP_THRESHOLD).')
+def find_duplicates_command(username, full, threshold):
+    """Rescan users' notes and report groups of near-duplicates."""
+    import sqlalchemy as sa
+    from app import db
+    from app.models import UserDirectory
+    from app.dedup import find_duplicates, refresh_signatures
+    from app.sharding import use_shard
+
+    query = sa.select(UserDirectory).order_by(UserDirectory.id)
+    if username:
+        query = query.where(UserDirectory.username == username)
+    users = db.session.scalars(query).all()
+    if username and not users:
+        raise click.ClickException(f'No user named {username!r}')
+
+    threshold = threshold or current_app.config['DEDUP_THRESHOLD']
+    for user in users:
+        started = time.perf_counter()
+        with use_shard(user.shard):
+            computed = refresh_signatures(user.id, full=full)
+            result = find_duplicates(user.id, threshold)
+        groups = result['groups']
+        click.echo(f"  {user.username}: {result['scanned']} notes ({computed} hashed), "
+                   f"{len(groups)} groups of duplicates, {sum(len(ids) for _, ids in groups)} "
+                   f"notes, {time.perf_counter() - started:.2f}s")
+
+
+@bp.cli.group('usage')
+def usage():
+    """Manage per-user usage counters and plans."""
+
+
+@usage.command('reconcile')
+@click.option('--batch-size', default=200, show_default=True, help='Users per transaction.')
+@click.option('--dry-run', is_flag=True, help='Only report drift, keep the stored counters.')
+def usage_reconcile(batch_size, dry_run):
+    """Recompute every user's usage counters and report drift."""
+    from app.usage import reconcile_usage
+    from app.sharding import use_shard
+    for shard in current_app.extensions['shards'].names:
+        with use_shard(shard):
+            drift = reconcile_usage(batch_size=batch_size, fix=not dry_run)
+        for user_id, counters in drift.items():
+            changes = ', '.join(f'{name} {stored} -> {actual}'
+                                for name, (stored, actual) in counters.items())
+            click.echo(f'  user {user_id}: {changes}')
+        click.echo(f'{len(drift)} users with drift on {shard}'
+                   f'{"" if dry_run or not drift else " (fixed)"}.')
+
+
+@usage.command('set-plan')
+@click.argument('username')
+@click.argument('plan')
+def usage_set_plan(username, plan):
+    """Move a user to another plan of PLAN_QUOTAS."""
+    import sqlalchemy as sa
+    from app import db
+    from app.models import UserDirectory, UserUsage
+    from app.sharding import use_shard
+    if plan not in current_app.config['PLAN_QUOTAS']:
+        raise click.BadParameter(f'Unknown plan {plan!r}', param_hint='PLAN')
+    user = db.session.scalar(sa.select(UserDirectory).where(UserDirectory.username == username))
+    if user is None:
+        raise click.BadParameter(f'No user named {username!r}', param_hint='USERNAME')
+    with use_shard(user.shard):
+        usage = db.session.get(UserUsage, user.id)
+        if usage is None:
+            usage = UserUsage(user_id=user.id)
+            db.session.add(usage)
+        usage.plan = plan
+        db.session.commit()
+    click.echo(f'{username} is now on the {plan} plan.')
+
+
+@bp.cli.command('db-audit')
+@click.option('--verbose', is_flag=True, help='List the statements captured per route.')
+def db_audit(verbose):
+    """Explain every query the API issues; fail on full table scans."""
+    from config import Config
+    from app.audit import audit_catalog, capture_catalog
+    catalog, missing, failed = capture_catalog(Config)
+    problems = audit_catalog(catalog)
+
+    for route, statements in sorted(catalog.items()):
+        click.echo(f'  {route:<56} {len(statements):>3} statements')
+        if verbose:
+            for statement, _ in statements:
+                click.echo(f'      {" ".join(str(statement).split())}')
+    for route in missing:
+        click.echo(f'Not exercised: {route}', err=True)
+    for method, path, status in failed:
+        click.echo(f'Call failed: {method} {path} -> {status}', err=True)
+    for route, database, tables, sql in problems:
+        click.echo(f'Full scan of {", ".join(tables)} on {database} by {route}:\n'
+                   f'      {" ".join(sql.split())}', err=True)
+    if missing or failed or problems:
+        raise click.ClickException(f'{len(problems)} full table scans, {len(missing)} routes '
+                                   f'not exercised, {len(failed)} failed calls.')
+    click.echo(f'{sum(map(len, catalog.values()))} statements checked, no full table scans.')
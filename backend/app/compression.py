@@ -0,0 +1,110 @@
+"""Negotiated gzip/brotli compression of API responses.
+
+An `after_request` hook compresses JSON, text and SVG bodies of at least
+`COMPRESS_MIN_SIZE` bytes with the best encoding the client's
+`Accept-Encoding` allows: brotli if the optional `brotli` package is
+installed, else gzip. Buffered responses are compressed in one go; streamed
+ones (large note content) piece by piece as they are sent, flushed after
+each piece so the client isn't kept waiting. Partial (206) responses are
+left alone, since their byte ranges refer to the uncompressed body.
+
+A compressed variant keeps a strong ETag, suffixed with its encoding
+(`"<tag>-br"`); routes answering `If-None-Match` use `matching_etag` so
+any variant's tag revalidates.
+"""
+import zlib
+from flask import current_app, request
+
+try:  # Optional: smaller than gzip on prose at a similar CPU cost
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('application/json', 'text/', 'image/svg+xml')  # Mimetype prefixes
+_GZIP_WBITS = 31  # zlib's gzip container
+
+
+def encodings():
+    """Content codings the server can produce, preferred first."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, level):
+    """Compresses a whole body with `encoding` (`br` or `gzip`)."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def stream_compressor(encoding, level):
+    """Returns `(compress, finish)` functions compressing a body piece by piece.
+
+    `compress(data)` returns everything needed to decode `data` so far, so
+    each piece can be sent right away; `finish()` returns the trailer.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return (lambda data: compressor.process(data) + compressor.flush()), compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    return (lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)), \
+        compressor.flush
+
+
+def matching_etag(etag):
+    """The tag in `If-None-Match` matching `etag` or one of its compressed
+    variants, or `None` (then the resource was modified).
+    """
+    for tag in (etag, *(f'{etag}-{encoding}' for encoding in ('br', 'gzip'))):
+        if request.if_none_match.contains_weak(tag):
+            return tag
+    return None
+
+
+def _compress_stream(iterable, compress, finish):
+    try:
+        for data in iterable:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if data:
+                yield compress(data)
+        yield finish()
+    finally:  # Ends the wrapped stream's request context and database reads
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def _compress_response(response):
+    config = current_app.config
+    response.vary.add('Accept-Encoding')  # Caches must key on it, compressed or not
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or request.method == 'HEAD' or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE)):
+        return response
+
+    length = response.content_length
+    if length is not None and length < config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = request.accept_encodings.best_match(encodings())
+    if encoding is None:
+        return response
+
+    level = config['COMPRESS_BROTLI_QUALITY' if encoding == 'br' else 'COMPRESS_GZIP_LEVEL']
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, *stream_compressor(encoding, level))
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress(response.get_data(), encoding, level))
+    response.content_encoding = encoding
+
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:  # Strong ETags identify the exact bytes sent
+        response.set_etag(f'{etag}-{encoding}')
+    return response
+
+
+def init_compression(app):
+    if app.config['COMPRESS_ENABLED']:
+        app.after_request(_compress_response)
@@ -0,0 +1,92 @@
+"""Custom SQLAlchemy column types.
+"""
+import zlib
+import sqlalchemy as sa
+
+try:  # Optional: better ratio and much faster decompression than zlib
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# First byte of every stored value says how the rest is encoded
+RAW, ZLIB, ZSTD = b'\x00', b'\x01', b'\x02'
+
+
+def encode_bytes(raw, min_size=1024, level=6):
+    """Encodes bytes as a tagged, possibly compressed, byte string.
+
+    Values shorter than `min_size` bytes, or that don't shrink, are stored raw.
+    """
+    if len(raw) < min_size:
+        return RAW + raw
+    if zstandard is not None:
+        packed = ZSTD + zstandard.ZstdCompressor(level=level).compress(raw)
+    else:
+        packed = ZLIB + zlib.compress(raw, level)
+    return packed if len(packed) < len(raw) + 1 else RAW + raw
+
+
+def decode_bytes(data):
+    """Inverse of `encode_bytes`."""
+    tag, body = data[:1], data[1:]
+    if tag == ZLIB:
+        return zlib.decompress(body)
+    if tag == ZSTD:
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read this value')
+        return zstandard.ZstdDecompressor().decompress(body)
+    return bytes(body)
+
+
+def encode_text(value, min_size=1024, level=6):
+    """Encodes text (as UTF-8) with `encode_bytes`."""
+    return encode_bytes(value.encode('utf-8'), min_size, level)
+
+
+def decode_text(data):
+    """Inverse of `encode_text`."""
+    return decode_bytes(data).decode('utf-8')
+
+
+class CompressedBinary(sa.TypeDecorator):
+    """Bytes compressed once they reach `min_size` bytes.
+
+    Python code reads and writes plain `bytes`; only the database sees the
+    compressed form, so SQL functions such as `length()` or `LIKE` don't
+    apply to these columns.
+    """
+
+    impl = sa.LargeBinary
+    cache_ok = True
+
+    def __init__(self, min_size=1024, level=6):
+        super().__init__()
+        self.min_size = min_size
+        self.level = level
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_bytes(value, self.min_size, self.level)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_bytes(value)
+
+
+class CompressedText(CompressedBinary):
+    """Text stored like `CompressedBinary` (as UTF-8); Python sees `str`."""
+
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_text(value, self.min_size, self.level)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_text(value)
@@ -0,0 +1,213 @@
+"""Near-duplicate note detection with MinHash signatures and LSH banding.
+
+A note's content is lowercased and split into words; every run of
+`SHINGLE_SIZE` words is a shingle. Its MinHash signature holds, for each of
+`NUM_PERM` hash functions, the smallest hash of any shingle, so the share of
+equal positions in two signatures estimates the Jaccard similarity of their
+shingle sets. Signatures are computed for whole batches of notes at once
+with NumPy and stored in `note_signature` (512 bytes per note) when notes
+are written (see `store_signatures`); a large note appended to loses its
+signature until `refresh_signatures` (`flask find-duplicates`) hashes it,
+since that means reading its whole content.
+
+Candidate pairs come from LSH: signatures are cut into `BANDS` bands and
+notes sharing any band are compared, so a library is scanned in roughly
+linear time instead of comparing every pair of notes.
+"""
+import re
+import zlib
+from datetime import datetime, timezone
+import numpy as np
+import sqlalchemy as sa
+from app import db
+from app.bulk import upsert_replace
+from app.chunks import read_content
+from app.models import Note, NoteSignature
+
+NUM_PERM = 128
+BANDS = 16  # Of NUM_PERM // BANDS values; ~70% similar notes share a band half the time
+SHINGLE_SIZE = 3  # Words
+BLOCK_SIZE = 1 << 14  # Shingles hashed at once (a 16 MiB array)
+
+_WORD = re.compile(r'\w+')
+# Fixed seed: stored signatures must stay comparable across processes and releases
+_rng = np.random.default_rng(20240607)
+_A = _rng.integers(0, 2**64 - 1, size=NUM_PERM, dtype=np.uint64, endpoint=True) | np.uint64(1)
+_B = _rng.integers(0, 2**64 - 1, size=NUM_PERM, dtype=np.uint64, endpoint=True)
+_MIX = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9][:SHINGLE_SIZE],
+                dtype=np.uint64)
+
+
+def shingles(text):
+    """Hashes (uint64 array) of the word shingles of `text`."""
+    words = _WORD.findall((text or '').lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    hashes = np.fromiter((zlib.crc32(word.encode()) for word in words),
+                         dtype=np.uint64, count=len(words))
+    if len(hashes) < SHINGLE_SIZE:  # Short notes are a single shingle
+        hashes = np.pad(hashes, (0, SHINGLE_SIZE - len(hashes)))
+    # Word i of each shingle, times its mixing constant, summed (wrapping)
+    windows = np.lib.stride_tricks.sliding_window_view(hashes, SHINGLE_SIZE)
+    return np.unique((windows * _MIX).sum(axis=1, dtype=np.uint64))
+
+
+def signatures(shingle_sets):
+    """MinHash signatures of several shingle sets, one uint32 row each.
+
+    All shingles are hashed together, `BLOCK_SIZE` at a time, with
+    multiply-shift hashing (`(a * x + b) mod 2**64 >> 32`); each row is then
+    the column-wise minimum over its own shingles.
+    """
+    out = np.full((len(shingle_sets), NUM_PERM), np.iinfo(np.uint32).max, dtype=np.uint32)
+    lengths = np.fromiter(map(len, shingle_sets), dtype=np.int64, count=len(shingle_sets))
+    if not lengths.sum():
+        return out
+    flat = np.concatenate(shingle_sets)
+    owners = np.repeat(np.arange(len(shingle_sets)), lengths)
+    with np.errstate(over='ignore'):
+        for start in range(0, len(flat), BLOCK_SIZE):
+            block, rows = flat[start:start + BLOCK_SIZE], owners[start:start + BLOCK_SIZE]
+            values = ((block[:, None] * _A + _B) >> np.uint64(32)).astype(np.uint32)
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])  # Rows are sorted
+            ids = rows[starts]
+            out[ids] = np.minimum(out[ids], np.minimum.reduceat(values, starts, axis=0))
+    return out
+
+
+def _signature_rows(contents):
+    """`note_signature` rows of `(note id, content)` pairs."""
+    sets = [shingles(content) for _, content in contents]
+    now = datetime.now(timezone.utc)
+    return [{'note_id': note_id, 'signature': row.astype('<u4').tobytes() if len(shingle_set) else b'',
+             'computed_at': now}
+            for (note_id, _), shingle_set, row in zip(contents, sets, signatures(sets))]
+
+
+def store_signatures(contents):
+    """Stores the signatures of notes whose content was just written.
+
+    Args:
+        contents (dict): New content by note id; `None` (content not read)
+            deletes the note's signature, for `refresh_signatures` to redo.
+    """
+    stale = [note_id for note_id, content in contents.items() if content is None]
+    if stale:
+        db.session.execute(sa.delete(NoteSignature).where(NoteSignature.note_id.in_(stale)))
+    known = [(note_id, content) for note_id, content in contents.items() if content is not None]
+    if known:
+        db.session.execute(
+            upsert_replace(NoteSignature.__table__, ['note_id'], ['signature', 'computed_at']),
+            _signature_rows(known))
+
+
+def refresh_signatures(user_id, full=False, batch_size=500):
+    """Computes missing and outdated signatures of a user's notes.
+
+    Args:
+        user_id (int): Owner of the notes.
+        full (bool, optional): Recompute every signature.
+        batch_size (int, optional): Notes loaded, hashed and written per transaction.
+
+    Returns:
+        int: Number of signatures computed.
+    """
+    query = (
+        sa.select(Note.id)
+        .outerjoin(NoteSignature, NoteSignature.note_id == Note.id)
+        .where(Note.user_id == user_id, Note.deleted_at.is_(None))
+    )
+    if not full:
+        query = query.where(sa.or_(NoteSignature.note_id.is_(None),
+                                   NoteSignature.computed_at < Note.updated_at))
+    note_ids = db.session.scalars(query).all()
+
+    for start in range(0, len(note_ids), batch_size):
+        batch = note_ids[start:start + batch_size]
+        notes = db.session.execute(
+            sa.select(Note.id, Note.content, Note.chunked_size).where(Note.id.in_(batch))).all()
+        db.session.execute(sa.delete(NoteSignature).where(NoteSignature.note_id.in_(batch)))
+        db.session.execute(sa.insert(NoteSignature),
+                           _signature_rows([(note.id, read_content(note)) for note in notes]))
+        db.session.commit()
+    return len(note_ids)
+
+
+def candidate_pairs(sigs):
+    """Index pairs of signatures that are equal in at least one band.
+
+    Each band's values are viewed as one opaque key per note and sorted;
+    every note in a bucket is paired with the bucket's first note, and
+    `duplicate_groups` joins the pairs transitively.
+    """
+    rows = NUM_PERM // BANDS
+    key_type = np.dtype((np.void, rows * sigs.dtype.itemsize))
+    pairs = set()
+    for band in range(BANDS):
+        keys = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows]).view(key_type).ravel()
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        same = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1]) + 1  # Not the bucket's first
+        if not len(same):
+            continue
+        firsts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        leaders = order[firsts[np.searchsorted(firsts, same, side='right') - 1]]
+        pairs.update(zip(leaders.tolist(), order[same].tolist()))
+    return pairs
+
+
+def duplicate_groups(note_ids, sigs, threshold):
+    """Groups notes whose estimated similarity reaches `threshold`.
+
+    Returns:
+        list: `(similarity, note ids)` per group, largest first; similarity is
+            the lowest of the pairs that joined the group.
+    """
+    pairs = np.array(sorted(candidate_pairs(sigs)), dtype=np.int64).reshape(-1, 2)
+    similarity = (sigs[pairs[:, 0]] == sigs[pairs[:, 1]]).mean(axis=1)
+    keep = similarity >= threshold
+
+    pairs, similarity = pairs[keep].tolist(), similarity[keep].tolist()
+
+    parent = list(range(len(note_ids)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        parent[root(b)] = root(a)
+
+    groups = {}  # Root: [lowest similarity, member indexes]
+    for (a, b), value in zip(pairs, similarity):
+        group = groups.setdefault(root(a), [1.0, set()])
+        group[0] = min(group[0], value)
+        group[1].update((a, b))
+    result = [(round(lowest, 3), sorted(note_ids[i] for i in members))
+              for lowest, members in groups.values()]
+    return sorted(result, key=lambda group: (-len(group[1]), group[1][0]))
+
+
+def find_duplicates(user_id, threshold):
+    """Groups a user's near-duplicate notes by their stored signatures.
+
+    Only reads: notes without a signature (see `store_signatures`) are left
+    out until `refresh_signatures` hashes them.
+
+    Returns:
+        dict: `groups` (as returned by `duplicate_groups`) and `scanned`
+            (notes compared).
+    """
+    rows = db.session.execute(
+        sa.select(NoteSignature.note_id, NoteSignature.signature)
+        .join(Note, NoteSignature.note_id == Note.id)
+        .where(Note.user_id == user_id, Note.deleted_at.is_(None),
+               sa.func.length(NoteSignature.signature) > 0)
+    ).all()
+    if not rows:
+        return {'groups': [], 'scanned': 0}
+    note_ids = [note_id for note_id, _ in rows]
+    sigs = np.frombuffer(b''.join(sig for _, sig in rows), dtype='<u4').reshape(len(rows), NUM_PERM)
+    return {'groups': duplicate_groups(note_ids, sigs, threshold), 'scanned': len(rows)}
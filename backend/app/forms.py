@@ -2,7 +2,7 @@
 import re
 import sqlalchemy as sa
 from app import db
-from app.models import User, GenderEnum
+from app.models import UserDirectory, GenderEnum
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, RadioField
 from wtforms.validators import DataRequired, ValidationError, Email, EqualTo
@@ -38,8 +38,8 @@ class SignupForm(FlaskForm):
     def validate_username(self, username):
         """Custom validator for the username field.
         """
-        # Check for existing user (uniqueness)
-        if db.session.scalar(sa.select(User).where(User.username == username.data)):
+        # Check for existing user (uniqueness, across all shards)
+        if db.session.scalar(sa.select(UserDirectory.id).where(UserDirectory.username == username.data)):
             raise ValidationError('Username is already in use. Please choose a different one.')
         
         # Check length
@@ -59,7 +59,7 @@ class SignupForm(FlaskForm):
         
     def validate_email(self, email):
         """Custom validator for the email field."""
-        if db.session.scalar(sa.select(User).where(User.email == email.data)):
+        if db.session.scalar(sa.select(UserDirectory.id).where(UserDirectory.email == email.data)):
             raise ValidationError('Email address already in use.')
         
     def validate_password(self, password):
@@ -0,0 +1,272 @@
+"""Streaming import of Markdown archives (zip or tar) into notes.
+
+Archive members are read one at a time straight from the upload stream,
+parsed (optionally in a process pool) and written in chunks with multi-row
+INSERTs: folders become groups, front-matter tags are upserted.
+
+Archives are size checked before anything is decompressed into memory: a
+file larger than `IMPORT_MAX_FILE_SIZE` (or than what is left of the
+user's quota) or an archive whose files add up to more than
+`IMPORT_MAX_SIZE` stops the import with `ArchiveTooLarge`, and a chunk
+holds at most `MAX_CHUNK_BYTES` of files.
+"""
+import os
+import re
+import tarfile
+import zipfile
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.bulk import normalize_tag_name, upsert_tags
+from app.chunks import chunk_rows, is_large
+from app.dedup import store_signatures
+from app.models import Note, NoteChunk, NoteRevision, Group, note_tag_association
+from app.revisions import snapshot_data
+from app.sharding import assign_ids
+from app.stats import add_counts
+from app.usage import add_usage, check_quota, content_size, get_usage
+
+MARKDOWN_SUFFIXES = ('.md', '.markdown')
+MAX_CHUNK_BYTES = 32 << 20  # Raw file bytes held per chunk, whatever its file count
+READ_SIZE = 1 << 20
+_FRONT_MATTER = re.compile(r'\A---\s*\n(.*?)\n---\s*(?:\n|\Z)', re.DOTALL)
+_HEADING = re.compile(r'^#\s+(.+?)\s*#*\s*$', re.MULTILINE)
+
+
+class ArchiveTooLarge(Exception):
+    """An archive file, or all of them, would exceed the import size limits."""
+
+
+def _read(f, name, size, max_size):
+    """Reads a file of `size` bytes in pieces, never more than `max_size`."""
+    if size > max_size:
+        raise ArchiveTooLarge(f'{name} has {size} bytes, the limit is {max_size}')
+    pieces, read = [], 0
+    while piece := f.read(min(READ_SIZE, max_size + 1 - read)):
+        pieces.append(piece)
+        read += len(piece)
+        if read > max_size:  # The header lied about the size
+            raise ArchiveTooLarge(f'{name} has more than {max_size} bytes')
+    return b''.join(pieces)
+
+
+def iter_archive(fileobj, max_file_size=None, max_total_size=None):
+    """Yields `(path, bytes)` for every Markdown file in a zip or tar archive.
+
+    Zip archives need a seekable file (their index is at the end); tar
+    archives, compressed or not, are read as a forward-only stream. Raises
+    `ArchiveTooLarge` (before reading it) at the first file larger than
+    `max_file_size` or taking the total over `max_total_size`.
+    """
+    max_file_size = float('inf') if max_file_size is None else max_file_size
+    total = 0
+
+    def check(size):
+        nonlocal total
+        total += size
+        if max_total_size is not None and total > max_total_size:
+            raise ArchiveTooLarge(f'The archive holds more than {max_total_size} bytes of notes')
+
+    if fileobj.seekable() and zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(MARKDOWN_SUFFIXES):
+                    check(info.file_size)
+                    with archive.open(info) as f:
+                        yield info.filename, _read(f, info.filename, info.file_size, max_file_size)
+        return
+
+    if fileobj.seekable():
+        fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(MARKDOWN_SUFFIXES):
+                check(member.size)
+                yield member.name, _read(archive.extractfile(member), member.name, member.size,
+                                         max_file_size)
+
+
+def _chunk(items, chunk_size):
+    """The next `chunk_size` items, fewer if they hold `MAX_CHUNK_BYTES`."""
+    chunk, size = [], 0
+    for item in items:
+        chunk.append(item)
+        size += len(item[1])
+        if len(chunk) == chunk_size or size >= MAX_CHUNK_BYTES:
+            break
+    return chunk
+
+
+def _parse_list(value):
+    value = value.strip()
+    if value.startswith('[') and value.endswith(']'):
+        value = value[1:-1]
+    return [item.strip().strip('\'"') for item in value.split(',') if item.strip()]
+
+
+def parse_front_matter(text):
+    """Parses the simple YAML subset used by note apps' front matter.
+
+    Supports `key: value`, `key: [a, b]`, `key: a, b` and indented `- item`
+    lists. Returns `(fields, body)`.
+    """
+    match = _FRONT_MATTER.match(text)
+    if not match:
+        return {}, text
+
+    fields, key = {}, None
+    for line in match.group(1).splitlines():
+        stripped = line.strip()
+        if stripped.startswith('- ') and key is not None:
+            fields.setdefault(key, [])
+            if isinstance(fields[key], list):
+                fields[key].append(stripped[2:].strip().strip('\'"'))
+        elif ':' in line and not line[0].isspace():
+            key, value = (part.strip() for part in line.split(':', 1))
+            key = key.lower()
+            fields[key] = value.strip('\'"') if value else []
+    return fields, text[match.end():]
+
+
+def parse_markdown(item):
+    """Turns one archive member into the values of a note.
+
+    Args:
+        item (tuple): `(path, raw bytes)` as yielded by `iter_archive`.
+
+    Returns:
+        dict: `title`, `content`, `tags` (list) and `folder` ('' for the root).
+    """
+    path, raw = item
+    text = raw.decode('utf-8', errors='replace').replace('\r\n', '\n')
+    fields, body = parse_front_matter(text)
+
+    title = fields.get('title')
+    if not title or isinstance(title, list):
+        heading = _HEADING.search(body)
+        title = heading.group(1) if heading else os.path.splitext(os.path.basename(path))[0]
+
+    tags = fields.get('tags', [])
+    if isinstance(tags, str):
+        tags = _parse_list(tags)
+    return {
+        'title': title[:200],
+        'content': body.strip('\n'),
+        'tags': sorted({normalize_tag_name(tag) for tag in tags} - {''}),
+        'folder': os.path.dirname(path.strip('/'))[:200],
+    }
+
+
+def _group_ids(user_id, folders, known):
+    """Adds ids of (possibly new) groups named after `folders` to `known`."""
+    missing = sorted(set(folders) - set(known) - {''})
+    if not missing:
+        return
+    known.update(db.session.execute(
+        sa.select(Group.name, Group.id)
+        .where(Group.user_id == user_id, Group.name.in_(missing))).all())
+    to_create = [name for name in missing if name not in known]
+    if to_create:
+        created = db.session.execute(
+            sa.insert(Group).returning(Group.name, Group.id, sort_by_parameter_order=True),
+            assign_ids(Group.__table__, [{'name': name, 'user_id': user_id} for name in to_create]))
+        known.update(created.all())
+
+
+def _write_chunk(user_id, parsed, group_ids, usage=None):
+    """Inserts one chunk of parsed notes, their revisions and tag links.
+
+    Raises `QuotaExceeded` (before writing) if the chunk doesn't fit the
+    user's plan (checked against `usage` if given, as read by `get_usage`).
+    """
+    sizes = [content_size(note['content']) for note in parsed]
+    check_quota(user_id, usage=usage, notes=len(parsed), note_bytes=sum(sizes))
+    _group_ids(user_id, (note['folder'] for note in parsed), group_ids)
+    tag_ids = upsert_tags({tag for note in parsed for tag in note['tags']}, user_id)
+
+    large = [is_large(size) for size in sizes]
+    note_ids = db.session.scalars(
+        sa.insert(Note).returning(Note.id, sort_by_parameter_order=True),
+        assign_ids(Note.__table__, [
+            {'title': note['title'], 'content': '' if chunked else note['content'],
+             'chunked_size': size if chunked else None, 'user_id': user_id,
+             'group_id': group_ids.get(note['folder'])}
+            for note, size, chunked in zip(parsed, sizes, large)])
+    ).all()
+    for note_id, note, chunked in zip(note_ids, parsed, large):
+        if chunked:
+            db.session.execute(sa.insert(NoteChunk), chunk_rows(note_id, note['content'].encode()))
+    db.session.execute(sa.insert(NoteRevision), assign_ids(NoteRevision.__table__, [
+        {'note_id': note_id, 'number': 1, 'is_snapshot': True, 'title': note['title'],
+         'data': snapshot_data(note['content'])}
+        for note_id, note in zip(note_ids, parsed)]))
+    store_signatures({note_id: note['content'] for note_id, note in zip(note_ids, parsed)})
+    # Bulk INSERTs skip the ORM flush hooks that maintain the rollups and usage
+    add_counts({(user_id, datetime.now(timezone.utc).date()): Counter(notes_created=len(parsed))})
+    add_usage({user_id: Counter(notes=len(parsed), note_bytes=sum(sizes))})
+
+    links = [{'note_id': note_id, 'tag_id': tag_ids[tag]}
+             for note_id, note in zip(note_ids, parsed) for tag in note['tags']]
+    if links:
+        db.session.execute(sa.insert(note_tag_association), links)
+    return len(links)
+
+
+def import_archive(fileobj, user_id, start=0, chunk_size=500, workers=0, progress=None):
+    """Imports every Markdown file of an archive as a note of `user_id`.
+
+    Each chunk is committed on its own, so an interrupted import can resume
+    by passing the last reported position as `start`. Stops with
+    `QuotaExceeded` at the first chunk that doesn't fit the user's plan,
+    and with `ArchiveTooLarge` at the first file over the size limits.
+
+    Args:
+        fileobj: Binary file object of a zip or tar(.gz/.bz2/.xz) archive.
+        user_id (int): Owner of the imported notes.
+        start (int, optional): Number of Markdown files to skip (already imported).
+        chunk_size (int, optional): Files parsed and inserted per transaction.
+        workers (int, optional): Parser processes; 0 parses in this process.
+        progress (callable, optional): Called with the position after each commit.
+
+    Returns:
+        dict: `position` (Markdown files processed), `notes`, `tags` (links)
+            and `groups` (folders used).
+    """
+    result = {'position': start, 'notes': 0, 'tags': 0, 'groups': 0}
+    group_ids = {}
+    config = current_app.config
+    max_file_size = config['IMPORT_MAX_FILE_SIZE']
+    usage = get_usage(user_id)
+    if usage['limits'].get('note_bytes'):  # A larger file can't fit the quota anyway
+        max_file_size = min(max_file_size, usage['limits']['note_bytes'] - usage['note_bytes'])
+    items = islice(iter_archive(fileobj, max(max_file_size, 0), config['IMPORT_MAX_SIZE']),
+                   start, None)
+    pool = ProcessPoolExecutor(workers) if workers else None
+    try:
+        while True:
+            chunk = _chunk(items, chunk_size)
+            if not chunk:
+                break
+            if pool is not None:
+                parsed = list(pool.map(parse_markdown, chunk, chunksize=max(1, len(chunk) // workers)))
+            else:
+                parsed = [parse_markdown(item) for item in chunk]
+
+            result['tags'] += _write_chunk(user_id, parsed, group_ids, usage)
+            db.session.commit()
+            usage = None  # Read again for the next chunk
+
+            result['position'] += len(chunk)
+            result['notes'] += len(chunk)
+            if progress is not None:
+                progress(result['position'])
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    result['groups'] = len(group_ids)
+    return result
@@ -0,0 +1,163 @@
+"""Non-blocking application and access logging.
+
+Request threads only ever push records onto an in-memory queue; a single
+background `QueueListener` thread does the formatting and file I/O.
+
+Files are rotated in process when `LOG_MAX_BYTES` is set. With several
+worker processes writing the same files (gunicorn), set it to 0 and rotate
+them externally (logrotate): each process appends whole lines and reopens
+a file once it has been moved.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+from flask import g, request, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+access_logger = logging.getLogger('notez.access')
+_running = set()  # Listeners started in this process
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record's `access` payload as a single JSON line."""
+
+    def format(self, record):
+        payload = {'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}
+        payload.update(getattr(record, 'access', {'message': record.getMessage()}))
+        return json.dumps(payload, separators=(',', ':'))
+
+
+# The start time is kept on the statement's execution context: a statement that
+# raises never reaches after_cursor_execute, so nothing is left behind
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_start
+    if has_request_context():
+        g.db_time = g.get('db_time', 0.0) + elapsed
+        g.db_queries = g.get('db_queries', 0) + 1
+
+
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+def _current_user_id():
+    """User id from the JWT if the endpoint verified one, without decoding again."""
+    try:
+        return get_jwt_identity()
+    except RuntimeError:  # Public endpoint, no token was verified
+        return None
+
+
+def _log_access(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    access_logger.info('access', extra={'access': {
+        'method': request.method,
+        'route': request.url_rule.rule if request.url_rule else None,
+        'path': request.path,
+        'status': response.status_code,
+        'latency_ms': round((time.perf_counter() - start) * 1000, 3),
+        'db_ms': round(g.get('db_time', 0.0) * 1000, 3),
+        'db_queries': g.get('db_queries', 0),
+        'user_id': _current_user_id(),
+    }})
+    return response
+
+
+def _file_handler(path, formatter, app):
+    if app.config['LOG_MAX_BYTES']:
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=app.config['LOG_MAX_BYTES'],
+            backupCount=app.config['LOG_BACKUP_COUNT'])
+    else:
+        handler = WatchedFileHandler(path)
+    handler.setFormatter(formatter)
+    handler.setLevel(logging.INFO)
+    return handler
+
+
+def _start(handlers):
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _running.add(listener)
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener):
+    """Flushes queued records and stops the listener thread (idempotent)."""
+    if listener in _running:
+        _running.discard(listener)
+        listener.stop()
+
+
+def restart_logging(app):
+    """Gives a forked worker its own queue and listener thread.
+
+    Threads don't survive fork: the parent's listener is forgotten (not
+    stopped, its thread isn't here) and a new one writes to the same files.
+    """
+    listener = app.extensions.get('log_listener')
+    if listener is None:
+        return None
+    _running.clear()
+    listener = _start(listener.handlers)
+    for logger in (app.logger, access_logger):
+        for handler in logger.handlers:
+            if isinstance(handler, QueueHandler):
+                handler.queue = listener.queue
+    app.extensions['log_listener'] = listener
+    return listener
+
+
+def init_logging(app):
+    """Routes app and access logs through a queue drained by a listener thread.
+
+    Args:
+        app (Flask): Application instance to attach logging to.
+
+    Returns:
+        QueueListener: The started listener (also stored in `app.extensions`).
+    """
+    log_dir = app.config['LOG_DIR']
+    os.makedirs(log_dir, exist_ok=True)
+
+    app_handler = _file_handler(os.path.join(log_dir, 'notez.log'), logging.Formatter(
+        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'), app)
+    access_handler = _file_handler(
+        os.path.join(log_dir, 'access.log'), JSONFormatter(), app)
+    # Each file handler only accepts records from its own logger
+    app_handler.addFilter(lambda record: record.name != access_logger.name)
+    access_handler.addFilter(lambda record: record.name == access_logger.name)
+
+    listener = _start([app_handler, access_handler])
+    queue_handler = QueueHandler(listener.queue)
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(logging.INFO)
+
+    if app.config['ACCESS_LOG_ENABLED']:
+        access_logger.handlers = [queue_handler]
+        access_logger.setLevel(logging.INFO)
+        access_logger.propagate = False
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(_start_timer)
+        app.after_request(_log_access)
+
+    app.extensions['log_listener'] = listener
+    return listener
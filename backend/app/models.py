@@ -4,7 +4,9 @@ from typing import List, Optional
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 from app import db
-from datetime import datetime, timezone
+from app.dbtypes import CompressedBinary, CompressedText
+from datetime import date, datetime, timezone
+from flask import url_for
 from werkzeug.security import generate_password_hash, check_password_hash
 import enum
 
@@ -22,17 +24,73 @@ note_tag_association = sa.Table(
     'note_tag',
     db.metadata,
     sa.Column('note_id', sa.ForeignKey('note.id'), primary_key=True),
-    sa.Column('tag_id', sa.ForeignKey('tag.id'), primary_key=True)
+    sa.Column('tag_id', sa.ForeignKey('tag.id'), primary_key=True),
+    sa.Index('ix_note_tag_tag_id', 'tag_id')  # The primary key only serves note_id lookups
 )
 
 todolist_tag_association = sa.Table(
     'todolist_tag',
     db.metadata,
     sa.Column('todolist_id', sa.ForeignKey('to_do_list.id'), primary_key=True),
-    sa.Column('tag_id', sa.ForeignKey('tag.id'), primary_key=True)
+    sa.Column('tag_id', sa.ForeignKey('tag.id'), primary_key=True),
+    sa.Index('ix_todolist_tag_tag_id', 'tag_id')
 )
 
 
+# --- Global Model Classes (always in the default database) ---
+class UserDirectory(db.Model):
+    """Global user directory.
+
+    Allocates user ids and answers username/email lookups without knowing
+    which shard a user lives on; `shard` names the database holding the
+    user's row and all of their data (see `app.sharding`).
+    """
+
+    __tablename__ = 'user_directory'
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    username: so.Mapped[str] = so.mapped_column(sa.String(80), index=True, unique=True)
+    email: so.Mapped[str] = so.mapped_column(sa.String(120), index=True, unique=True)
+    shard: so.Mapped[str] = so.mapped_column(sa.String(64), default='default')
+
+    def __repr__(self):
+        return f'<UserDirectory {self.username} @{self.shard}>'
+
+
+class RevokedToken(db.Model):
+    """Revoked JWT (e.g. after logout).
+
+    Checked through the in-process blocklist in `app.blocklist`; rows can be
+    deleted once `expires_at` has passed.
+    """
+
+    __tablename__ = 'revoked_token'
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    jti: so.Mapped[str] = so.mapped_column(sa.String(36), unique=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.Integer)  # In user_directory, maybe another db
+    expires_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), index=True)
+    revoked_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime(timezone=True), index=True, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<RevokedToken {self.jti}>'
+
+
+class IdBlock(db.Model):
+    """Ids handed out for a per-user table when there are several shards.
+
+    `allocated` is the highest id reserved so far; ids are unique across
+    shards, so a user moved to another shard keeps them (see
+    `app.sharding.IdAllocator`).
+    """
+
+    __tablename__ = 'id_block'
+    name: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    allocated: so.Mapped[int] = so.mapped_column(sa.BigInteger, default=0)
+
+    def __repr__(self):
+        return f'<IdBlock {self.name} {self.allocated}>'
+
+
 # --- Main Model Classes ---
 class User(db.Model):
     """User database model.
@@ -80,20 +138,19 @@ class User(db.Model):
         return check_password_hash(self.password_hash, password)
     
     def avatar(self, size=128):
-        """Generates a gender-specific avatar using the DiceBear API.
-        Uses a neutral style if gender is not specified.
+        """URL of a gender-specific avatar rendered by this API (see `app.avatars`).
+        Uses the initials if gender is not specified.
         """
-        # Use username as unique seed for the avatar
-        seed = self.username.lower()
-
-        style = "adventurer"
+        from app.avatars import RENDER_VERSION
 
         if self.gender in [GenderEnum.male, GenderEnum.female]:
-            gender_option = f"&gender={self.gender.value}"
-            return f"https://api.dicebear.com/8.x/{style}/svg?seed={seed}{gender_option}&size={size}"
+            # Use username as unique seed for the avatar
+            return url_for('api.get_avatar', style='adventurer', seed=self.username.lower(),
+                           gender=self.gender.value, size=size, v=RENDER_VERSION, _external=True)
         else:
             initials = (self.first_name[0] + self.last_name[0]).upper()
-            return f"https://api.dicebear.com/8.x/initials/svg?seed={initials}&size={size}&background-color=00897b,00acc1,26a69a"
+            return url_for('api.get_avatar', style='initials', seed=initials,
+                           size=size, v=RENDER_VERSION, _external=True)
 
     
 
@@ -104,7 +161,11 @@ class Note(db.Model):
     __tablename__ = 'note'
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     title: so.Mapped[str] = so.mapped_column(sa.String(200), nullable=True)
-    content: so.Mapped[str] = so.mapped_column(sa.Text)
+    content: so.Mapped[str] = so.mapped_column(  # Compressed at rest
+        CompressedText(min_size=1024), active_history=True)  # Old size for usage counters
+    # UTF-8 size of large notes, whose content is in `note_chunk` rows ('' here)
+    chunked_size: so.Mapped[int | None] = so.mapped_column(
+        sa.BigInteger, nullable=True, active_history=True)
     created_at: so.Mapped[datetime] = so.mapped_column(
         sa.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     updated_at: so.Mapped[datetime] = so.mapped_column(
@@ -117,18 +178,88 @@ class Note(db.Model):
     
     # Foreign Keys
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), index=True)
-    group_id: so.Mapped[int | None] = so.mapped_column(sa.ForeignKey('group.id'), nullable=True)
+    group_id: so.Mapped[int | None] = so.mapped_column(
+        sa.ForeignKey('group.id'), nullable=True, index=True)
 
     # ORM relationships
     author: so.Mapped["User"] = so.relationship(back_populates="notes")
     category: so.Mapped[Optional["Group"]] = so.relationship(back_populates="notes")
     tags: so.Mapped[List["Tag"]] = so.relationship(
         secondary=note_tag_association, back_populates="notes")
+    revisions: so.WriteOnlyMapped["NoteRevision"] = so.relationship(
+        back_populates="note", cascade="all, delete-orphan", passive_deletes=True)
+    chunks: so.WriteOnlyMapped["NoteChunk"] = so.relationship(
+        cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f'<Note {self.title}>'
+
+
+class NoteChunk(db.Model):
+    """Piece of a large note's UTF-8 content (see `app.chunks`).
+
+    Chunk `number` holds bytes `number * CHUNK_SIZE` up to the next chunk, so
+    a boundary may split a character; only the last chunk is shorter.
+    """
+
+    __tablename__ = 'note_chunk'
+    note_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('note.id', ondelete='CASCADE'), primary_key=True)
+    number: so.Mapped[int] = so.mapped_column(sa.Integer, primary_key=True)
+    data: so.Mapped[bytes] = so.mapped_column(CompressedBinary(min_size=1024))
+
+    def __repr__(self):
+        return f'<NoteChunk {self.note_id}#{self.number}>'
+
+
+class NoteRevision(db.Model):
+    """Note revision database model.
+
+    Every `snapshot_interval`-th revision stores the full (compressed) content;
+    the ones in between store a compressed line diff against the previous
+    revision. See `app.revisions`.
+    """
+
+    __tablename__ = 'note_revision'
+    __table_args__ = (sa.UniqueConstraint('note_id', 'number'),)
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    number: so.Mapped[int] = so.mapped_column(sa.Integer)  # 1, 2, ... per note
+    is_snapshot: so.Mapped[bool] = so.mapped_column(sa.Boolean)
+    title: so.Mapped[str | None] = so.mapped_column(sa.String(200), nullable=True)
+    data: so.Mapped[bytes] = so.mapped_column(sa.LargeBinary)
+    created_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    # Foreign Key
+    note_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('note.id', ondelete='CASCADE'))
+
+    # ORM Relationships
+    note: so.Mapped["Note"] = so.relationship(back_populates="revisions")
+
+    def __repr__(self):
+        return f'<NoteRevision {self.note_id}#{self.number}>'
     
 
+class NoteSignature(db.Model):
+    """MinHash signature of a note's content, for near-duplicate detection.
+
+    `signature` holds `app.dedup.NUM_PERM` little-endian uint32 values (empty
+    for notes without words); it is recomputed when the note has been
+    updated since `computed_at`.
+    """
+
+    __tablename__ = 'note_signature'
+    note_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('note.id', ondelete='CASCADE'), primary_key=True)
+    signature: so.Mapped[bytes] = so.mapped_column(sa.LargeBinary)
+    computed_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<NoteSignature {self.note_id}>'
+
+
 class Group(db.Model):
     """Group database model.
     """
@@ -177,9 +308,9 @@ class ToDoList(db.Model):
         sa.DateTime(timezone=True), nullable=True)
     
     # Foreign Keys
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'))
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), index=True)
     group_id: so.Mapped[int | None] = so.mapped_column(
-        sa.ForeignKey('group.id'), nullable=True)
+        sa.ForeignKey('group.id'), nullable=True, index=True)
     
     # ORM Relationships
     author: so.Mapped["User"] = so.relationship(back_populates="todolists")
@@ -199,12 +330,18 @@ class ToDoItem(db.Model):
     __tablename__ = 'to_do_item'
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     description: so.Mapped[str] = so.mapped_column(sa.String(500))
+    # active_history: the stats rollups need the previous values on change
     is_completed: so.Mapped[bool] = so.mapped_column(
-        sa.Boolean, default=False, server_default=sa.false())
+        sa.Boolean, default=False, server_default=sa.false(), active_history=True)
     created_at: so.Mapped[datetime] = so.mapped_column(
         sa.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc)
+    )
     completed_at: so.Mapped[datetime | None] = so.mapped_column(
-        sa.DateTime(timezone=True), nullable=True)
+        sa.DateTime(timezone=True), nullable=True, active_history=True)
     due_date: so.Mapped[datetime | None] = so.mapped_column(
         sa.DateTime(timezone=True), nullable=True)
     reminder_time: so.Mapped[datetime | None] = so.mapped_column(
@@ -229,7 +366,8 @@ class Tag(db.Model):
     created_at: so.Mapped[datetime] = so.mapped_column(
         sa.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     # A tag can be global (user_id is NULL) or user-specific.
-    user_id: so.Mapped[int | None] = so.mapped_column(sa.ForeignKey('user.id'), nullable=True)
+    user_id: so.Mapped[int | None] = so.mapped_column(
+        sa.ForeignKey('user.id'), nullable=True, index=True)
 
     # ORM Relationships
     creator: so.Mapped[Optional["User"]] = so.relationship(back_populates="tags")
@@ -240,3 +378,67 @@ class Tag(db.Model):
     
     def __repr__(self):
         return f'<Tag {self.name}>'
+
+
+class DailyStats(db.Model):
+    """Per-user, per-day (UTC) activity counters.
+
+    Kept up to date as notes and to-do items are written (see `app.stats`),
+    so `GET /api/stats` reads a few rows instead of scanning the user's
+    history. `flask stats backfill` rebuilds them from the source tables.
+    """
+
+    __tablename__ = 'daily_stats'
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), primary_key=True)
+    day: so.Mapped[date] = so.mapped_column(sa.Date, primary_key=True)
+    notes_created: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    notes_updated: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    items_created: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    items_completed: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    items_on_time: so.Mapped[int] = so.mapped_column(  # Completed by their due date
+        sa.Integer, default=0, server_default='0')
+    items_late: so.Mapped[int] = so.mapped_column(  # Completed after their due date
+        sa.Integer, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<DailyStats {self.user_id} {self.day}>'
+
+
+class UserUsage(db.Model):
+    """Per-user usage counters and plan, checked against `PLAN_QUOTAS`.
+
+    Updated in the same transaction as every note, to-do and tag write (see
+    `app.usage`), so quota checks read this one row instead of counting.
+    `note_bytes` is the UTF-8 size of the notes' content before compression.
+    """
+
+    __tablename__ = 'user_usage'
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), primary_key=True)
+    plan: so.Mapped[str] = so.mapped_column(sa.String(32), default='free', server_default='free')
+    notes: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    note_bytes: so.Mapped[int] = so.mapped_column(sa.BigInteger, default=0, server_default='0')
+    todolists: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    todo_items: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    tags: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<UserUsage {self.user_id} ({self.plan})>'
+
+
+class SyncOperation(db.Model):
+    """Result of an operation applied by `POST /api/sync/push`, by its key.
+
+    A retried operation (same user and idempotency key) gets this result
+    back instead of being applied again. Rows older than
+    `SYNC_KEY_RETENTION_DAYS` are deleted by `flask prune-sync-keys`.
+    """
+
+    __tablename__ = 'sync_operation'
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), primary_key=True)
+    key: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    result: so.Mapped[dict] = so.mapped_column(sa.JSON)
+    created_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime(timezone=True), index=True, default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<SyncOperation {self.user_id} {self.key}>'
@@ -0,0 +1,205 @@
+"""Moving users (and all their rows) between shards.
+
+Tables are copied in foreign-key order. A table belongs to a user if it has
+a foreign key to `user` or to another table that does, so new per-user
+tables are picked up without changes here. Rows are copied with their ids,
+which are unique across shards (see `IdAllocator` in `app.sharding`), so
+ids clients hold keep working. Rows written before ids were allocated that
+way may collide on the target; the move then fails and changes nothing.
+
+Tags are shared between users, so they are matched by name on the target
+and never deleted from the source (the user's own tags become global there).
+A tag whose name the target already has takes that tag's id, in links and
+in stored sync results, and no longer counts as the user's.
+"""
+import time
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.bulk import insert_ignore
+from app.models import UserDirectory
+from app.sharding import GLOBAL_TABLES, bind_key
+
+
+def _user_tables():
+    """Per-user tables in foreign-key (insert) order, excluding `user` itself."""
+    owned = {'user'}
+    tables = []
+    for table in db.metadata.sorted_tables:
+        if table.name in GLOBAL_TABLES or table.name == 'user':
+            continue
+        if any(fk.column.table.name in owned for fk in table.foreign_keys):
+            owned.add(table.name)
+            tables.append(table)
+    return tables
+
+
+def _owner_filter(table, user_id):
+    """WHERE clause selecting a user's rows of `table`, as nested subqueries."""
+    direct = [fk.parent == user_id for fk in table.foreign_keys
+              if fk.column.table.name == 'user']
+    if direct:
+        return sa.or_(*direct)
+    return sa.or_(*(
+        fk.parent.in_(sa.select(fk.column).where(_owner_filter(fk.column.table, user_id)))
+        for fk in table.foreign_keys if fk.column.table.name != 'tag'))
+
+
+def _map_tags(src, dst, tag_ids, user_id, copied):
+    """Maps source tag ids to target ids by name, copying missing tags.
+
+    Tags created by other users are created as global tags on the target,
+    since their creators don't exist there.
+
+    Returns:
+        int: The user's own tags whose name the target already had.
+    """
+    missing = set(tag_ids) - set(copied['tag'])
+    if not missing:
+        return 0
+    tag = db.metadata.tables['tag']
+    rows = src.execute(
+        sa.select(tag.c.id, tag.c.name, tag.c.user_id, tag.c.created_at)
+        .where(tag.c.id.in_(missing))).all()
+    dst.execute(insert_ignore(tag, dst.dialect.name),
+                [{'id': row.id, 'name': row.name, 'created_at': row.created_at,
+                  'user_id': user_id if row.user_id == user_id else None}
+                 for row in rows])
+    target = {row.name: row for row in dst.execute(
+        sa.select(tag.c.name, tag.c.id, tag.c.user_id).where(tag.c.name.in_([row.name for row in rows])))}
+    copied['tag'].update({row.id: target[row.name].id for row in rows})
+    return sum(1 for row in rows if row.user_id == user_id and target[row.name].user_id != user_id)
+
+
+def _copy(src, dst, user_id):
+    """Copies the user's rows, with their ids, from `src` to `dst` connections.
+
+    Returns:
+        dict: Rows copied per table.
+    """
+    user_table = db.metadata.tables['user']
+    dst.execute(sa.insert(user_table), [
+        src.execute(sa.select(user_table).where(user_table.c.id == user_id)).one()._asdict()])
+
+    # Id on the target by id on the source, per table (only tags may differ)
+    copied, counts, results, merged = {'user': {user_id: user_id}, 'tag': {}}, {}, [], 0
+    for table in _user_tables():
+        rows = [row._asdict() for row in src.execute(
+            sa.select(table).where(_owner_filter(table, user_id)))]
+        counts[table.name] = len(rows)
+        if table.name == 'sync_operation':  # Their results hold ids of rows not copied yet
+            results = rows
+            continue
+        if table.name == 'tag':
+            merged += _map_tags(src, dst, [row['id'] for row in rows], user_id, copied)
+            continue
+        if not rows:
+            continue
+
+        for fk in table.foreign_keys:
+            if fk.column.table.name == 'tag':
+                column = fk.parent.name
+                merged += _map_tags(src, dst, {row[column] for row in rows}, user_id, copied)
+                for row in rows:
+                    if row[column] is not None:
+                        row[column] = copied['tag'][row[column]]
+        dst.execute(sa.insert(table), rows)
+        if list(table.primary_key.columns.keys()) == ['id']:
+            copied[table.name] = {row['id']: row['id'] for row in rows}
+
+    if results:
+        from app.sync import move_result
+        merged += _map_tags(src, dst, {row['result']['id'] for row in results
+                                       if row['result'].get('type') == 'tag'}, user_id, copied)
+        for row in results:
+            row['result'] = move_result(row['result'], copied)
+        dst.execute(sa.insert(db.metadata.tables['sync_operation']), results)
+    if merged:  # Those are another user's (or global) tags on the target
+        usage = db.metadata.tables['user_usage']
+        dst.execute(sa.update(usage).where(usage.c.user_id == user_id)
+                    .values(tags=usage.c.tags - merged))
+    return counts
+
+
+def _delete(src, user_id):
+    """Deletes the user's rows from the `src` connection, children first."""
+    for table in reversed(_user_tables()):
+        if table.name == 'tag':  # Other users may use them
+            src.execute(sa.update(table).where(table.c.user_id == user_id).values(user_id=None))
+        else:
+            src.execute(sa.delete(table).where(_owner_filter(table, user_id)))
+    user_table = db.metadata.tables['user']
+    src.execute(sa.delete(user_table).where(user_table.c.id == user_id))
+
+
+def move_users(moves, grace=None):
+    """Moves users to other shards.
+
+    Each user's rows are copied to the target and the directory is pointed
+    at it; after `grace` seconds (so other processes' shard caches have
+    expired) the old copies are deleted.
+
+    Args:
+        moves (list): `(user_id, target shard)` pairs; `target` is `default`
+            or a `SHARD_DATABASE_URLS` name.
+        grace (float, optional): Defaults to `SHARD_MAP_TTL`.
+
+    Returns:
+        dict: Rows copied per user id (users already on their target are skipped).
+    """
+    shard_map = current_app.extensions['shards']
+    copied, sources = {}, {}
+    for user_id, target in moves:
+        entry = db.session.get(UserDirectory, user_id)
+        if entry is None:
+            raise ValueError(f'No user with id {user_id}')
+        if target not in shard_map.names:
+            raise ValueError(f'Unknown shard {target!r}')
+        if entry.shard == target:
+            continue
+
+        with db.engines[bind_key(entry.shard)].connect() as src, \
+                db.engines[bind_key(target)].begin() as dst:
+            copied[user_id] = sum(_copy(src, dst, user_id).values())
+        sources[user_id] = entry.shard
+        entry.shard = target
+        db.session.commit()
+        shard_map.forget(user_id)
+        current_app.logger.info('Moved user %s from %s to %s', user_id, sources[user_id], target)
+
+    if sources:
+        time.sleep(shard_map.ttl if grace is None else grace)
+    for user_id, source in sources.items():
+        with db.engines[bind_key(source)].begin() as src:
+            _delete(src, user_id)
+    return copied
+
+
+def plan_rebalance(shards):
+    """Picks moves that even out the number of users over `shards`.
+
+    Users on shards not in `shards` are all moved off them.
+
+    Returns:
+        list: `(user_id, source, target)` tuples.
+    """
+    counts = dict.fromkeys(shards, 0)
+    counts.update(db.session.execute(
+        sa.select(UserDirectory.shard, sa.func.count())
+        .group_by(UserDirectory.shard)).all())
+    quota = -(-sum(counts.values()) // len(shards))  # Most users a shard should keep
+
+    moves = []
+    for source in sorted(counts, key=counts.get, reverse=True):
+        extra = counts[source] - (quota if source in shards else 0)
+        if extra <= 0:
+            continue
+        user_ids = db.session.scalars(
+            sa.select(UserDirectory.id).where(UserDirectory.shard == source)
+            .order_by(UserDirectory.id.desc()).limit(extra)).all()
+        for user_id in user_ids:
+            target = min(shards, key=counts.get)
+            moves.append((user_id, source, target))
+            counts[source] -= 1
+            counts[target] += 1
+    return moves
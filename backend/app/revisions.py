@@ -0,0 +1,220 @@
+"""Note revision history stored as compressed line diffs between snapshots.
+
+Revision `n` of a note is either a snapshot (the full content, zlib
+compressed) or a delta against revision `n - 1`. A snapshot is written at
+least every `NOTE_REVISION_SNAPSHOT_INTERVAL` revisions, so rebuilding any
+revision reads one snapshot plus fewer than that many deltas.
+
+A delta is a JSON list of operations, each either `[start, end]` (copy lines
+`start:end` of the previous revision, to its end if `end` is null) or a
+string (insert these lines). An append or a title-only edit is recorded as
+`[[0, null], text]` without reading the note's content, which matters for
+large (chunked) notes.
+"""
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.chunks import read_content
+from app.models import NoteRevision
+from app.sharding import assign_ids
+from app.stats import add_counts
+
+
+def make_delta(old, new):
+    """Encodes `new` as compressed line operations against `old`."""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:  # 'replace' or 'insert'; 'delete' just skips old lines
+            ops.append(''.join(b[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode())
+
+
+def append_delta(text):
+    """A delta adding `text` to the end of the previous revision's content."""
+    ops = [[0, None], text] if text else [[0, None]]
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode())
+
+
+def apply_delta(old, delta):
+    """Rebuilds the new text from `old` and a delta made by `make_delta`."""
+    a = old.splitlines(keepends=True)
+    return ''.join(
+        ''.join(a[op[0]:op[1]]) if isinstance(op, list) else op
+        for op in json.loads(zlib.decompress(delta)))
+
+
+def snapshot_data(content):
+    """Encodes the full content of a snapshot revision."""
+    return zlib.compress(content.encode())
+
+
+class Appended(str):
+    """Content of a revision given as the text appended to the previous one
+    (`Appended('')` when only the title changed). It is stored as a delta
+    without reading the note's content, unless a snapshot is due.
+    """
+
+
+def record_revision(note, previous_content=None, content=None):
+    """Adds a revision holding the note's current title and content.
+
+    Must be called after the note is flushed (so it has an id) and before the
+    commit. `previous_content` is the content of the latest recorded revision,
+    i.e. the note's content before this write; without it, or when the
+    snapshot interval is reached, a full snapshot is stored. `content`
+    defaults to `note.content`, which is empty for large (chunked) notes; it
+    may be `Appended`, then `previous_content` isn't needed.
+
+    Returns:
+        dict: The `note_revision` row inserted.
+    """
+    return record_revisions([(note, previous_content, content)])[0]
+
+
+def record_revisions(changes):
+    """Adds revisions of several notes in two statements.
+
+    Their numbers are read in one query and the rows inserted in one
+    executemany (the ORM would insert them one by one on SQLite, since
+    their autoincrement ids can't be matched to a multi-row INSERT). The
+    notes' duplicate detection signatures are stored in one or two more
+    (see `app.dedup.store_signatures`), and revisions after the first
+    counted as edits in the daily rollups in one more (see `app.stats`).
+
+    Args:
+        changes (list): `(note, previous_content, content)` per note, as
+            passed to `record_revision`.
+
+    Returns:
+        list: The `note_revision` rows inserted.
+    """
+    interval = current_app.config['NOTE_REVISION_SNAPSHOT_INTERVAL']
+    numbers = {note_id: (last_number, last_snapshot) for note_id, last_number, last_snapshot
+               in db.session.execute(
+                   sa.select(
+                       NoteRevision.note_id,
+                       sa.func.max(NoteRevision.number),
+                       sa.func.max(NoteRevision.number).filter(NoteRevision.is_snapshot))
+                   .where(NoteRevision.note_id.in_({note.id for note, _, _ in changes}))
+                   .group_by(NoteRevision.note_id))}
+
+    revisions, contents = [], {}  # New content by note id (None when not read)
+    for note, previous_content, content in changes:
+        last_number, last_snapshot = numbers.get(note.id, (None, None))
+        number = (last_number or 0) + 1
+        appended = isinstance(content, Appended)
+        is_snapshot = (last_number is None or (previous_content is None and not appended)
+                       or number - (last_snapshot or 0) >= interval)
+        if is_snapshot:
+            text = (read_content(note) if appended or content is None else content) or ''
+            data = snapshot_data(text)
+        elif appended:
+            text, data = None, append_delta(content)
+        else:
+            text, data = content, make_delta(previous_content, content)
+        if content or not appended:  # Not a title-only edit
+            contents[note.id] = text
+        revisions.append({
+            'note_id': note.id,
+            'number': number,
+            'is_snapshot': is_snapshot,
+            'title': note.title,
+            'data': data})
+    db.session.execute(sa.insert(NoteRevision), assign_ids(NoteRevision.__table__, revisions))
+    today = datetime.now(timezone.utc).date()
+    add_counts({(user_id, today): Counter(notes_updated=count) for user_id, count in Counter(
+        note.user_id for (note, _, _), revision in zip(changes, revisions)
+        if revision['number'] > 1).items()})
+    if contents:
+        from app.dedup import store_signatures  # Loads NumPy
+        store_signatures(contents)
+    return revisions
+
+
+def reconstruct(note_id, number):
+    """Returns `(revision, content)` for revision `number` of a note.
+
+    Reads the closest snapshot at or before `number` and the deltas after it
+    in a single query. Returns `None` if the revision does not exist.
+    """
+    base = (
+        sa.select(sa.func.max(NoteRevision.number))
+        .where(NoteRevision.note_id == note_id,
+               NoteRevision.number <= number,
+               NoteRevision.is_snapshot)
+        .scalar_subquery()
+    )
+    chain = db.session.scalars(
+        sa.select(NoteRevision)
+        .where(NoteRevision.note_id == note_id,
+               NoteRevision.number >= base,
+               NoteRevision.number <= number)
+        .order_by(NoteRevision.number)
+    ).all()
+    if not chain or chain[-1].number != number:
+        return None
+
+    content = zlib.decompress(chain[0].data).decode()
+    for revision in chain[1:]:
+        content = apply_delta(content, revision.data)
+    return chain[-1], content
+
+
+def compact_revisions(older_than, keep_last=10, batch_size=500):
+    """Drops revisions created before `older_than`.
+
+    For each note, the newest `keep_last` revisions are always kept. The
+    oldest revision that survives is rewritten as a snapshot so it no longer
+    depends on the deleted ones.
+
+    Args:
+        older_than (datetime): Revisions created before this may be pruned.
+        keep_last (int, optional): Revisions to keep per note regardless of age.
+        batch_size (int, optional): Notes handled per transaction.
+
+    Returns:
+        int: Number of revisions deleted.
+    """
+    # Per note, the first revision number that must be kept
+    ranked = (
+        sa.select(
+            NoteRevision.note_id,
+            NoteRevision.number,
+            NoteRevision.created_at,
+            sa.func.row_number().over(
+                partition_by=NoteRevision.note_id,
+                order_by=NoteRevision.number.desc()).label('rank'))
+        .subquery()
+    )
+    first_kept = sa.func.min(sa.case(
+        (sa.or_(ranked.c.rank <= keep_last, ranked.c.created_at >= older_than),
+         ranked.c.number)))
+    keep_from = (
+        sa.select(ranked.c.note_id, first_kept)
+        .group_by(ranked.c.note_id)
+        .having(first_kept > sa.func.min(ranked.c.number))  # Something to prune
+    )
+    cutoffs = db.session.execute(keep_from).all()
+
+    deleted = 0
+    for start in range(0, len(cutoffs), batch_size):
+        for note_id, number in cutoffs[start:start + batch_size]:
+            revision, content = reconstruct(note_id, number)
+            if not revision.is_snapshot:
+                revision.is_snapshot = True
+                revision.data = snapshot_data(content)
+            deleted += db.session.execute(
+                sa.delete(NoteRevision)
+                .where(NoteRevision.note_id == note_id, NoteRevision.number < number)
+            ).rowcount
+        db.session.commit()
+    return deleted
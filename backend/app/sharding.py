@@ -0,0 +1,242 @@
+"""Horizontal sharding of user data across several databases.
+
+Every per-user table lives in each shard database; a user's rows all live in
+one shard. The default database (`DATABASE_URL`) holds the global
+`user_directory` table, which allocates user ids and maps each user to a
+shard. Shards are Flask-SQLAlchemy binds (`SHARD_DATABASE_URLS`, e.g.
+`shard1=sqlite:///shard1.db,shard2=sqlite:///shard2.db`); the name
+`default` refers to the default database itself. Without any binds sharding
+is off and everything uses the default database, as before.
+
+Statements on per-user tables are routed by `ShardedSession.get_bind` to:
+    1. the shard selected with `use_shard()`, if any;
+    2. otherwise, in a request, the shard of the user in the verified JWT.
+Everything else (and per-user tables outside both) uses the default database.
+
+Schema: `flask shards init` creates the tables in every database; with
+migrations, run `flask db upgrade` once per shard with `DATABASE_URL` set to
+that shard's URL. Users are moved with `flask shards move`/`rebalance`.
+
+Ids: with several shards, new rows of the per-user tables with an `id` key
+get ids that are unique across shards, reserved in the global `id_block`
+table (see `IdAllocator`), so a user keeps their ids when moved. ORM
+inserts get them in a `before_flush` hook; bulk INSERTs call `assign_ids`.
+"""
+import os
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import current_app, g, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+import sqlalchemy as sa
+
+DEFAULT_SHARD = 'default'
+# Tables that only exist in (and are always read from) the default database
+GLOBAL_TABLES = frozenset({'user_directory', 'revoked_token', 'id_block', 'alembic_version'})
+
+_selected_shard = ContextVar('selected_shard', default=None)
+
+
+def bind_key(shard):
+    """Flask-SQLAlchemy bind key of a shard (`None` is the default database)."""
+    return None if shard == DEFAULT_SHARD else shard
+
+
+@contextmanager
+def use_shard(shard):
+    """Routes per-user tables to `shard` inside the block (CLI jobs, login)."""
+    token = _selected_shard.set(shard)
+    try:
+        yield
+    finally:
+        _selected_shard.reset(token)
+
+
+def current_shard():
+    """Shard selected with `use_shard`, else that of the JWT user, else `None`."""
+    shard = _selected_shard.get()
+    if shard is None and has_request_context():
+        try:
+            identity = get_jwt_identity()
+        except RuntimeError:  # No token verified (yet) in this request
+            identity = None
+        if identity is not None:
+            user_id = int(identity)
+            cached = g.get('shard')  # (user id, shard) looked up earlier in this request
+            if cached is None or cached[0] != user_id:
+                cached = g.shard = (user_id, current_app.extensions['shards'].shard_for(user_id))
+            shard = cached[1]
+    return shard
+
+
+def _table_of(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table
+    if isinstance(clause, sa.Table):
+        return clause
+    if isinstance(clause, sa.UpdateBase) and isinstance(clause.table, sa.Table):
+        return clause.table
+    if isinstance(clause, sa.Select):
+        for from_ in clause.get_final_froms():
+            for table in sa.sql.util.find_tables(from_):
+                return table
+    return None
+
+
+class ShardedSession(Session):
+    """Session that sends per-user tables to the current user's shard."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and current_app.extensions['shards'].enabled:
+            table = _table_of(mapper, clause)
+            if table is not None and table.name not in GLOBAL_TABLES:
+                shard = current_shard()
+                if shard is not None:
+                    return self._db.engines[bind_key(shard)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def id_tables():
+    """Per-user tables whose rows get an `id` from `IdAllocator` (not `user`,
+    whose ids come from `user_directory`)."""
+    from app import db
+    return [table for table in db.metadata.sorted_tables
+            if table.name not in GLOBAL_TABLES and table.name != 'user'
+            and list(table.primary_key.columns.keys()) == ['id']]
+
+
+class IdAllocator:
+    """Ids of per-user tables that are unique across shards.
+
+    Server databases reserve `SHARD_ID_BLOCK_SIZE` ids at a time in
+    `id_block`, on a connection of their own (so the row isn't locked until
+    the caller commits), and hand them out from memory. SQLite allows one
+    writer at a time: there, exactly the ids needed are reserved in the
+    session's transaction, since a second connection would wait on the
+    session's own lock (and a rollback gives the ids back).
+    """
+
+    def __init__(self, app):
+        self.block_size = app.config['SHARD_ID_BLOCK_SIZE']
+        self._blocks = {}  # Table name: [next id, last id]
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def take(self, session, table, count):
+        """`count` new ids of `table`, as a list."""
+        from app.models import IdBlock
+        engine = session.get_bind(clause=IdBlock.__table__)
+        if engine.dialect.name == 'sqlite':
+            connection = session.connection(bind_arguments={'clause': IdBlock.__table__})
+            last = self._reserve(connection, table, count)
+            return list(range(last - count + 1, last + 1))
+
+        ids = []
+        with self._lock:
+            if self._pid != os.getpid():  # Forked: the parent's blocks aren't ours
+                self._blocks, self._pid = {}, os.getpid()
+            while len(ids) < count:
+                block = self._blocks.get(table.name)
+                if block is None or block[0] > block[1]:
+                    size = max(self.block_size, count - len(ids))
+                    with engine.begin() as connection:
+                        last = self._reserve(connection, table, size)
+                    block = self._blocks[table.name] = [last - size + 1, last]
+                taken = min(count - len(ids), block[1] - block[0] + 1)
+                ids.extend(range(block[0], block[0] + taken))
+                block[0] += taken
+        return ids
+
+    def _reserve(self, connection, table, count):
+        """Reserves the next `count` ids of `table`; returns the last one."""
+        from app import db
+        from app.bulk import insert_ignore
+        from app.models import IdBlock
+        blocks = IdBlock.__table__
+        reserve = (sa.update(blocks).where(blocks.c.name == table.name)
+                   .values(allocated=blocks.c.allocated + count))
+        if connection.execute(reserve).rowcount == 0:
+            # First reservation: start above the ids the table already has anywhere
+            highest = 0
+            for engine in db.engines.values():
+                with engine.connect() as other:
+                    highest = max(highest, other.scalar(sa.select(sa.func.max(table.c.id))) or 0)
+            connection.execute(insert_ignore(blocks, connection.dialect.name),
+                               [{'name': table.name, 'allocated': highest}])
+            connection.execute(reserve)
+        return connection.scalar(sa.select(blocks.c.allocated).where(blocks.c.name == table.name))
+
+
+def assign_ids(table, rows):
+    """Sets the `id` of rows about to be bulk inserted into `table` (dicts),
+    when ids are allocated across shards. Returns `rows`.
+    """
+    from app import db
+    shards = current_app.extensions['shards']
+    if shards.enabled and rows:
+        for row, id_ in zip(rows, shards.ids.take(db.session, table, len(rows))):
+            row['id'] = id_
+    return rows
+
+
+@sa.event.listens_for(ShardedSession, 'before_flush')
+def _assign_ids(session, flush_context, instances):
+    """Gives new ORM objects of the `id_tables` their ids."""
+    shards = current_app.extensions['shards']
+    if not shards.enabled:
+        return
+    tables = set(id_tables())
+    pending = defaultdict(list)
+    for obj in session.new:
+        table = sa.inspect(obj).mapper.local_table
+        if table in tables and obj.id is None:
+            pending[table].append(obj)
+    for table, objects in pending.items():
+        for obj, id_ in zip(objects, shards.ids.take(session, table, len(objects))):
+            obj.id = id_
+
+
+class ShardMap:
+    """User id to shard lookups, cached per process for `SHARD_MAP_TTL` seconds.
+
+    The cache only holds ids, so after a user is moved other processes keep
+    routing to the old shard for up to the TTL; `move_users` waits that long
+    before deleting the old copy.
+    """
+
+    def __init__(self, app):
+        self.shards = app.config['SHARDS']
+        self.ttl = app.config['SHARD_MAP_TTL']
+        self.names = [DEFAULT_SHARD] + list(app.config.get('SQLALCHEMY_BINDS') or {})
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.ids = IdAllocator(app)
+
+    @property
+    def enabled(self):
+        return len(self.names) > 1
+
+    def assign(self, user_id):
+        """Shard a new user is created on."""
+        return self.shards[user_id % len(self.shards)]
+
+    def shard_for(self, user_id):
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        from app import db
+        from app.models import UserDirectory
+        shard = db.session.scalar(
+            sa.select(UserDirectory.shard).where(UserDirectory.id == user_id)) or DEFAULT_SHARD
+        with self._lock:
+            if len(self._cache) > 100_000:
+                self._cache.clear()
+            self._cache[user_id] = (shard, time.monotonic() + self.ttl)
+        return shard
+
+    def forget(self, user_id):
+        self._cache.pop(user_id, None)
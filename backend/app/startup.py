@@ -0,0 +1,82 @@
+"""Startup timing, import profiling and database warm-up helpers.
+"""
+import re
+import sys
+import time
+import subprocess
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Records how long each step of `create_app` takes."""
+
+    def __init__(self):
+        self.steps = {}
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = time.perf_counter() - start
+
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def profile_imports(code='from app import create_app; create_app()', cwd=None):
+    """Runs `code` in a fresh interpreter with `-X importtime`.
+
+    Args:
+        code (str, optional): Python source to profile.
+        cwd (str, optional): Working directory for the child interpreter.
+
+    Returns:
+        list: `(package, cumulative_seconds)` for every top-level package the
+            code imported directly (or that `app` imported), slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=cwd, capture_output=True, text=True)
+    totals = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # Depth 0 are imports made by `code`; depth 1 are the ones `app` made itself
+        if indent > 2 or (indent == 0 and name == 'app'):
+            continue
+        package = name.split('.')[0] if not name.startswith('app.') else name
+        totals[package] = totals.get(package, 0) + cumulative / 1e6
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def warm_up(app, connections):
+    """Fills the connection pool and the compiled statement cache.
+
+    Opens `connections` pooled connections at once so they are all established
+    before the first request, then runs the hottest API statements once so
+    SQLAlchemy's compiled cache already holds them.
+    """
+    import sqlalchemy as sa
+    from app import db
+    from app.models import User, Note
+
+    statements = [
+        sa.select(User).where(User.username == ''),
+        sa.select(Note).where(Note.user_id == 0).order_by(Note.updated_at.desc()),
+    ]
+    with app.app_context():
+        opened = [db.engine.connect() for _ in range(connections)]
+        try:
+            for conn in opened:
+                conn.execute(sa.text('SELECT 1'))
+            for statement in statements:
+                opened[0].execute(statement).all()
+        except sa.exc.DBAPIError as e:  # e.g. tables not migrated yet
+            app.logger.warning('Database warm-up failed: %s', e)
+        finally:
+            for conn in opened:
+                conn.close()  # Returned to the pool, still connected
@@ -0,0 +1,218 @@
+"""Daily activity rollups behind `GET /api/stats`.
+
+`daily_stats` holds one row of counters per user and UTC day. Every ORM
+flush that creates a note, creates a to-do item or (un)completes one adds
+to the counters of the affected days with one upsert, so reading a user's
+trends never scans their notes or items. Note edits are counted by
+`record_revisions`, one per revision after the first, which is what
+`backfill_stats` counts too (an edit may take several flushes). Writes
+that bypass the ORM (the archive importer) call `add_counts` themselves.
+`backfill_stats` rebuilds the table from the source tables.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from app import db
+from app.bulk import upsert_add
+from app.models import DailyStats, Note, NoteRevision, ToDoItem, ToDoList, User
+from app.sharding import ShardedSession
+
+COUNTERS = ('notes_created', 'notes_updated', 'items_created',
+            'items_completed', 'items_on_time', 'items_late')
+
+
+def _utc(value):
+    """Aware UTC datetime (SQLite returns naive ones, which are UTC)."""
+    if value is None:
+        return datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _completion(completed_at, due_date, sign=1):
+    """Counters for completing an item (`sign=-1` for undoing that)."""
+    counts = Counter(items_completed=sign)
+    if due_date is not None:
+        on_time = _utc(completed_at) <= _utc(due_date)
+        counts['items_on_time' if on_time else 'items_late'] += sign
+    return counts
+
+
+def add_counts(deltas, connection=None):
+    """Adds counters to the users' rollups in one statement.
+
+    Args:
+        deltas (dict): `Counter` of counter name to amount per `(user_id, day)`.
+        connection (optional): Connection to use instead of `db.session`.
+    """
+    rows = [{'user_id': user_id, 'day': day, **{name: counts.get(name, 0) for name in COUNTERS}}
+            for (user_id, day), counts in deltas.items() if any(counts.values())]
+    if not rows:
+        return
+    table = DailyStats.__table__
+    if connection is None:
+        db.session.execute(upsert_add(table, ['user_id', 'day'], COUNTERS), rows)
+    else:
+        connection.execute(
+            upsert_add(table, ['user_id', 'day'], COUNTERS, connection.dialect.name), rows)
+
+
+@sa.event.listens_for(ShardedSession, 'after_flush')
+def _update_rollups(session, flush_context):
+    """Counts the notes and to-do items created (or completed) by a flush."""
+    deltas = defaultdict(Counter)
+    items = []  # (to-do list id, day, counters); the owner is on the list
+
+    for obj in session.new:
+        if isinstance(obj, Note):
+            deltas[obj.user_id, _utc(obj.created_at).date()]['notes_created'] += 1
+        elif isinstance(obj, ToDoItem):
+            items.append((obj.todolist_id, _utc(obj.created_at).date(), Counter(items_created=1)))
+            if obj.is_completed:
+                items.append((obj.todolist_id, _utc(obj.completed_at).date(),
+                              _completion(obj.completed_at, obj.due_date)))
+
+    for obj in session.dirty:
+        if isinstance(obj, ToDoItem):
+            history = sa.inspect(obj).attrs.is_completed.history
+            was_completed = bool(history.deleted and history.deleted[0])
+            if not history.has_changes() or was_completed == bool(obj.is_completed):
+                continue
+            if obj.is_completed:
+                items.append((obj.todolist_id, _utc(obj.completed_at).date(),
+                              _completion(obj.completed_at, obj.due_date)))
+            else:  # Undo the count on the day it was completed
+                previous = sa.inspect(obj).attrs.completed_at.history
+                completed_at = previous.deleted[0] if previous.deleted else obj.completed_at
+                if completed_at is not None:
+                    items.append((obj.todolist_id, _utc(completed_at).date(),
+                                  _completion(completed_at, obj.due_date, sign=-1)))
+
+    if not deltas and not items:
+        return
+    connection = session.connection(bind_arguments={'clause': DailyStats.__table__})
+    if items:
+        owners = dict(connection.execute(
+            sa.select(ToDoList.id, ToDoList.user_id)
+            .where(ToDoList.id.in_({todolist_id for todolist_id, _, _ in items}))).all())
+        for todolist_id, day, counts in items:
+            deltas[owners[todolist_id], day].update(counts)
+    add_counts(deltas, connection)
+
+
+def _day(column, dialect):
+    """SQL expression for the UTC date of a datetime column."""
+    if dialect == 'sqlite':  # Stored as UTC text
+        return sa.func.date(column, type_=sa.Date)
+    if dialect == 'postgresql':
+        return sa.cast(sa.func.timezone('UTC', column), sa.Date)
+    return sa.cast(column, sa.Date)
+
+
+def _aggregates(user_ids, dialect):
+    """Queries yielding `(user_id, day, counters...)` rows for `user_ids`."""
+    day = _day(Note.created_at, dialect)
+    yield (sa.select(Note.user_id, day.label('day'), sa.func.count().label('notes_created'))
+           .where(Note.user_id.in_(user_ids))
+           .group_by(Note.user_id, day))
+
+    # Revision 1 is the note's creation, later ones are edits
+    day = _day(NoteRevision.created_at, dialect)
+    yield (sa.select(Note.user_id, day.label('day'), sa.func.count().label('notes_updated'))
+           .join(Note, NoteRevision.note_id == Note.id)
+           .where(Note.user_id.in_(user_ids), NoteRevision.number > 1)
+           .group_by(Note.user_id, day))
+
+    day = _day(ToDoItem.created_at, dialect)
+    yield (sa.select(ToDoList.user_id, day.label('day'), sa.func.count().label('items_created'))
+           .join(ToDoList, ToDoItem.todolist_id == ToDoList.id)
+           .where(ToDoList.user_id.in_(user_ids))
+           .group_by(ToDoList.user_id, day))
+
+    day = _day(ToDoItem.completed_at, dialect)
+    has_due_date = ToDoItem.due_date.is_not(None)
+    yield (sa.select(
+               ToDoList.user_id, day.label('day'),
+               sa.func.count().label('items_completed'),
+               sa.func.sum(sa.case(
+                   (has_due_date & (ToDoItem.completed_at <= ToDoItem.due_date), 1),
+                   else_=0)).label('items_on_time'),
+               sa.func.sum(sa.case(
+                   (has_due_date & (ToDoItem.completed_at > ToDoItem.due_date), 1),
+                   else_=0)).label('items_late'))
+           .join(ToDoList, ToDoItem.todolist_id == ToDoList.id)
+           .where(ToDoList.user_id.in_(user_ids), ToDoItem.is_completed,
+                  ToDoItem.completed_at.is_not(None))
+           .group_by(ToDoList.user_id, day))
+
+
+def backfill_stats(batch_size=500):
+    """Rebuilds `daily_stats` from notes, revisions and to-do items.
+
+    Runs one grouped query per source table and batch of `batch_size` users,
+    then replaces those users' rollups in the same transaction. Edits whose
+    revisions were compacted away are no longer counted.
+
+    Returns:
+        int: Number of users processed.
+    """
+    table = DailyStats.__table__
+    dialect = db.session.get_bind(clause=table).dialect.name
+    last_id = processed = 0
+    while True:
+        user_ids = db.session.scalars(
+            sa.select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)).all()
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        deltas = defaultdict(Counter)
+        for query in _aggregates(user_ids, dialect):
+            for row in db.session.execute(query).mappings():
+                counts = {name: row[name] for name in COUNTERS if name in row}
+                deltas[row['user_id'], row['day']].update(counts)
+
+        db.session.execute(sa.delete(table).where(table.c.user_id.in_(user_ids)))
+        add_counts(deltas)
+        db.session.commit()
+        processed += len(user_ids)
+    return processed
+
+
+def _totals(rows):
+    totals = dict.fromkeys(COUNTERS, 0)
+    for row in rows:
+        if row is not None:
+            for name in COUNTERS:
+                totals[name] += getattr(row, name)
+    return totals
+
+
+def get_stats(user_id, days=30, weeks=12):
+    """Daily and weekly (Monday to Sunday, UTC) counters up to today.
+
+    Reads at most `max(days, 7 * weeks)` rollup rows, however long the
+    user's history is.
+
+    Returns:
+        dict: `daily` (oldest first, one entry per day) and `weekly` lists.
+    """
+    today = datetime.now(timezone.utc).date()
+    first_day = today - timedelta(days=days - 1)
+    first_week = today - timedelta(days=today.weekday(), weeks=weeks - 1)
+    rows = db.session.scalars(
+        sa.select(DailyStats)
+        .where(DailyStats.user_id == user_id, DailyStats.day >= min(first_day, first_week))
+    ).all()
+    by_day = {row.day: row for row in rows}
+
+    daily = [{'date': (first_day + timedelta(days=i)).isoformat(),
+              **_totals([by_day.get(first_day + timedelta(days=i))])}
+             for i in range(days)]
+    weekly = []
+    for i in range(weeks):
+        start = first_week + timedelta(weeks=i)
+        weekly.append({'week_start': start.isoformat(),
+                       **_totals(by_day.get(start + timedelta(days=d)) for d in range(7))})
+    return {'daily': daily, 'weekly': weekly}
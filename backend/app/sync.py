@@ -0,0 +1,482 @@
+"""Batched replay of offline edits (`POST /api/sync/push`).
+
+A batch is an ordered list of operations:
+
+    {"key": "c1f0...", "op": "update", "type": "note", "id": 12,
+     "updated_at": "2024-06-01T09:30:00+00:00", "data": {"title": "New"}}
+
+`op` is `create`, `update` or `delete` and `type` is `note`, `todolist`,
+`item` or `tag`. `key` is the client's idempotency key: results of
+applied operations are stored in `sync_operation`, so a retried operation
+gets its first result back instead of being applied twice. An id (`id`,
+or an item's `todolist_id`) may also be the key of the create operation
+of an object made offline, in the same batch or an earlier one.
+
+The batch is one transaction. Targets are loaded with one query per type,
+the changes are made on the ORM objects and written by one flush, which
+batches the INSERTs and UPDATEs per table (and lets the usage and stats
+hooks count them); deletes are bulk DELETEs. An update or delete whose
+`updated_at` differs from the row's before the batch is a `conflict` and
+is skipped, as are `invalid` operations and those whose target is
+`not_found`; the rest of the batch is still applied. Tags have no
+`updated_at`, so their updates aren't checked.
+"""
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from app import db
+from app.bulk import normalize_tag_name
+from app.chunks import note_size, read_content, set_content
+from app.models import (Group, Note, NoteChunk, NoteRevision, NoteSignature, SyncOperation, Tag,
+                        ToDoItem, ToDoList, note_tag_association, todolist_tag_association)
+from app.revisions import Appended, record_revisions
+from app.usage import add_usage, check_quota, get_usage
+
+TYPES = {'note': Note, 'todolist': ToDoList, 'item': ToDoItem, 'tag': Tag}
+ACTIONS = ('create', 'update', 'delete')
+MAX_KEY_LENGTH = 64
+
+
+class Rejected(Exception):
+    """An operation that is skipped; `status` is its result status."""
+
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status, self.details = status, details
+
+
+def _text(max_length=None):
+    def parse(value):
+        if value is not None and not isinstance(value, str):
+            raise ValueError('must be a string')
+        if value is not None and max_length and len(value) > max_length:
+            raise ValueError(f'must be at most {max_length} characters')
+        return value
+    return parse
+
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise ValueError('must be true or false')
+    return value
+
+
+def _datetime(value):
+    if value is None:
+        return None
+    try:
+        return _aware(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        raise ValueError('must be an ISO 8601 date and time') from None
+
+
+def _id(value):
+    """An id, or the key of the operation that created the object."""
+    if value is None or isinstance(value, str) or (
+            isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    raise ValueError('must be an id or the key of a create operation')
+
+
+def _group_id(value):
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+        raise ValueError('must be a group id')
+    return value
+
+
+FIELDS = {
+    'note': {'title': _text(200), 'content': _text(), 'group_id': _group_id},
+    'todolist': {'title': _text(200), 'group_id': _group_id},
+    'item': {'description': _text(500), 'is_completed': _flag, 'due_date': _datetime,
+             'reminder_time': _datetime, 'todolist_id': _id},
+    'tag': {'name': _text(100)},
+}
+REQUIRED = {'todolist': ('title',), 'item': ('description', 'todolist_id'), 'tag': ('name',)}
+
+
+def _aware(value):
+    """Aware UTC datetime (SQLite returns naive ones, which are UTC)."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def parse_operation(op):
+    """Validates an operation (whose key was checked already).
+
+    Returns:
+        dict: `key`, `action`, `type`, `id`, `updated_at` and `data` (parsed).
+    """
+    action, kind, data = op.get('op'), op.get('type'), op.get('data') or {}
+    if action not in ACTIONS:
+        raise Rejected('invalid', f'`op` must be one of {", ".join(ACTIONS)}')
+    if kind not in TYPES:
+        raise Rejected('invalid', f'`type` must be one of {", ".join(TYPES)}')
+    if not isinstance(data, dict):
+        raise Rejected('invalid', '`data` must be an object')
+    unknown = sorted(set(data) - set(FIELDS[kind]))
+    if unknown:
+        raise Rejected('invalid', f'Unknown {kind} fields: {", ".join(unknown)}')
+    try:
+        data = {name: FIELDS[kind][name](value) for name, value in data.items()}
+        target, base = _id(op.get('id')), _datetime(op.get('updated_at'))
+    except ValueError as e:
+        raise Rejected('invalid', str(e)) from None
+
+    required = REQUIRED.get(kind, ())
+    if any(data.get(name, '') is None for name in required):
+        raise Rejected('invalid', f'{", ".join(required)} can\'t be null')
+    if action == 'create':
+        missing = [name for name in required if name not in data]
+        if missing:
+            raise Rejected('invalid', f'Missing {", ".join(missing)}')
+        if kind == 'note' and not data.get('title') and not data.get('content'):
+            raise Rejected('invalid', 'A note must have either a title or content.')
+    elif target is None:
+        raise Rejected('invalid', f'`id` is required to {action} a {kind}')
+    return {'key': op['key'], 'action': action, 'type': kind, 'id': target,
+            'updated_at': base, 'data': data}
+
+
+class _Batch:
+    """Objects loaded, created and deleted while a batch is applied."""
+
+    def __init__(self, user_id, stored):
+        self.user_id = user_id
+        self.stored = stored  # Results of earlier batches by key
+        self.objects = {}  # (type, id): object loaded
+        self.created = {}  # Key: (type, object)
+        self.originals = {}  # Object: (updated_at, title, content or None if chunked and unread, size)
+        self.contents = {}  # Note: content set by this batch
+        self.item_lists = {}  # Item: its to-do list, for items created or moved
+        self.deleted = {}  # Objects to delete (a dict keeps their order)
+        self.groups = set()  # Ids of the referenced groups the user owns
+        self.tags = {}  # Name: tag, of the names created or renamed to
+
+    def load(self, operations):
+        """Loads the user's objects the operations refer to, one query per type."""
+        ids = {kind: set() for kind in TYPES}
+        groups, names = set(), set()
+        for op in operations:
+            targets = [] if op['action'] == 'create' else [(op['type'], op['id'])]
+            if 'todolist_id' in op['data']:
+                targets.append(('todolist', op['data']['todolist_id']))
+            for kind, value in targets:
+                if isinstance(value, str):  # Key of an earlier batch's create
+                    value = (self.stored.get(value) or {}).get('id')
+                if value is not None:
+                    ids[kind].add(value)
+            if op['data'].get('group_id') is not None:
+                groups.add(op['data']['group_id'])
+            if op['type'] == 'tag' and op['data'].get('name') is not None:
+                names.add(normalize_tag_name(op['data']['name']))
+
+        queries = {
+            'note': sa.select(Note).where(Note.user_id == self.user_id),
+            'todolist': sa.select(ToDoList).where(ToDoList.user_id == self.user_id),
+            'item': sa.select(ToDoItem).join(ToDoList, ToDoItem.todolist_id == ToDoList.id)
+                      .where(ToDoList.user_id == self.user_id),
+            'tag': sa.select(Tag).where(Tag.user_id == self.user_id),
+        }
+        for kind, wanted in ids.items():
+            if not wanted:
+                continue
+            for obj in db.session.scalars(queries[kind].where(TYPES[kind].id.in_(wanted))):
+                self.objects[kind, obj.id] = obj
+                if kind == 'note':
+                    self.originals[obj] = (obj.updated_at, obj.title,
+                                           obj.content if obj.chunked_size is None else None,
+                                           note_size(obj.content, obj.chunked_size))
+                elif kind != 'tag':
+                    self.originals[obj] = (obj.updated_at,)
+        if groups:
+            self.groups = set(db.session.scalars(
+                sa.select(Group.id).where(Group.user_id == self.user_id, Group.id.in_(groups))))
+        if names:
+            self.tags = {tag.name: tag for tag in db.session.scalars(
+                sa.select(Tag).where(Tag.name.in_(names)))}
+
+    def is_deleted(self, obj):
+        if obj in self.deleted:
+            return True
+        if isinstance(obj, ToDoItem):
+            todolist = self.item_lists.get(obj) or self.objects.get(('todolist', obj.todolist_id))
+            return todolist in self.deleted
+        return False
+
+    def resolve(self, kind, value):
+        """The object of type `kind` with id `value`, or created by operation `value`."""
+        if isinstance(value, str):
+            if value in self.created:
+                created_kind, obj = self.created[value]
+            elif value in self.stored:
+                created_kind = self.stored[value].get('type')
+                obj = self.objects.get((kind, self.stored[value].get('id')))
+            else:
+                raise Rejected('not_found', f'No operation with key {value!r} created an object')
+            if created_kind != kind:
+                raise Rejected('invalid', f'Operation {value!r} did not create a {kind}')
+        else:
+            obj = self.objects.get((kind, value))
+        if obj is None or self.is_deleted(obj) or (
+                isinstance(obj, Tag) and obj.user_id != self.user_id):
+            raise Rejected('not_found', f'{kind.capitalize()} {value} not found')
+        return obj
+
+    def _check_group(self, data):
+        if data.get('group_id') is not None and data['group_id'] not in self.groups:
+            raise Rejected('not_found', f'Group {data["group_id"]} not found')
+
+    def _tag_name(self, name, tag=None):
+        name = normalize_tag_name(name)
+        if not name:
+            raise Rejected('invalid', 'Tag names can\'t be empty')
+        existing = self.tags.get(name)
+        if existing is not None and existing is not tag and self.is_deleted(existing):
+            raise Rejected('conflict', f'Tag {name!r} is deleted by this batch')
+        return name, existing
+
+    def apply(self, op):
+        """Applies one operation to the session; raises `Rejected` if it can't be."""
+        kind, data = op['type'], op['data']
+        if op['action'] == 'create':
+            self._check_group(data)
+            obj = self.create(kind, data)
+            self.created[op['key']] = (kind, obj)
+            return obj
+
+        obj = self.resolve(kind, op['id'])
+        original = self.originals.get(obj)
+        if op['updated_at'] is not None and original is not None \
+                and _aware(original[0]) != op['updated_at']:
+            raise Rejected('conflict', f'{kind.capitalize()} changed since {op["updated_at"]}',
+                           current_updated_at=_aware(original[0]).isoformat())
+        if op['action'] == 'delete':
+            self.deleted[obj] = None
+        else:
+            self._check_group(data)
+            self.update(kind, obj, data)
+        return obj
+
+    def create(self, kind, data):
+        if kind == 'tag':
+            name, tag = self._tag_name(data['name'])
+            if tag is None:  # Names are unique across users, like `upsert_tags`
+                tag = self.tags[name] = Tag(name=name, user_id=self.user_id)
+                db.session.add(tag)
+            return tag
+
+        if kind == 'item':
+            todolist = self.resolve('todolist', data['todolist_id'])
+            completed = data.get('is_completed', False)
+            obj = ToDoItem(description=data['description'], is_completed=completed,
+                           completed_at=datetime.now(timezone.utc) if completed else None,
+                           due_date=data.get('due_date'), reminder_time=data.get('reminder_time'),
+                           todolist=todolist)
+            self.item_lists[obj] = todolist
+        elif kind == 'todolist':
+            obj = ToDoList(title=data['title'], group_id=data.get('group_id'), user_id=self.user_id)
+        else:
+            obj = Note(title=data.get('title'), group_id=data.get('group_id'), user_id=self.user_id)
+        db.session.add(obj)
+        if kind == 'note':
+            self.contents[obj] = data.get('content') or ''
+            set_content(obj, self.contents[obj])
+        return obj
+
+    def update(self, kind, obj, data):
+        # Everything is checked before the object is changed
+        if kind == 'note':
+            title = data.get('title', obj.title)
+            has_content = data['content'] if 'content' in data \
+                else obj.content or obj.chunked_size is not None
+            if not title and not has_content:
+                raise Rejected('invalid', 'A note must have either a title or content.')
+        todolist = self.resolve('todolist', data['todolist_id']) if 'todolist_id' in data else None
+        if 'name' in data:
+            name, existing = self._tag_name(data['name'], obj)
+            if existing is not None and existing is not obj:
+                raise Rejected('conflict', f'Tag {name!r} already exists')
+
+        for field, value in data.items():
+            if field == 'content':
+                original = self.originals.get(obj)
+                if original is not None and original[2] is None and obj not in self.contents:
+                    # Read the chunks before they are replaced, to diff against them
+                    self.originals[obj] = (*original[:2], read_content(obj), original[3])
+                self.contents[obj] = value or ''
+                set_content(obj, self.contents[obj])
+            elif field == 'todolist_id':
+                obj.todolist = self.item_lists[obj] = todolist
+            elif field == 'is_completed':
+                if value != obj.is_completed:
+                    obj.completed_at = datetime.now(timezone.utc) if value else None
+                obj.is_completed = value
+            elif field == 'name':
+                self.tags.pop(obj.name, None)
+                obj.name = name
+                self.tags[name] = obj
+            else:
+                setattr(obj, field, value)
+
+    def revisions(self):
+        """`record_revisions` changes of the notes created or edited (not deleted)."""
+        changes = []
+        notes = {obj for _, obj in self.created.values() if isinstance(obj, Note)}
+        notes.update(obj for (kind, _), obj in self.objects.items() if kind == 'note')
+        for note in notes:
+            if self.is_deleted(note):
+                continue
+            _, title, previous, _ = self.originals.get(note, (None, None, None, 0))
+            content = self.contents.get(note)
+            if note in self.originals and note.title == title \
+                    and (content is None or content == previous):
+                continue
+            if content is None:  # Only the title changed, the content needn't be read
+                content = Appended('')
+            changes.append((note, previous, content))
+        return changes
+
+    def additions(self):
+        """Notes and note bytes the batch adds (negative if it frees some)."""
+        notes = note_bytes = 0
+        for note in {obj for _, obj in self.created.values() if isinstance(obj, Note)} \
+                | {obj for obj in self.originals if isinstance(obj, Note)}:
+            original = self.originals[note][3] if note in self.originals else 0
+            deleted = self.is_deleted(note)
+            notes += (0 if deleted else 1) - (1 if note in self.originals else 0)
+            note_bytes += (0 if deleted else note_size(note.content, note.chunked_size)) - original
+        return notes, note_bytes
+
+    def delete(self):
+        """Deletes the objects marked for deletion with bulk DELETEs.
+
+        Links, revisions, chunks, signatures and the items of deleted lists
+        go with them; the usage counters are updated here, since the ORM
+        flush hooks don't see these statements.
+        """
+        ids = {kind: [obj.id for obj in self.deleted if isinstance(obj, model)]
+               for kind, model in TYPES.items()}
+        counts = {'notes': -len(ids['note']), 'todolists': -len(ids['todolist']),
+                  'tags': -len(ids['tag']),
+                  'note_bytes': -sum(note_size(obj.content, obj.chunked_size)
+                                     for obj in self.deleted if isinstance(obj, Note))}
+        items = len(ids['item'])
+        if ids['todolist']:
+            items += db.session.scalar(
+                sa.select(sa.func.count()).select_from(ToDoItem)
+                .where(ToDoItem.todolist_id.in_(ids['todolist']), ToDoItem.id.not_in(ids['item'])))
+        counts['todo_items'] = -items
+
+        if ids['tag']:
+            for association in (note_tag_association, todolist_tag_association):
+                db.session.execute(sa.delete(association)
+                                   .where(association.c.tag_id.in_(ids['tag'])))
+        if ids['item']:
+            db.session.execute(sa.delete(ToDoItem).where(ToDoItem.id.in_(ids['item'])))
+        if ids['todolist']:
+            db.session.execute(sa.delete(ToDoItem).where(ToDoItem.todolist_id.in_(ids['todolist'])))
+            db.session.execute(sa.delete(todolist_tag_association)
+                               .where(todolist_tag_association.c.todolist_id.in_(ids['todolist'])))
+        if ids['note']:
+            db.session.execute(sa.delete(note_tag_association)
+                               .where(note_tag_association.c.note_id.in_(ids['note'])))
+            for model in (NoteRevision, NoteChunk, NoteSignature):
+                db.session.execute(sa.delete(model).where(model.note_id.in_(ids['note'])))
+        for kind in ('tag', 'todolist', 'note'):
+            if ids[kind]:
+                model = TYPES[kind]
+                db.session.execute(sa.delete(model).where(model.id.in_(ids[kind])),
+                                   execution_options={'synchronize_session': False})
+        for obj in [*self.objects.values(), *(obj for _, obj in self.created.values())]:
+            if obj in db.session and self.is_deleted(obj):
+                db.session.expunge(obj)
+        add_usage({self.user_id: counts})
+
+
+def _result(op, status, **fields):
+    return {'key': op.get('key') if isinstance(op, dict) else None, 'status': status,
+            'type': op.get('type') if isinstance(op, dict) else None, **fields}
+
+
+def apply_batch(user_id, operations):
+    """Applies an ordered batch of operations of `user_id`, without committing.
+
+    Raises `QuotaExceeded` (after writing: roll back) if the batch takes
+    the user over their plan.
+
+    Returns:
+        list: Per operation: `key`, `status` (`applied`, `replayed`,
+            `conflict`, `not_found` or `invalid`) and `type`; `id` and
+            `updated_at` if applied, `error` (and `current_updated_at` for
+            conflicts) otherwise.
+    """
+    results, parsed, keys = [None] * len(operations), {}, set()
+    for i, op in enumerate(operations):
+        try:
+            key = op.get('key') if isinstance(op, dict) else None
+            if not isinstance(key, str) or not 0 < len(key) <= MAX_KEY_LENGTH:
+                raise Rejected('invalid', f'`key` must be a string of 1 to {MAX_KEY_LENGTH} characters')
+            if key in keys:
+                raise Rejected('invalid', f'Duplicate key {key!r} in batch')
+            keys.add(key)
+            parsed[i] = parse_operation(op)
+        except Rejected as e:
+            results[i] = _result(op, e.status, error=str(e), **e.details)
+
+    references = {value for op in parsed.values()
+                  for value in (op['id'], op['data'].get('todolist_id')) if isinstance(value, str)}
+    stored = dict(db.session.execute(
+        sa.select(SyncOperation.key, SyncOperation.result)
+        .where(SyncOperation.user_id == user_id, SyncOperation.key.in_(keys | references))).all())
+    for i in [i for i, op in parsed.items() if op['key'] in stored]:
+        results[i] = {**stored[parsed.pop(i)['key']], 'status': 'replayed'}
+
+    usage = get_usage(user_id)  # Before any of the batch is flushed
+    batch = _Batch(user_id, stored)
+    batch.load(parsed.values())
+    applied = {}
+    for i, op in parsed.items():
+        try:
+            applied[i] = batch.apply(op)
+        except Rejected as e:
+            results[i] = _result(op, e.status, error=str(e), **e.details)
+
+    notes, note_bytes = batch.additions()
+    check_quota(user_id, usage=usage, notes=notes, note_bytes=note_bytes)
+    db.session.flush()  # Assigns the ids revisions and results need
+    changes = batch.revisions()
+    if changes:
+        record_revisions(changes)
+
+    for i, obj in applied.items():
+        deleted = batch.is_deleted(obj)
+        results[i] = _result(parsed[i], 'applied', id=obj.id, updated_at=(
+            None if deleted or isinstance(obj, Tag) else _aware(obj.updated_at).isoformat()))
+    batch.delete()
+    if applied:
+        db.session.execute(sa.insert(SyncOperation), [
+            {'user_id': user_id, 'key': parsed[i]['key'], 'result': results[i]} for i in applied])
+    return results
+
+
+def move_result(result, copied):
+    """A stored result with its id mapped to a user's new shard.
+
+    Args:
+        result (dict): `SyncOperation.result`.
+        copied (dict): New id by old id per table name; objects deleted
+            since the operation get a null id.
+    """
+    if result.get('id') is None or result.get('type') not in TYPES:
+        return result
+    return {**result, 'id': copied.get(TYPES[result['type']].__tablename__, {}).get(result['id'])}
+
+
+def prune_sync_operations(older_than):
+    """Forgets idempotency keys applied before `older_than`.
+
+    Returns:
+        int: Number of keys deleted.
+    """
+    deleted = db.session.execute(
+        sa.delete(SyncOperation).where(SyncOperation.created_at < older_than)).rowcount
+    db.session.commit()
+    return deleted
@@ -0,0 +1,204 @@
+"""Per-user usage counters and plan quotas.
+
+`user_usage` holds one row per user: the notes, to-do lists, to-do items and
+tags they own and the UTF-8 size of their notes' content. Flush hooks add
+every ORM write to these counters with one upsert in the same transaction
+(counted before the flush, written after it once new owners have ids), and bulk writes that bypass the ORM call `add_usage`
+themselves. Quota checks read only this row; `reconcile_usage` recomputes
+the counters from the source tables and reports any drift.
+"""
+from collections import Counter, defaultdict
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.bulk import upsert_add
+from app.chunks import note_size
+from app.models import Note, Tag, ToDoItem, ToDoList, User, UserUsage
+from app.sharding import ShardedSession
+
+COUNTERS = ('notes', 'note_bytes', 'todolists', 'todo_items', 'tags')
+DEFAULT_PLAN = 'free'
+
+
+class QuotaExceeded(Exception):
+    """A write would take a user over their plan's quota."""
+
+    def __init__(self, counter, limit, plan):
+        super().__init__(f'The {plan} plan allows at most {limit} {counter.replace("_", " ")}')
+        self.counter, self.limit, self.plan = counter, limit, plan
+
+
+def content_size(content):
+    """Size a note's content counts for in `note_bytes`."""
+    return len(content.encode('utf-8')) if content else 0
+
+
+def add_usage(deltas, session=None):
+    """Adds to users' counters in one statement.
+
+    Args:
+        deltas (dict): `Counter` of counter name to amount per user id.
+        session (optional): Session to use instead of `db.session`.
+    """
+    rows = [{'user_id': user_id, **{name: counts.get(name, 0) for name in COUNTERS}}
+            for user_id, counts in deltas.items() if any(counts.values())]
+    if rows:
+        session = session or db.session
+        dialect = session.get_bind(clause=UserUsage.__table__).dialect.name
+        session.execute(upsert_add(UserUsage.__table__, ['user_id'], COUNTERS, dialect), rows)
+
+
+def _previous(obj, name):
+    """Value an attribute had before this flush (active history)."""
+    history = sa.inspect(obj).attrs[name].history
+    if history.has_changes():
+        return history.deleted[0] if history.deleted else None
+    return getattr(obj, name)
+
+
+def _owner(obj, parent, column):
+    """Owner id of an object, or its owner object if that is new in this flush."""
+    user_id = getattr(obj, column)
+    if user_id is None and getattr(obj, parent) is not None:
+        owner = getattr(obj, parent)
+        user_id = owner.id if owner.id is not None else owner
+    return user_id
+
+
+def _item_owner(item):
+    return _owner(item.todolist, 'author', 'user_id')
+
+
+@sa.event.listens_for(ShardedSession, 'before_flush')
+def _count_usage(session, flush_context, instances):
+    """Counts the notes, to-do lists, to-do items and tags a flush writes."""
+    deltas = defaultdict(Counter)  # Owner id or new owner object: counters
+    for sign, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Note):
+                owner = _owner(obj, 'author', 'user_id')
+                deltas[owner]['notes'] += sign
+                deltas[owner]['note_bytes'] += sign * note_size(obj.content, obj.chunked_size)
+            elif isinstance(obj, ToDoList):
+                deltas[_owner(obj, 'author', 'user_id')]['todolists'] += sign
+            elif isinstance(obj, ToDoItem):
+                deltas[_item_owner(obj)]['todo_items'] += sign
+            elif isinstance(obj, Tag) and (obj.user_id is not None or obj.creator is not None):
+                deltas[_owner(obj, 'creator', 'user_id')]['tags'] += sign
+
+    for obj in session.dirty:
+        if isinstance(obj, Note):
+            state = sa.inspect(obj)
+            if state.attrs.content.history.has_changes() \
+                    or state.attrs.chunked_size.history.has_changes():
+                old = note_size(_previous(obj, 'content'), _previous(obj, 'chunked_size'))
+                deltas[obj.user_id]['note_bytes'] += note_size(obj.content, obj.chunked_size) - old
+    flush_context.attributes['usage'] = deltas
+
+
+@sa.event.listens_for(ShardedSession, 'after_flush')
+def _update_usage(session, flush_context):
+    """Writes the counters `_count_usage` collected, now that new owners have ids."""
+    deltas = defaultdict(Counter)
+    for owner, counts in flush_context.attributes.pop('usage', {}).items():
+        deltas[owner.id if isinstance(owner, User) else owner].update(counts)
+    add_usage(deltas, session)
+
+
+def _limits(plan):
+    quotas = current_app.config['PLAN_QUOTAS']
+    return quotas.get(plan, quotas[DEFAULT_PLAN])
+
+
+def get_usage(user_id):
+    """A user's plan, counters and quota limits (0 = unlimited)."""
+    row = db.session.execute(
+        sa.select(UserUsage.plan, *(getattr(UserUsage, name) for name in COUNTERS))
+        .where(UserUsage.user_id == user_id)).first()
+    usage = row._asdict() if row else {'plan': DEFAULT_PLAN, **dict.fromkeys(COUNTERS, 0)}
+    usage['limits'] = _limits(usage['plan'])
+    return usage
+
+
+def check_quota(user_id, usage=None, **additions):
+    """Raises `QuotaExceeded` if `additions` would exceed the user's plan.
+
+    Args:
+        user_id (int): User about to write.
+        usage (dict, optional): `get_usage` result to check against, when the
+            counters were read before some of the writes were flushed.
+        **additions: Amounts about to be added, e.g. `notes=1, note_bytes=120`.
+    """
+    usage = usage or get_usage(user_id)
+    for name, amount in additions.items():
+        limit = usage['limits'].get(name, 0)
+        if limit and amount > 0 and usage[name] + amount > limit:
+            raise QuotaExceeded(name, limit, usage['plan'])
+
+
+def _actual_usage(user_ids, batch_size):
+    """Counters of `user_ids` computed from the source tables."""
+    actual = {user_id: Counter() for user_id in user_ids}
+    for column, query in (
+            ('notes', sa.select(Note.user_id, sa.func.count())
+             .where(Note.user_id.in_(user_ids)).group_by(Note.user_id)),
+            ('todolists', sa.select(ToDoList.user_id, sa.func.count())
+             .where(ToDoList.user_id.in_(user_ids)).group_by(ToDoList.user_id)),
+            ('todo_items', sa.select(ToDoList.user_id, sa.func.count())
+             .join(ToDoItem, ToDoItem.todolist_id == ToDoList.id)
+             .where(ToDoList.user_id.in_(user_ids)).group_by(ToDoList.user_id)),
+            ('tags', sa.select(Tag.user_id, sa.func.count())
+             .where(Tag.user_id.in_(user_ids)).group_by(Tag.user_id))):
+        for user_id, count in db.session.execute(query):
+            actual[user_id][column] = count
+
+    # Content is compressed at rest, so sizes are measured here, streamed
+    rows = db.session.execute(
+        sa.select(Note.user_id, Note.content, Note.chunked_size).where(Note.user_id.in_(user_ids))
+        .execution_options(yield_per=batch_size))
+    for user_id, content, chunked_size in rows:
+        actual[user_id]['note_bytes'] += note_size(content, chunked_size)
+    return actual
+
+
+def reconcile_usage(batch_size=200, fix=True):
+    """Recomputes every user's counters and reports where they drifted.
+
+    Users are processed `batch_size` at a time, each batch in one
+    transaction. Writes made while a batch is counted may show up as drift.
+
+    Args:
+        batch_size (int, optional): Users per batch.
+        fix (bool, optional): Store the recomputed counters.
+
+    Returns:
+        dict: `{counter: (stored, actual)}` per user id with drift.
+    """
+    drift = {}
+    last_id = 0
+    while True:
+        user_ids = db.session.scalars(
+            sa.select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)).all()
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        actual = _actual_usage(user_ids, batch_size)
+        stored = {row.user_id: row for row in db.session.scalars(
+            sa.select(UserUsage).where(UserUsage.user_id.in_(user_ids)))}
+        for user_id in user_ids:
+            row = stored.get(user_id)
+            diff = {name: (getattr(row, name) if row else 0, actual[user_id][name])
+                    for name in COUNTERS
+                    if (getattr(row, name) if row else 0) != actual[user_id][name]}
+            if not diff:
+                continue
+            drift[user_id] = diff
+            if fix:
+                if row is None:
+                    row = UserUsage(user_id=user_id, plan=DEFAULT_PLAN)
+                    db.session.add(row)
+                for name, (_, value) in diff.items():
+                    setattr(row, name, value)
+        db.session.commit()
+    return drift
@@ -0,0 +1,91 @@
+"""Size and latency of `CompressedText` versus plain `Text` note content.
+
+Usage (from the backend directory):
+    python benchmarks/bench_compression.py --rows 200
+
+For each content size, writes and reads `--rows` notes through the ORM into
+an in-memory SQLite database with both column types and reports the stored
+bytes and per-row write/read latency. Content mixes prose and log lines,
+roughly what our largest notes look like.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.dbtypes import CompressedText, zstandard  # noqa: E402
+
+SIZES = [256, 1024, 4096, 16384, 65536, 1024 * 1024]
+WORDS = ('note meeting project deadline review draft summary customer request '
+         'server error timeout retry deploy release fix issue database query').split()
+
+
+def sample_text(size, rng):
+    """Roughly `size` bytes of prose interleaved with log-like lines."""
+    parts, length = [], 0
+    while length < size:
+        if rng.random() < 0.5:
+            line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))) + '.\n'
+        else:
+            line = (f'2024-05-{rng.randint(1, 28):02d} 12:{rng.randint(0, 59):02d}:'
+                    f'{rng.randint(0, 59):02d} INFO worker-{rng.randint(1, 8)} '
+                    f'{rng.choice(WORDS)} id={rng.randint(1, 10 ** 6)}\n')
+        parts.append(line)
+        length += len(line)
+    return ''.join(parts)[:size]
+
+
+def measure(column_type, texts):
+    """Returns (stored bytes, write us/row, read us/row) for one column type."""
+    class Base(so.DeclarativeBase):
+        pass
+
+    class Row(Base):
+        __tablename__ = 'row'
+        id: so.Mapped[int] = so.mapped_column(primary_key=True)
+        content: so.Mapped[str] = so.mapped_column(column_type)
+
+    engine = sa.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with so.Session(engine) as session:
+        start = time.perf_counter()
+        session.add_all(Row(content=text) for text in texts)
+        session.commit()
+        write = time.perf_counter() - start
+
+        session.expunge_all()
+        start = time.perf_counter()
+        contents = session.scalars(sa.select(Row.content)).all()
+        read = time.perf_counter() - start
+        assert contents == texts
+
+        stored = session.scalar(sa.select(sa.func.sum(sa.func.length(Row.__table__.c.content))))
+    return stored, write / len(texts) * 1e6, read / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--level', type=int, default=6)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    print(f'{args.rows} rows per size, codec: {"zstd" if zstandard else "zlib"} '
+          f'level {args.level}')
+    print(f'{"size":>9} {"ratio":>6} {"text write us":>14} {"comp write us":>14} '
+          f'{"text read us":>13} {"comp read us":>13}')
+    for size in SIZES:
+        rows = args.rows if size < 65536 else max(10, args.rows // 20)
+        texts = [sample_text(size, rng) for _ in range(rows)]
+        plain = measure(sa.Text, texts)
+        packed = measure(CompressedText(min_size=1024, level=args.level), texts)
+        print(f'{size:>9} {plain[0] / packed[0]:>5.1f}x {plain[1]:>14.1f} {packed[1]:>14.1f} '
+              f'{plain[2]:>13.1f} {packed[2]:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""CPU per response versus bytes on the wire for compressed `/api/notes` payloads.
+
+Usage (from the backend directory):
+    python benchmarks/bench_response_compression.py --repeat 20
+
+Builds `/api/notes` listings of typical sizes (serialized like `jsonify`)
+and compresses each with gzip and, if the `brotli` package is installed,
+brotli at several levels, through `app.compression`. For each it reports
+the compressed size, the compression time per response and the time the
+body takes on the wire at `--mbits` link speeds. A setting pays off when
+its CPU time plus wire time beats sending the body uncompressed. The last
+payload is also compressed piece by piece, as streamed note content is.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timezone
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.chunks import CHUNK_SIZE  # noqa: E402
+from app.compression import brotli, compress, stream_compressor  # noqa: E402
+from bench_compression import WORDS  # noqa: E402
+
+# (notes in the listing, average content bytes per note)
+PAYLOADS = [(10, 400), (50, 800), (200, 1500), (1000, 2000)]
+SETTINGS = [('gzip', 1), ('gzip', 6), ('gzip', 9)]
+if brotli is not None:
+    SETTINGS += [('br', 1), ('br', 4), ('br', 6), ('br', 11)]
+
+
+def sample_prose(size, rng):
+    """Roughly `size` bytes of sentences, like most note content."""
+    parts, length = [], 0
+    while length < size:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 18)))
+        parts.append(sentence.capitalize() + ('.\n' if rng.random() < 0.2 else '. '))
+        length += len(parts[-1])
+    return ''.join(parts)[:size]
+
+
+def listing(count, size, rng):
+    """Body of a `/api/notes` response with `count` notes."""
+    now = datetime.now(timezone.utc)
+    notes = [{'id': i + 1, 'title': sample_prose(40, rng).strip(),
+              'content': sample_prose(int(size * rng.uniform(0.3, 1.7)), rng),
+              'chunked': False, 'updated_at': now.isoformat()}
+             for i in range(count)]
+    return Flask(__name__).json.dumps(notes).encode()
+
+
+def timed(function, repeat):
+    """Returns `(result, median seconds)` of `repeat` calls to `function`."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def compress_streamed(data, encoding, level):
+    compress_piece, finish = stream_compressor(encoding, level)
+    return b''.join(compress_piece(data[start:start + CHUNK_SIZE])
+                    for start in range(0, len(data), CHUNK_SIZE)) + finish()
+
+
+def report(label, data, settings, repeat, mbits, function):
+    wire = ' '.join(f'{f"{speed} Mbit ms":>12}' for speed in mbits)
+    print(f'\n{label}: {len(data):,} bytes')
+    print(f'{"encoding":>10} {"bytes":>10} {"ratio":>6} {"cpu us":>9} {"MB/s":>7} {wire}')
+
+    def row(name, size, seconds):
+        totals = ' '.join(f'{(seconds + size * 8 / (speed * 1e6)) * 1000:>12.2f}' for speed in mbits)
+        throughput = len(data) / seconds / 1e6 if seconds else float('inf')
+        print(f'{name:>10} {size:>10,} {len(data) / size:>5.1f}x {seconds * 1e6:>9.0f} '
+              f'{throughput:>7.0f} {totals}')
+
+    row('identity', len(data), 0.0)
+    for encoding, level in settings:
+        packed, seconds = timed(lambda: function(data, encoding, level), repeat)
+        row(f'{encoding}-{level}', len(packed), seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--mbits', type=float, nargs='+', default=[10, 100, 1000],
+                        help='Link speeds the wire time (plus CPU time) is shown for.')
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    print(f'codecs: gzip{", brotli" if brotli is not None else " (brotli not installed)"}; '
+          f'times are medians of {args.repeat} runs; wire columns are CPU + transfer time')
+    for count, size in PAYLOADS:
+        data = listing(count, size, rng)
+        report(f'/api/notes, {count} notes of ~{size} B', data, SETTINGS, args.repeat,
+               args.mbits, compress)
+    report(f'Streamed in {CHUNK_SIZE // 1024} KiB pieces, {count} notes', data, SETTINGS,
+           args.repeat, args.mbits, compress_streamed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Throughput versus gunicorn worker count for `GET /api/notes`.
+
+Usage (from the backend directory):
+    python benchmarks/bench_workers.py --workers 1,2,4,8 --duration 10
+
+Each run starts `gunicorn notez:app` with `gunicorn.conf.py` against a
+throwaway SQLite database, hammers the endpoint from `--concurrency`
+keep-alive client threads and reports requests/second and latency
+percentiles. Use the "per worker" column to see where adding workers stops
+paying off on a given node.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+import http.client
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+USERNAME, PASSWORD = 'bench', 'Bench123!'
+
+
+def prepare_database(env, notes):
+    """Creates the schema, one user and `notes` notes in a SQLite file."""
+    os.environ.update(env)  # Config reads the environment on import
+    import sqlalchemy as sa
+    from app import create_app, db
+    from app.models import User, UserDirectory, Note
+    from config import Config
+
+    class BenchConfig(Config):
+        TESTING = True
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        # Login finds users through the directory, which allocates their id
+        entry = UserDirectory(username=USERNAME, email='bench@example.com')
+        db.session.add(entry)
+        db.session.flush()
+        user = User(id=entry.id, first_name='Bench', last_name='Mark', username=USERNAME,
+                    email='bench@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.flush()
+        db.session.execute(sa.insert(Note), [
+            {'title': f'Note {i}', 'content': 'Lorem ipsum dolor sit amet. ' * 20,
+             'user_id': user.id}
+            for i in range(notes)])
+        db.session.commit()
+
+
+def request(conn, method, path, body=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    conn.request(method, path, body=json.dumps(body) if body else None, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def client(port, token, stop_at):
+    """Sends requests on one keep-alive connection until `stop_at`."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        status, _ = request(conn, 'GET', '/api/notes', token=token)
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies
+
+
+def run(workers, threads, port, env, duration, concurrency):
+    env = dict(env, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_BIND=f'127.0.0.1:{port}')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'notez:app'], cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port)
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        _, body = request(conn, 'POST', '/api/auth/login',
+                          {'username': USERNAME, 'password': PASSWORD})
+        token = json.loads(body)['access_token']
+
+        stop_at = time.monotonic() + duration
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = pool.map(client, [port] * concurrency, [token] * concurrency,
+                               [stop_at] * concurrency)
+            latencies = sorted(l for result in results for l in result)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    rps = len(latencies) / duration
+    return rps, percentile(0.5), percentile(0.99)
+
+
+def main():
+    cores = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default=','.join(
+        str(n) for n in sorted({1, 2, cores, cores * 2 + 1})))
+    parser.add_argument('--threads', type=int, default=min(4, cores * 2))
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--notes', type=int, default=100)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                   LOG_DIR=os.path.join(tmp, 'logs'),
+                   SECRET_KEY='bench', JWT_SECRET_KEY='bench-secret-key-of-at-least-32-bytes')
+        prepare_database(env, args.notes)
+
+        print(f'GET /api/notes, {args.notes} notes, {args.concurrency} clients, '
+              f'{args.duration:.0f}s per run, {cores} cores')
+        print(f'{"workers":>8} {"threads":>8} {"req/s":>10} {"per worker":>11} '
+              f'{"p50 ms":>8} {"p99 ms":>8}')
+        for workers in (int(n) for n in args.workers.split(',')):
+            rps, p50, p99 = run(workers, args.threads, args.port, env,
+                                args.duration, args.concurrency)
+            print(f'{workers:>8} {args.threads:>8} {rps:>10.1f} {rps / workers:>11.1f} '
+                  f'{p50:>8.2f} {p99:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,4 +8,73 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     #SQLALCHEMY_ECHO = True
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
+    # Seconds before a token revoked by another worker is rejected by this one
+    JWT_BLOCKLIST_REFRESH_SECONDS = float(os.environ.get('JWT_BLOCKLIST_REFRESH_SECONDS', 5))
     WTF_CSRF_ENABLED = False
+
+    # Logging (written by a background QueueListener thread)
+    LOG_DIR = os.environ.get('LOG_DIR', os.path.join(basedir, 'logs'))
+    # Size at which files are rotated; 0 = rotated externally (logrotate), see app/logs.py
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 10))
+    ACCESS_LOG_ENABLED = os.environ.get('ACCESS_LOG_ENABLED', '1') == '1'
+
+    # Response compression: brotli (if installed) or gzip, for bodies of at least MIN_SIZE bytes
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    # Level 1 gets 4-5x on note listings for a fraction of the CPU of higher levels
+    # (see benchmarks/bench_response_compression.py)
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 1))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 1))
+
+    # Startup: optional extensions are only imported when enabled
+    MIGRATIONS_ENABLED = os.environ.get('MIGRATIONS_ENABLED', '1') == '1'
+    SESSION_LOGIN_ENABLED = os.environ.get('SESSION_LOGIN_ENABLED', '0') == '1'
+    # Pooled connections to open (and hot statements to compile) at startup
+    DB_WARMUP_CONNECTIONS = int(os.environ.get('DB_WARMUP_CONNECTIONS', 0))
+
+    # Note revisions: a full snapshot at least every N revisions, deltas between
+    NOTE_REVISION_SNAPSHOT_INTERVAL = int(os.environ.get('NOTE_REVISION_SNAPSHOT_INTERVAL', 20))
+
+    # Notes of at least this many UTF-8 bytes are stored in chunks (see app/chunks.py)
+    LARGE_NOTE_THRESHOLD = int(os.environ.get('LARGE_NOTE_THRESHOLD', 1024 * 1024))
+
+    # Archive imports: Markdown files per transaction, parser processes (0 = inline)
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 0))
+    # Uncompressed bytes per Markdown file and per archive; uploads are capped too
+    IMPORT_MAX_FILE_SIZE = int(os.environ.get('IMPORT_MAX_FILE_SIZE', 16 * 1024 * 1024))
+    IMPORT_MAX_SIZE = int(os.environ.get('IMPORT_MAX_SIZE', 512 * 1024 * 1024))
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 128 * 1024 * 1024))
+
+    # Offline sync pushes: operations per batch, days idempotency keys are remembered
+    SYNC_MAX_OPERATIONS = int(os.environ.get('SYNC_MAX_OPERATIONS', 500))
+    SYNC_KEY_RETENTION_DAYS = int(os.environ.get('SYNC_KEY_RETENTION_DAYS', 30))
+
+    # Duplicate notes: minimum estimated word-shingle similarity reported
+    DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.8))
+
+    # Quotas per plan (user_usage.plan): notes and UTF-8 bytes of note content, 0 = unlimited
+    PLAN_QUOTAS = {
+        'free': {
+            'notes': int(os.environ.get('FREE_PLAN_MAX_NOTES', 5000)),
+            'note_bytes': int(os.environ.get('FREE_PLAN_MAX_NOTE_BYTES', 100 * 1024 * 1024)),
+        },
+        'pro': {'notes': 0, 'note_bytes': 0},
+    }
+
+    # Avatars: rendered SVGs kept on disk (shared by workers) and the hottest in memory
+    AVATAR_CACHE_DIR = os.environ.get('AVATAR_CACHE_DIR', os.path.join(basedir, 'avatar_cache'))
+    AVATAR_MEMORY_CACHE_SIZE = int(os.environ.get('AVATAR_MEMORY_CACHE_SIZE', 1024))
+    # Files kept on disk (least recently used deleted past it, 0 = memory only)
+    AVATAR_DISK_CACHE_SIZE = int(os.environ.get('AVATAR_DISK_CACHE_SIZE', 50000))
+
+    # Sharding: extra databases holding user data as "name=url,name=url" (see app/sharding.py)
+    SQLALCHEMY_BINDS = dict(
+        bind.strip().split('=', 1)
+        for bind in os.environ.get('SHARD_DATABASE_URLS', '').split(',') if bind.strip())
+    # Shards new users are spread over ('default' is DATABASE_URL)
+    SHARDS = os.environ.get('SHARDS', ','.join(SQLALCHEMY_BINDS) or 'default').split(',')
+    SHARD_MAP_TTL = int(os.environ.get('SHARD_MAP_TTL', 60))
+    # Ids of per-user rows each process reserves at a time (not on SQLite)
+    SHARD_ID_BLOCK_SIZE = int(os.environ.get('SHARD_ID_BLOCK_SIZE', 1000))
@@ -0,0 +1,66 @@
+"""Gunicorn configuration for production (picked up automatically from this directory).
+
+Usage:
+    gunicorn notez:app
+
+The app is imported once in the master (`preload_app`) and forked into the
+workers, so code and read-only data are shared copy-on-write. Anything that
+holds a socket or a thread is re-created per worker in `post_fork`.
+
+Reloads:
+    kill -HUP <master>   restarts workers gracefully with the preloaded code
+                         (config changes only, code is not re-imported).
+    kill -USR2 <master>  starts a new master with new code alongside the old
+                         one; then `kill -WINCH <old master>` to drain its
+                         workers and `kill -QUIT <old master>` to retire it.
+                         Both masters share the listening socket, so no
+                         request is dropped.
+"""
+import gc
+import os
+import multiprocessing
+
+# Alembic is only needed by `flask db`, keep it out of the workers
+os.environ.setdefault('MIGRATIONS_ENABLED', '0')
+# The workers share the log files: leave rotation to logrotate (`copytruncate`
+# isn't needed, the files are reopened once moved)
+os.environ.setdefault('LOG_MAX_BYTES', '0')
+
+cores = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+preload_app = True
+
+# Requests mostly wait on the database, so each worker runs a few threads
+workers = int(os.environ.get('WEB_CONCURRENCY', cores * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', min(4, cores * 2)))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Draining and recycling workers
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = None  # The app writes its own JSON access log
+
+
+def when_ready(server):
+    """Moves everything the preloaded app allocated out of the collector's
+    reach, so collections in the workers don't touch (and copy) shared pages.
+    """
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Gives each worker its own database connections and logging thread."""
+    from app import db
+    from app.logs import restart_logging
+    app = server.app.wsgi()
+    with app.app_context():
+        # close=False: leave the parent's sockets alone, just forget them
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    restart_logging(app)  # Threads don't survive fork
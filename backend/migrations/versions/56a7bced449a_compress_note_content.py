@@ -0,0 +1,92 @@
+"""compress note content
+
+Revision ID: 56a7bced449a
+Revises: f7f416b1149a
+Create Date: 2026-10-19 06:45:40.820765
+
+"""
+import zlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '56a7bced449a'
+down_revision = 'f7f416b1149a'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+# Same format as app.dbtypes.CompressedText: a tag byte, then the payload
+RAW, ZLIB = b'\x00', b'\x01'
+MIN_SIZE = 1024
+
+note = sa.table(
+    'note',
+    sa.column('id', sa.Integer),
+    sa.column('content', sa.Text),
+    sa.column('content_blob', sa.LargeBinary),
+    sa.column('content_text', sa.Text),
+)
+
+
+def _encode(text):
+    raw = (text or '').encode('utf-8')
+    if len(raw) >= MIN_SIZE:
+        packed = ZLIB + zlib.compress(raw)
+        if len(packed) < len(raw) + 1:
+            return packed
+    return RAW + raw
+
+
+def _decode(data):
+    if data[:1] == ZLIB:
+        return zlib.decompress(data[1:]).decode('utf-8')
+    if data[:1] == RAW:
+        return bytes(data[1:]).decode('utf-8')
+    raise RuntimeError('zstd-compressed notes must be rewritten with zlib before downgrading')
+
+
+def _convert(source, target, convert):
+    """Copies `source` into `target` through `convert`, BATCH_SIZE rows at a time."""
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(note.c.id, note.c[source])
+            .where(note.c.id > last_id)
+            .order_by(note.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            note.update().where(note.c.id == sa.bindparam('row_id'))
+            .values({target: sa.bindparam('value')}),
+            [{'row_id': row_id, 'value': convert(value)} for row_id, value in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_blob', sa.LargeBinary(), nullable=True))
+
+    _convert('content', 'content_blob', _encode)
+
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.drop_column('content')
+        batch_op.alter_column('content_blob', new_column_name='content',
+                              existing_type=sa.LargeBinary(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_text', sa.Text(), nullable=True))
+
+    _convert('content', 'content_text', _decode)
+
+    with op.batch_alter_table('note', schema=None) as batch_op:
+        batch_op.drop_column('content')
+        batch_op.alter_column('content_text', new_column_name='content',
+                              existing_type=sa.Text(), nullable=False)
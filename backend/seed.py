@@ -2,8 +2,10 @@
 """
 import random
 from faker import Faker
-from app import app, db
-from app.models import User, Note, Group, ToDoList, ToDoItem, Tag
+from app import create_app, db
+import sqlalchemy as sa
+from app.models import (User, UserDirectory, Note, Group, ToDoList, ToDoItem, Tag,
+                        note_tag_association, todolist_tag_association)
 from datetime import datetime, timedelta, timezone
 
 
@@ -124,16 +126,27 @@ def run_seed(num_users=50):
 
     # Create Many-to-Many Associations for Tags
     print("Creating tag associations...")
-
-    # Tag Notes
-    for note in all_notes:
-        # Assign 0 to 3 random tags
-        note.tags = random.sample(all_tags, random.randint(0, 3))
-
-    # Tag ToDoLists
-    for todolist in all_todolists:
-        # Assign 0 to 2 random tags
-        todolist.tags = random.sample(all_tags, random.randint(0, 2))
+    db.session.flush()  # Assigns the ids the association rows point to
+
+    # Register the users in the global directory (all on the default database)
+    db.session.execute(sa.insert(UserDirectory), [
+        {'id': user.id, 'username': user.username, 'email': user.email, 'shard': 'default'}
+        for user in users
+    ])
+
+    # Tag Notes: 0 to 3 random tags each, written as one multi-row INSERT
+    db.session.execute(sa.insert(note_tag_association), [
+        {'note_id': note.id, 'tag_id': tag.id}
+        for note in all_notes
+        for tag in random.sample(all_tags, random.randint(0, 3))
+    ])
+
+    # Tag ToDoLists: 0 to 2 random tags each
+    db.session.execute(sa.insert(todolist_tag_association), [
+        {'todolist_id': todolist.id, 'tag_id': tag.id}
+        for todolist in all_todolists
+        for tag in random.sample(all_tags, random.randint(0, 2))
+    ])
 
     print("Committing the transaction...")
     db.session.commit()
@@ -148,5 +161,6 @@ def run_seed(num_users=50):
 
 
 if __name__ == '__main__':
-    with app.app_context():
+    # `flask seed` is preferred, it reuses the CLI's app instance
+    with create_app().app_context():
         run_seed()
@@ -0,0 +1,127 @@
+"""Fixtures: an app on a seeded in-memory database and SQL statement budgets.
+
+`query_budget(n)` fails a test when the block inside it runs more than `n`
+SQL statements (on any engine, so shard binds count too), and optionally
+when it takes longer than `seconds`. Seeded users come in several sizes so
+tests can check that a route's statement count doesn't grow with the
+number of notes.
+"""
+import time
+from contextlib import contextmanager
+import pytest
+import sqlalchemy as sa
+from config import Config
+from app import create_app, db
+from app.models import Group, Note, Tag, ToDoItem, ToDoList
+from app.revisions import record_revisions
+
+PASSWORD = 'Passw0rd!'
+
+
+class TestConfig(Config):
+    TESTING = True
+    SECRET_KEY = 'test'
+    JWT_SECRET_KEY = 'test-secret-key-of-at-least-32-bytes'
+    JWT_BLOCKLIST_REFRESH_SECONDS = 3600  # A refresh would add a statement to some request
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_BINDS = {}
+    SHARDS = ['default']
+    MIGRATIONS_ENABLED = False
+    DB_WARMUP_CONNECTIONS = 0
+    LARGE_NOTE_THRESHOLD = 1024  # So large (chunked) notes are small enough to seed
+    COMPRESS_ENABLED = False  # Tests read the JSON bodies
+
+
+@pytest.fixture
+def app(tmp_path):
+    class AppConfig(TestConfig):
+        AVATAR_CACHE_DIR = str(tmp_path / 'avatars')
+
+    app = create_app(AppConfig)
+    with app.app_context():
+        db.metadata.create_all(db.engine)
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(client):
+    """Registers a user with `notes` notes (and lists, tags, revisions).
+
+    Returns:
+        function: `make_user(username, notes=0)` returning a dict with the
+            user's `id`, auth `headers`, `note_ids` and `todolist_ids`.
+    """
+    def make(username, notes=0):
+        client.post('/api/auth/register', json={
+            'username': username, 'email': f'{username}@example.com',
+            'password': PASSWORD, 'password2': PASSWORD,
+            'first_name': 'Test', 'last_name': 'User', 'gender': 'other'})
+        token = client.post('/api/auth/login', json={
+            'username': username, 'password': PASSWORD}).json['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        user_id = client.get('/api/auth/me', headers=headers).json['id']
+        return {'id': user_id, 'headers': headers, **seed(user_id, notes)}
+    return make
+
+
+def seed(user_id, notes):
+    """Adds `notes` notes to a user, plus one to-do list per 5 notes.
+
+    Every note has a revision and every other one a tag; through the ORM,
+    so the usage counters and rollups stay consistent.
+    """
+    group = Group(name='Seeded', user_id=user_id)
+    tags = [Tag(name=f'tag-{user_id}-{i}', user_id=user_id) for i in range(3)]
+    db.session.add_all([group, *tags])
+    note_list = [Note(title=f'Note {i}', content=f'Seeded note {i}\nwith two lines\n',
+                      user_id=user_id, category=group if i % 2 else None,
+                      tags=[tags[i % 3]] if i % 2 == 0 else [])
+                 for i in range(notes)]
+    lists = [ToDoList(title=f'List {i}', user_id=user_id, category=group, tags=[tags[0]],
+                      items=[ToDoItem(description=f'Item {i}.{j}', is_completed=j == 0)
+                             for j in range(3)])
+             for i in range(max(notes // 5, 1))]
+    db.session.add_all(note_list + lists)
+    db.session.flush()
+    if note_list:
+        record_revisions([(note, None, None) for note in note_list])
+    db.session.commit()
+    return {'note_ids': [note.id for note in note_list],
+            'todolist_ids': [todolist.id for todolist in lists]}
+
+
+@pytest.fixture
+def query_budget(app):
+    """Context manager failing when its block exceeds a statement budget.
+
+    Usage:
+        with query_budget(3, seconds=0.5) as statements:
+            client.get(...)
+
+    `statements` lists the SQL executed, in order.
+    """
+    @contextmanager
+    def budget(count, seconds=None):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', record)
+        start = time.perf_counter()
+        try:
+            yield statements
+        finally:
+            sa.event.remove(sa.engine.Engine, 'before_cursor_execute', record)
+        elapsed = time.perf_counter() - start
+        assert len(statements) <= count, (
+            f'{len(statements)} statements, budget {count}:\n' + '\n'.join(statements))
+        if seconds is not None:
+            assert elapsed <= seconds, f'{elapsed:.3f}s, budget {seconds}s'
+    return budget
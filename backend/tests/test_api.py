@@ -0,0 +1,207 @@
+"""Statement budgets of every `/api` route.
+
+Each route runs within `BUDGETS[route]` SQL statements. Routes that read
+or write many of a user's rows are run for users with few and many notes
+under the same budget, so an N+1 query fails here.
+"""
+import io
+import zipfile
+import pytest
+
+SIZES = [5, 50]  # Notes of the seeded users
+
+BUDGETS = {
+    'POST /api/auth/register': 4,
+    'POST /api/auth/login': 2,
+    'POST /api/auth/logout': 1,
+    'GET /api/auth/me': 1,
+    'GET /api/avatars/<style>/<seed>.svg': 0,  # Rendered without the database
+    'GET /api/usage': 1,
+    'POST /api/notes': 10,  # 9 for notes that aren't chunked
+    'GET /api/notes': 1,
+    'PUT /api/notes/<int:note_id>': 9,
+    'GET /api/notes/<int:note_id>/content': 2,
+    'POST /api/notes/<int:note_id>/content': 11,  # With the revision it records and the signature it drops
+    # 20 files; SQLite runs the note INSERT ... RETURNING once per row (PostgreSQL once)
+    'POST /api/notes/import': 32,
+    'GET /api/notes/duplicates': 2,
+    'GET /api/notes/<int:note_id>/revisions': 2,
+    'GET /api/notes/<int:note_id>/revisions/<int:number>': 2,
+    'POST /api/tags/apply': 8,
+    'POST /api/sync/push': 22,
+    'GET /api/stats': 1,
+}
+
+
+def test_every_route_has_a_budget(app):
+    routes = {f'{method} {rule.rule}' for rule in app.url_map.iter_rules()
+              if rule.rule.startswith('/api/')
+              for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    assert routes == set(BUDGETS)
+
+
+def test_register_and_login(client, query_budget):
+    credentials = {'username': 'newbie', 'password': 'Passw0rd!'}
+    with query_budget(BUDGETS['POST /api/auth/register']):
+        response = client.post('/api/auth/register', json={
+            **credentials, 'password2': credentials['password'], 'email': 'newbie@example.com',
+            'first_name': 'New', 'last_name': 'User', 'gender': 'other'})
+    assert response.status_code == 201
+    with query_budget(BUDGETS['POST /api/auth/login']):
+        response = client.post('/api/auth/login', json=credentials)
+    assert response.status_code == 200
+
+
+def test_logout(client, make_user, query_budget):
+    user = make_user('leaver')
+    with query_budget(BUDGETS['POST /api/auth/logout']):
+        assert client.post('/api/auth/logout', headers=user['headers']).status_code == 200
+    assert client.get('/api/auth/me', headers=user['headers']).status_code == 401
+
+
+def test_me_and_avatar(client, make_user, query_budget):
+    user = make_user('viewer')
+    with query_budget(BUDGETS['GET /api/auth/me']):
+        avatar = client.get('/api/auth/me', headers=user['headers']).json['avatar']
+    with query_budget(BUDGETS['GET /api/avatars/<style>/<seed>.svg']):
+        response = client.get(avatar[avatar.index('/api/'):])
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_usage(client, make_user, query_budget, notes):
+    user = make_user('counter', notes=notes)
+    with query_budget(BUDGETS['GET /api/usage']):
+        usage = client.get('/api/usage', headers=user['headers']).json
+    assert usage['notes'] == notes
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_list_notes(client, make_user, query_budget, notes):
+    user = make_user('reader', notes=notes)
+    with query_budget(BUDGETS['GET /api/notes'], seconds=1.0):
+        response = client.get('/api/notes', headers=user['headers'])
+    assert len(response.json) == notes
+
+
+def test_list_notes_statements_dont_grow_with_notes(client, make_user, query_budget):
+    counts = []
+    for username, notes in (('small', 2), ('large', 100)):
+        user = make_user(username, notes=notes)
+        with query_budget(BUDGETS['GET /api/notes']) as statements:
+            client.get('/api/notes', headers=user['headers'])
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.parametrize('content', ['Small note', 'Large note\n' * 200])
+def test_create_note(client, make_user, query_budget, content):
+    user = make_user('writer', notes=5)
+    with query_budget(BUDGETS['POST /api/notes']):
+        response = client.post('/api/notes', headers=user['headers'],
+                               json={'title': 'New', 'content': content})
+    assert response.status_code == 201
+    assert response.json['chunked'] == (len(content) >= 1024)
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_update_note(client, make_user, query_budget, notes):
+    user = make_user('editor', notes=notes)
+    with query_budget(BUDGETS['PUT /api/notes/<int:note_id>']):
+        response = client.put(f'/api/notes/{user["note_ids"][0]}', headers=user['headers'],
+                              json={'content': 'Edited'})
+    assert response.status_code == 200
+
+
+def test_note_content(client, make_user, query_budget):
+    user = make_user('chunker')
+    note_id = client.post('/api/notes', headers=user['headers'],
+                          json={'title': 'Large', 'content': 'Large note\n' * 200}).json['id']
+    with query_budget(BUDGETS['POST /api/notes/<int:note_id>/content']):
+        response = client.post(f'/api/notes/{note_id}/content', headers=user['headers'],
+                               data='More\n')
+    assert response.status_code == 200
+    with query_budget(BUDGETS['GET /api/notes/<int:note_id>/content']):
+        response = client.get(f'/api/notes/{note_id}/content',
+                              headers={**user['headers'], 'Range': 'bytes=-5'})
+    assert response.status_code == 206
+    assert response.data == b'More\n'
+
+
+def test_import_notes(client, make_user, query_budget):
+    user = make_user('importer', notes=5)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        for i in range(20):
+            z.writestr(f'folder/note-{i}.md', f'---\ntags: [imported]\n---\n# Note {i}\nBody')
+    archive.seek(0)
+    with query_budget(BUDGETS['POST /api/notes/import']):
+        response = client.post('/api/notes/import', headers=user['headers'],
+                               data={'archive': (archive, 'notes.zip')},
+                               content_type='multipart/form-data')
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_duplicates(client, make_user, query_budget, notes):
+    user = make_user('twin', notes=notes)
+    with query_budget(BUDGETS['GET /api/notes/duplicates']):
+        response = client.get('/api/notes/duplicates', headers=user['headers'])
+    assert response.json['scanned'] == notes
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_revisions(client, make_user, query_budget, notes):
+    user = make_user('historian', notes=notes)
+    note_id = user['note_ids'][0]
+    for i in range(notes // 5):
+        client.put(f'/api/notes/{note_id}', headers=user['headers'], json={'content': f'v{i}'})
+    with query_budget(BUDGETS['GET /api/notes/<int:note_id>/revisions']):
+        response = client.get(f'/api/notes/{note_id}/revisions', headers=user['headers'])
+    assert len(response.json) == notes // 5 + 1
+    with query_budget(BUDGETS['GET /api/notes/<int:note_id>/revisions/<int:number>']):
+        response = client.get(f'/api/notes/{note_id}/revisions/{notes // 5 + 1}',
+                              headers=user['headers'])
+    assert response.json['content'] == f'v{notes // 5 - 1}'
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_apply_tags(client, make_user, query_budget, notes):
+    user = make_user('tagger', notes=notes)
+    with query_budget(BUDGETS['POST /api/tags/apply']):
+        response = client.post('/api/tags/apply', headers=user['headers'], json={
+            'add': ['bulk', 'more'], 'remove': [f'tag-{user["id"]}-0'],
+            'note_ids': user['note_ids'], 'todolist_ids': user['todolist_ids']})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_sync_push(client, make_user, query_budget, notes):
+    user = make_user('syncer', notes=notes)
+    operations = [
+        {'key': 'list', 'op': 'create', 'type': 'todolist', 'data': {'title': 'Offline'}},
+        {'key': 'item', 'op': 'create', 'type': 'item',
+         'data': {'description': 'Sync', 'todolist_id': 'list'}},
+        {'key': 'tag', 'op': 'create', 'type': 'tag', 'data': {'name': 'offline'}},
+        *({'key': f'edit-{note_id}', 'op': 'update', 'type': 'note', 'id': note_id,
+           'data': {'content': f'Edited offline {note_id}'}} for note_id in user['note_ids']),
+        {'key': 'drop', 'op': 'delete', 'type': 'todolist', 'id': user['todolist_ids'][0]},
+    ]
+    with query_budget(BUDGETS['POST /api/sync/push']):
+        response = client.post('/api/sync/push', headers=user['headers'],
+                               json={'operations': operations})
+    assert {result['status'] for result in response.json['results']} == {'applied'}
+    with query_budget(BUDGETS['POST /api/sync/push']):
+        response = client.post('/api/sync/push', headers=user['headers'],
+                               json={'operations': operations})
+    assert {result['status'] for result in response.json['results']} == {'replayed'}
+    assert client.get('/api/usage', headers=user['headers']).json['notes'] == notes
+
+
+@pytest.mark.parametrize('notes', SIZES)
+def test_stats(client, make_user, query_budget, notes):
+    user = make_user('analyst', notes=notes)
+    with query_budget(BUDGETS['GET /api/stats']):
+        response = client.get('/api/stats', headers=user['headers'])
+    assert response.status_code == 200
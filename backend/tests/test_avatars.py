@@ -0,0 +1,39 @@
+"""Avatar rendering and the bounded on-disk store."""
+import os
+from app.avatars import AvatarStore
+
+
+def stored_files(directory):
+    return [name for _, _, names in os.walk(directory) for name in names if name.endswith('.svg')]
+
+
+def test_disk_store_keeps_at_most_disk_size_files(tmp_path):
+    store = AvatarStore(str(tmp_path), memory_size=0, disk_size=10)
+    for i in range(50):
+        store.get('adventurer', f'seed-{i}')
+    assert len(stored_files(tmp_path)) <= 10
+    # The most recent avatars are the ones kept
+    assert os.path.exists(store._path(store.key('adventurer', 'seed-49', None, 128)))
+
+
+def test_disk_store_can_be_disabled(tmp_path):
+    store = AvatarStore(str(tmp_path), memory_size=4, disk_size=0)
+    svg, etag = store.get('initials', 'AB')
+    assert svg.startswith(b'<svg') and etag
+    assert stored_files(tmp_path) == []
+
+
+def test_arbitrary_seeds_dont_fill_the_disk(app, client):
+    app.extensions['avatars'].disk_size = 5
+    for i in range(20):
+        assert client.get(f'/api/avatars/adventurer/random-{i}.svg?size={16 + i}').status_code == 200
+    assert len(stored_files(app.config['AVATAR_CACHE_DIR'])) <= 5
+
+
+def test_unwritable_directory_serves_from_memory(tmp_path):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')  # A file where the directory should be
+    store = AvatarStore(str(blocker / 'avatars'), memory_size=4, disk_size=10)
+    svg, etag = store.get('initials', 'AB')
+    assert svg.startswith(b'<svg')
+    assert store.get('initials', 'AB') == (svg, etag)
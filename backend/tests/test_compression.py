@@ -0,0 +1,42 @@
+"""Response compression: per-encoding ETags and `Vary` on every response."""
+import gzip
+import pytest
+from app import create_app
+from conftest import TestConfig
+
+AVATAR = '/api/avatars/adventurer/alice.svg'
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.fixture
+def client(tmp_path):
+    class AppConfig(TestConfig):
+        AVATAR_CACHE_DIR = str(tmp_path / 'avatars')
+        COMPRESS_ENABLED = True
+        COMPRESS_MIN_SIZE = 0
+
+    return create_app(AppConfig).test_client()
+
+
+def test_compressed_variant_has_a_strong_etag(client):
+    plain = client.get(AVATAR)
+    compressed = client.get(AVATAR, headers=GZIP)
+    assert compressed.content_encoding == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    etag, weak = compressed.get_etag()
+    assert not weak and etag == f'{plain.get_etag()[0]}-gzip'
+
+
+def test_compressed_variant_revalidates(client):
+    etag = client.get(AVATAR, headers=GZIP).headers['ETag']
+    response = client.get(AVATAR, headers={**GZIP, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_every_response_varies_on_encoding(client):
+    etag = client.get(AVATAR).headers['ETag']
+    for response in (client.get(AVATAR), client.get(AVATAR, headers={'If-None-Match': etag}),
+                     client.get('/api/avatars/unknown/alice.svg')):
+        assert 'Accept-Encoding' in response.vary
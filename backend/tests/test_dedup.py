@@ -0,0 +1,31 @@
+"""Near-duplicate detection from the signatures stored on write."""
+import sqlalchemy as sa
+from app import db
+from app.dedup import refresh_signatures
+from app.models import NoteSignature
+
+TEXT = 'the quick brown fox jumps over the lazy dog ' * 40
+
+
+def test_duplicates_are_found_without_writing(client, make_user, query_budget):
+    user = make_user('twins')
+    ids = [client.post('/api/notes', headers=user['headers'],
+                       json={'title': f'Copy {i}', 'content': TEXT}).json['id'] for i in range(2)]
+    client.put(f'/api/notes/{ids[1]}', headers=user['headers'], json={'content': TEXT + 'again'})
+
+    with query_budget(2) as statements:
+        response = client.get('/api/notes/duplicates', headers=user['headers'])
+    assert not [sql for sql in statements if not sql.lstrip().upper().startswith('SELECT')]
+    assert [[note['id'] for note in group['notes']] for group in response.json['groups']] == [ids]
+
+
+def test_appended_large_notes_wait_for_the_refresh(app, client, make_user):
+    user = make_user('appender')
+    note_id = client.post('/api/notes', headers=user['headers'],
+                          json={'title': 'Large', 'content': TEXT * 2}).json['id']
+    client.post(f'/api/notes/{note_id}/content', headers=user['headers'], data='More\n')
+    assert db.session.get(NoteSignature, note_id) is None
+    assert client.get('/api/notes/duplicates', headers=user['headers']).json['scanned'] == 0
+
+    assert refresh_signatures(user['id']) == 1
+    assert db.session.scalar(sa.select(sa.func.count()).select_from(NoteSignature)) == 1
@@ -0,0 +1,52 @@
+"""Size limits of archive imports."""
+import io
+import tarfile
+import zipfile
+
+
+def zip_archive(files):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    archive.seek(0)
+    return archive
+
+
+def upload(client, user, archive, name='notes.zip'):
+    return client.post('/api/notes/import', headers=user['headers'],
+                       data={'archive': (archive, name)}, content_type='multipart/form-data')
+
+
+def test_file_over_the_limit_is_rejected_before_reading_it(app, client, make_user):
+    app.config['IMPORT_MAX_FILE_SIZE'] = 1000
+    user = make_user('bomber')
+    # Compresses to about a kilobyte
+    archive = zip_archive({'small.md': '# Small', 'bomb.md': '\n' * (1 << 20)})
+    response = upload(client, user, archive)
+    assert response.status_code == 413
+    assert response.json['position'] == 0
+    assert client.get('/api/notes', headers=user['headers']).json == []
+
+
+def test_archive_over_the_total_limit_is_rejected(app, client, make_user):
+    app.config['IMPORT_MAX_SIZE'] = 1000
+    user = make_user('hoarder')
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+        for i in range(3):
+            data = b'x' * 400
+            info = tarfile.TarInfo(f'note-{i}.md')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    archive.seek(0)
+    assert upload(client, user, archive, 'notes.tar.gz').status_code == 413
+
+
+def test_upload_size_is_capped(app, client, make_user):
+    app.config['MAX_CONTENT_LENGTH'] = 1000
+    user = make_user('uploader')
+    archive = zip_archive({f'note-{i}.md': f'# Note {i}\n{i * 997}' for i in range(100)})
+    response = upload(client, user, archive)
+    assert response.status_code == 413
+    assert response.json['error'] == 'Archive too large'
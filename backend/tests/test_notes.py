@@ -0,0 +1,83 @@
+"""Validation and quota checks of the note routes."""
+import pytest
+
+
+@pytest.mark.parametrize('content', [None, 5, ['text']])
+def test_update_rejects_content_that_isnt_a_string(client, make_user, content):
+    user = make_user('editor', notes=1)
+    note_id = user['note_ids'][0]
+    response = client.put(f'/api/notes/{note_id}', headers=user['headers'],
+                          json={'content': content})
+    assert response.status_code == 400
+    assert client.get('/api/notes', headers=user['headers']).json[0]['content'].startswith('Seeded')
+
+
+@pytest.mark.parametrize('body', [{'title': 5}, {'title': None}, {'title': ['x']},
+                                  ['title'], 'title'])
+def test_update_rejects_bodies_and_titles_of_the_wrong_type(client, make_user, body):
+    user = make_user('editor', notes=1)
+    note_id = user['note_ids'][0]
+    response = client.put(f'/api/notes/{note_id}', headers=user['headers'], json=body)
+    assert response.status_code == 400
+    assert client.get('/api/notes', headers=user['headers']).json[0]['title'] == 'Note 0'
+
+
+@pytest.fixture
+def small_plan(app):
+    app.config['PLAN_QUOTAS'] = {**app.config['PLAN_QUOTAS'],
+                                 'free': {'notes': 10, 'note_bytes': 100}}
+
+
+def test_update_up_to_the_quota(client, make_user, small_plan):
+    user = make_user('saver')
+    note_id = client.post('/api/notes', headers=user['headers'],
+                          json={'title': 'Quota', 'content': 'x' * 60}).json['id']
+
+    response = client.put(f'/api/notes/{note_id}', headers=user['headers'],
+                          json={'content': 'x' * 99})
+    assert response.status_code == 200
+    assert client.get('/api/usage', headers=user['headers']).json['note_bytes'] == 99
+
+    response = client.put(f'/api/notes/{note_id}', headers=user['headers'],
+                          json={'content': 'x' * 101})
+    assert response.status_code == 403
+    assert client.get('/api/usage', headers=user['headers']).json['note_bytes'] == 99
+
+
+def test_content_revalidation(client, make_user, query_budget):
+    user = make_user('reader')
+    note_id = client.post('/api/notes', headers=user['headers'],
+                          json={'title': 'Large', 'content': 'Large note\n' * 200}).json['id']
+    url = f'/api/notes/{note_id}/content'
+    etag = client.get(url, headers=user['headers']).headers['ETag']
+
+    with query_budget(1):  # The note's metadata only, no chunk
+        response = client.get(url, headers={**user['headers'], 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+    client.post(url, headers=user['headers'], data='More\n')
+    response = client.get(url, headers={**user['headers'], 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.data.endswith(b'More\n')
+
+
+def test_large_note_history(client, make_user, query_budget):
+    user = make_user('archivist')
+    content = 'Large note\n' * 200
+    note_id = client.post('/api/notes', headers=user['headers'],
+                          json={'title': 'Large', 'content': content}).json['id']
+    url = f'/api/notes/{note_id}'
+    client.post(f'{url}/content', headers=user['headers'], data='More')
+    with query_budget(8) as statements:  # Title only: no chunk is read
+        client.put(url, headers=user['headers'], json={'title': 'Renamed'})
+    assert not any('note_chunk' in statement for statement in statements)
+    client.put(url, headers=user['headers'], json={'content': 'Edited\n' + content})
+
+    revisions = client.get(f'{url}/revisions', headers=user['headers']).json
+    assert [revision['is_snapshot'] for revision in revisions] == [False, False, False, True]
+    history = [client.get(f'{url}/revisions/{number}', headers=user['headers']).json
+               for number in range(1, 5)]
+    assert [(revision['title'], revision['content']) for revision in history] == [
+        ('Large', content), ('Large', content + 'More'), ('Renamed', content + 'More'),
+        ('Renamed', 'Edited\n' + content)]
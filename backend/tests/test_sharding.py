@@ -0,0 +1,61 @@
+"""Moving users between shards (two SQLite files)."""
+import pytest
+from app import create_app, db
+from app.rebalance import move_users
+from app.sharding import GLOBAL_TABLES, use_shard
+from app.usage import reconcile_usage
+from tests.conftest import PASSWORD, TestConfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    class AppConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "main.db"}'
+        SQLALCHEMY_BINDS = {'s1': f'sqlite:///{tmp_path / "s1.db"}'}
+        AVATAR_CACHE_DIR = str(tmp_path / 'avatars')
+
+    app = create_app(AppConfig)
+    with app.app_context():
+        db.metadata.create_all(db.engine)
+        db.metadata.create_all(db.engines['s1'], tables=[
+            table for table in db.metadata.sorted_tables if table.name not in GLOBAL_TABLES])
+    # Requests get their own app context (and `g`), as they would in production
+    return app
+
+
+def register(client, username):
+    client.post('/api/auth/register', json={
+        'username': username, 'email': f'{username}@example.com',
+        'password': PASSWORD, 'password2': PASSWORD,
+        'first_name': 'Test', 'last_name': 'User', 'gender': 'other'})
+    token = client.post('/api/auth/login', json={
+        'username': username, 'password': PASSWORD}).json['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    return client.get('/api/auth/me', headers=headers).json['id'], headers
+
+
+def test_moved_user_keeps_ids(app, client):
+    other, other_headers = register(client, 'other')
+    client.post('/api/notes', headers=other_headers, json={'title': 'Theirs', 'content': 'x'})
+    user, headers = register(client, 'mover')
+    note = client.post('/api/notes', headers=headers, json={'title': 'Mine', 'content': 'one'}).json
+    client.put(f"/api/notes/{note['id']}", headers=headers, json={'content': 'two'})
+    client.post('/api/tags/apply', headers=headers, json={'add': ['work'], 'note_ids': [note['id']]})
+    revisions = client.get(f"/api/notes/{note['id']}/revisions", headers=headers).json
+
+    with app.app_context():
+        move_users([(user, 's1')], grace=0)
+    assert [n['id'] for n in client.get('/api/notes', headers=headers).json] == [note['id']]
+    assert client.get(f"/api/notes/{note['id']}/revisions", headers=headers).json == revisions
+    new = client.post('/api/notes', headers=headers, json={'title': 'New', 'content': 'x'}).json
+    theirs = client.post('/api/notes', headers=other_headers, json={'title': 'New', 'content': 'x'}).json
+    assert len({note['id'], new['id'], theirs['id']}) == 3
+
+    # Back again: "work" is left on the old shard as a global tag
+    with app.app_context():
+        move_users([(user, 'default')], grace=0)
+    assert client.get(f"/api/notes/{note['id']}/revisions", headers=headers).json == revisions
+    with app.app_context():
+        for shard in ('default', 's1'):
+            with use_shard(shard):
+                assert reconcile_usage(fix=False) == {}
@@ -0,0 +1,34 @@
+"""Daily note rollups kept on write against those rebuilt from the tables."""
+import sqlalchemy as sa
+from app import db
+from app.models import DailyStats
+from app.stats import backfill_stats
+
+LARGE = 'Large note\n' * 200  # Over LARGE_NOTE_THRESHOLD
+
+
+def note_rollups():
+    db.session.expire_all()
+    return {(row.user_id, row.day): (row.notes_created, row.notes_updated)
+            for row in db.session.scalars(sa.select(DailyStats))}
+
+
+def test_incremental_counts_match_the_backfill(client, make_user):
+    user = make_user('counter', notes=5)
+    headers = user['headers']
+    small, chunked = user['note_ids'][0], client.post(
+        '/api/notes', headers=headers, json={'title': 'Large', 'content': LARGE}).json['id']
+    client.put(f'/api/notes/{small}', headers=headers, json={'title': 'Both', 'content': 'New'})
+    client.put(f'/api/notes/{small}', headers=headers, json={'title': 'Title only'})
+    client.put(f'/api/notes/{small}', headers=headers, json={'content': LARGE})  # Becomes chunked
+    client.put(f'/api/notes/{chunked}', headers=headers, json={'title': 'Both', 'content': LARGE * 2})
+    client.post(f'/api/notes/{chunked}/content', headers=headers, data='More\n')
+    client.put(f"/api/notes/{user['note_ids'][1]}", headers=headers, json={'group_id': None})
+    client.post('/api/sync/push', headers=headers, json={'operations': [
+        {'key': 'edit', 'op': 'update', 'type': 'note', 'id': user['note_ids'][2],
+         'data': {'title': 'Offline', 'content': LARGE}}]})
+
+    incremental = note_rollups()
+    assert incremental == {(user['id'], day): (6, 6) for _, day in incremental}
+    backfill_stats()
+    assert note_rollups() == incremental
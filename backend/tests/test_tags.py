@@ -0,0 +1,17 @@
+"""Validation of bulk tag changes."""
+import pytest
+
+
+@pytest.mark.parametrize('key', ['note_ids', 'todolist_ids'])
+def test_apply_rejects_booleans_as_ids(client, make_user, key):
+    user = make_user('tagger', notes=1)
+    response = client.post('/api/tags/apply', headers=user['headers'],
+                           json={'add': ['flagged'], key: [True]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [['flagged'], 'flagged', 1])
+def test_apply_rejects_bodies_that_are_not_objects(client, make_user, body):
+    user = make_user('tagger')
+    response = client.post('/api/tags/apply', headers=user['headers'], json=body)
+    assert response.status_code == 400
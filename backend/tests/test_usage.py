@@ -0,0 +1,18 @@
+"""Usage counters maintained by the flush hooks."""
+from app import db
+from app.models import Note, Tag, ToDoItem, ToDoList, User
+from app.usage import COUNTERS, get_usage
+
+
+def test_objects_flushed_with_their_new_owner_are_counted(app):
+    user = User(first_name='New', last_name='Owner', username='owner', email='owner@example.com',
+                password_hash='-')
+    todolist = ToDoList(title='List', author=user,
+                        items=[ToDoItem(description='Item'), ToDoItem(description='Other')])
+    db.session.add_all([user, todolist, Note(title='Note', content='Hello', author=user),
+                        Tag(name='mine', creator=user)])
+    db.session.commit()
+
+    usage = get_usage(user.id)
+    assert {name: usage[name] for name in COUNTERS} == {
+        'notes': 1, 'note_bytes': 5, 'todolists': 1, 'todo_items': 2, 'tags': 1}